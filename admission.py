@@ -0,0 +1,312 @@
+"""
+Контроль допуска запросов (включается ADMISSION_ENABLED=1).
+Защищает процесс от перегрузки до того, как запрос займет поток пула и соединение
+с базой данных:
+
+- у каждого клиента своя корзина токенов (ADMISSION_RATE запросов в секунду,
+  запас ADMISSION_BURST); клиент - пользователь из JWT токена, для запросов
+  без действительного токена (/login, /register) - IP адрес. Сверх лимита - ответ 429;
+- одновременно выполняется не более ADMISSION_MAX_CONCURRENCY запросов, из них
+  не более ADMISSION_SCAN_CONCURRENCY тяжелых (полные списки, выгрузка, загрузка);
+- запросы сверх лимита ждут в очереди своего класса; освободившееся место получает
+  запрос класса с более высоким приоритетом: auth, затем write, read, scan.
+  При переполненной очереди и после ADMISSION_QUEUE_TIMEOUT секунд ожидания - ответ 503.
+
+Ответы 429 и 503 содержат заголовок Retry-After. Лимиты действуют в пределах
+одного рабочего процесса. Состояние меняется только в цикле событий, поэтому
+блокировки не нужны.
+"""
+import asyncio
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from urllib.parse import parse_qs
+
+from jwt import InvalidTokenError
+from starlette.responses import JSONResponse
+
+from config import (
+    ADMISSION_MAX_CONCURRENCY, ADMISSION_SCAN_CONCURRENCY, ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT, ADMISSION_RATE, ADMISSION_BURST, ADMISSION_SCAN_COST,
+    ADMISSION_MAX_CLIENTS,
+)
+from tokens import keyring
+
+# Классы запросов в порядке убывания приоритета
+PRIORITY_CLASSES = ("auth", "write", "read", "scan")
+
+# Маршруты без контроля допуска: метрики, документация и долгие подписки на события
+EXEMPT_PATHS = {"/metrics", "/events", "/docs", "/redoc", "/openapi.json", "/admin/profile"}
+AUTH_PATHS = {"/login", "/register", "/logout"}
+BULK_PATHS = {"/products/bulk"}
+BULK_PREFIXES = ("/export/", "/import/")
+# Списки, которые без limit или с stream=true читают таблицу целиком
+LIST_PATHS = {"/warehouses/", "/products/", "/warehouses/summary", "/warehouses/stats"}
+
+
+def classify(method: str, path: str, query_string: bytes = b""):
+    """
+    Класс запроса (auth, write, read, scan) или None для маршрутов без контроля допуска.
+    """
+    if path in EXEMPT_PATHS:
+        return None
+    if path in AUTH_PATHS:
+        return "auth"
+    if path in BULK_PATHS or path.startswith(BULK_PREFIXES):
+        return "scan"
+    if method not in ("GET", "HEAD"):
+        return "write"
+    if path in LIST_PATHS:
+        params = parse_qs(query_string.decode("latin-1"))
+        if "limit" not in params or params.get("stream", ["false"])[-1].lower() == "true":
+            return "scan"
+    return "read"
+
+
+def client_key(scope) -> str:
+    """
+    Ключ корзины токенов: пользователь из действительного JWT токена или IP адрес клиента.
+    """
+    for name, value in scope["headers"]:
+        if name != b"authorization":
+            continue
+        scheme, _, token = value.decode("latin-1").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                return f"user:{keyring.decode(token)['uid']}"
+            except InvalidTokenError:
+                pass
+        break
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+class TokenBuckets:
+    """
+    Корзины токенов клиентов. Хранится не более max_clients корзин;
+    давно не использованные вытесняются (вытесненный клиент получает полную корзину).
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def take(self, key: str, cost: float = 1) -> float:
+        """
+        Списание cost токенов. Возвращает 0, если токенов хватило,
+        иначе время в секундах до появления нужного количества.
+        """
+        now = time.monotonic()
+        cost = min(cost, self.burst)
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class PriorityLimiter:
+    """
+    Ограничение числа одновременных запросов с очередями по классам.
+    class_limits - необязательные лимиты отдельных классов внутри общего лимита.
+    """
+
+    def __init__(self, limit: int, class_limits: dict, queue_size: int, timeout: float):
+        self.limit = limit
+        self.class_limits = class_limits
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.active_by_class = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._waiters = {request_class: deque() for request_class in PRIORITY_CLASSES}
+
+    @property
+    def waiting(self) -> int:
+        """
+        Число запросов в очередях.
+        """
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _has_slot(self, request_class: str) -> bool:
+        return self.active < self.limit and (
+            self.active_by_class[request_class]
+            < self.class_limits.get(request_class, self.limit)
+        )
+
+    def _take(self, request_class: str):
+        self.active += 1
+        self.active_by_class[request_class] += 1
+
+    def _expire(self, request_class: str, future):
+        if not future.done():
+            self._waiters[request_class].remove(future)
+            future.set_result(False)
+
+    async def acquire(self, request_class: str) -> str:
+        """
+        Получение места для запроса.
+        Возвращает admitted, shed (очередь класса заполнена) или timeout.
+        """
+        waiters = self._waiters[request_class]
+        if not waiters and self._has_slot(request_class):
+            self._take(request_class)
+            return "admitted"
+        if len(waiters) >= self.queue_size:
+            return "shed"
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiters.append(future)
+        timer = loop.call_later(self.timeout, self._expire, request_class, future)
+        try:
+            granted = await future
+        except asyncio.CancelledError:
+            # Клиент отключился: место, выданное одновременно с отменой, возвращается
+            if future.done() and not future.cancelled() and future.result():
+                self.release(request_class)
+            elif future in waiters:
+                waiters.remove(future)
+            raise
+        finally:
+            timer.cancel()
+        return "admitted" if granted else "timeout"
+
+    def release(self, request_class: str):
+        """
+        Освобождение места и передача свободных мест ожидающим в порядке приоритета.
+        """
+        self.active -= 1
+        self.active_by_class[request_class] -= 1
+        for waiting_class in PRIORITY_CLASSES:
+            waiters = self._waiters[waiting_class]
+            while waiters and self._has_slot(waiting_class):
+                future = waiters.popleft()
+                if future.done():
+                    continue
+                self._take(waiting_class)
+                future.set_result(True)
+            if self.active >= self.limit:
+                return
+
+
+class AdmissionController:
+    """
+    Проверка лимита клиента и получение места для запроса.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        scan_concurrency: int = ADMISSION_SCAN_CONCURRENCY,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        rate: float = ADMISSION_RATE,
+        burst: float = ADMISSION_BURST,
+        scan_cost: float = ADMISSION_SCAN_COST,
+        max_clients: int = ADMISSION_MAX_CLIENTS,
+    ):
+        self.limiter = PriorityLimiter(
+            max_concurrency, {"scan": scan_concurrency}, queue_size, queue_timeout
+        )
+        self.buckets = TokenBuckets(rate, burst, max_clients) if rate > 0 else None
+        self.costs = {"scan": scan_cost}
+        self.retry_after = max(1, math.ceil(queue_timeout))
+        self._outcomes = Counter()
+        self._wait = {request_class: [0, 0.0] for request_class in PRIORITY_CLASSES}
+
+    async def admit(self, key: str, request_class: str):
+        """
+        Допуск запроса класса request_class от клиента key.
+        Возвращает None, если запрос допущен (после выполнения нужен release()),
+        иначе пару (код ответа, Retry-After в секундах).
+        """
+        if self.buckets is not None:
+            wait = self.buckets.take(key, self.costs.get(request_class, 1))
+            if wait:
+                self._outcomes[request_class, "rate_limited"] += 1
+                return 429, max(1, math.ceil(wait))
+        started = time.perf_counter()
+        outcome = await self.limiter.acquire(request_class)
+        self._outcomes[request_class, outcome] += 1
+        if outcome == "shed":
+            return 503, self.retry_after
+        wait_stats = self._wait[request_class]
+        wait_stats[0] += 1
+        wait_stats[1] += time.perf_counter() - started
+        if outcome == "timeout":
+            return 503, self.retry_after
+        return None
+
+    def release(self, request_class: str):
+        """
+        Завершение допущенного запроса.
+        """
+        self.limiter.release(request_class)
+
+    def stats(self):
+        """
+        Счетчики исходов по классам, время ожидания в очереди и текущая загрузка.
+        """
+        return {
+            "in_flight": self.limiter.active,
+            "queued": self.limiter.waiting,
+            "clients": len(self.buckets) if self.buckets is not None else 0,
+            "outcomes": dict(self._outcomes),
+            "queue_wait": {
+                request_class: {"count": count, "total_seconds": total}
+                for request_class, (count, total) in self._wait.items()
+            },
+        }
+
+
+REJECTION_DETAILS = {
+    429: "Слишком много запросов, повторите попытку позже",
+    503: "Сервис перегружен, повторите попытку позже",
+}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware контроля допуска HTTP запросов.
+    Место занято до полной отправки ответа, в том числе потокового.
+    """
+
+    def __init__(self, app, controller: AdmissionController = None):
+        self.app = app
+        self.controller = controller or admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_class = classify(scope["method"], scope["path"], scope["query_string"])
+        if request_class is None:
+            await self.app(scope, receive, send)
+            return
+        rejection = await self.controller.admit(client_key(scope), request_class)
+        if rejection is not None:
+            status, retry_after = rejection
+            response = JSONResponse(
+                {"detail": REJECTION_DETAILS[status]},
+                status_code=status,
+                headers={"Retry-After": str(retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(request_class)
+
+
+admission = AdmissionController()
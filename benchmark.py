@@ -0,0 +1,748 @@
+"""
+Нагрузочный тест и бенчмарк маршрутов API.
+
+Заполняет отдельную базу SQLite данными заданного размера, выполняет запросы
+к каждому маршруту конкурентными клиентами (внутри процесса через ASGI и по HTTP
+через uvicorn), считает SQL запросы на запрос и сохраняет отчет в JSON.
+Отчет можно сравнить с сохраненным базовым отчетом:
+
+    python benchmark.py --output report.json
+    python benchmark.py --baseline report.json --threshold 0.2
+
+При регрессии больше порога скрипт завершается с кодом 1.
+
+Потоки событий не заканчиваются, поэтому для /events и /events/ws замеряется
+время до первого события. /events выполняется только через uvicorn (ASGITransport
+ждет конца ответа), /events/ws - только внутри процесса: клиента WebSocket
+в зависимостях нет, и сообщения передаются приложению напрямую по ASGI.
+POST /admin/profile не замеряется: он выключен по умолчанию и по назначению
+работает заданное число секунд.
+
+Сравнение сериализации полных списков (ORM и pydantic против кортежей и orjson)
+на 100 000 продуктов без прогона сценариев:
+
+    python benchmark.py --warehouses 100 --products 1000 --modes "" --serialization
+
+Полная выгрузка продуктов (GET /export/products) во всех форматах, с gzip и без:
+скорость и пиковая память по сравнению с полным списком GET /products/:
+
+    python benchmark.py --warehouses 100 --products 1000 --modes "" --export
+
+Время запуска: импорт main, старт приложения (миграции и прогрев) и первый
+запрос в новом процессе, без прогрева и с прогревом:
+
+    python benchmark.py --modes "" --startup
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCENARIOS = [
+    "register",
+    "login",
+    "logout",
+    "create_warehouse",
+    "list_warehouses",
+    "list_warehouses_paged",
+    "warehouse_summary",
+    "warehouses_stats",
+    "get_warehouse",
+    "warehouse_stats",
+    "create_product",
+    "bulk_products",
+    "list_products",
+    "list_products_paged",
+    "list_products_stream",
+    "search_products",
+    "update_product",
+    "adjust_product",
+    "adjust_products",
+    "export_products",
+    "import_products",
+    "events",
+    "events_ws",
+    "metrics",
+    "delete_product",
+]
+
+# Сценарии с bcrypt выполняются с меньшим количеством запросов
+SLOW_SCENARIOS = {"register", "login"}
+# Сценарии с бесконечным потоком ответа: замеряется время до первого события.
+# ASGITransport дожидается конца ответа, поэтому они выполняются только через uvicorn
+STREAM_SCENARIOS = {"events"}
+# Сценарии WebSocket выполняются только внутри процесса
+WEBSOCKET_SCENARIOS = {"events_ws"}
+
+
+def parse_args(argv=None):
+    """
+    Разбор аргументов командной строки.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--warehouses", type=int, default=20)
+    parser.add_argument("--products", type=int, default=50, help="продуктов на склад")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--modes", default="inprocess,uvicorn",
+                        help="режимы через запятую: inprocess, uvicorn")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--database", help="файл базы SQLite (по умолчанию временный)")
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="отключить кэш сериализованных ответов")
+    parser.add_argument("--group-commit", action="store_true",
+                        help="включить групповую фиксацию изменений")
+    parser.add_argument("--serialization", action="store_true",
+                        help="сравнить сериализацию полных списков складов и продуктов")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="повторов сравнения сериализации и замеров запуска")
+    parser.add_argument("--export", action="store_true",
+                        help="измерить полную выгрузку продуктов во всех форматах")
+    parser.add_argument("--startup", action="store_true",
+                        help="измерить импорт, запуск приложения и первый запрос")
+    parser.add_argument("--output", help="файл для сохранения отчета")
+    parser.add_argument("--baseline", help="базовый отчет для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="допустимая относительная регрессия (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """
+    Настройка окружения до импорта приложения: отдельная база и кэш ответов.
+    """
+    database = args.database or os.path.join(
+        tempfile.mkdtemp(prefix="warehouse-bench-"), "bench.db"
+    )
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    if args.no_response_cache:
+        os.environ["RESPONSE_CACHE_BACKEND"] = "none"
+    if args.group_commit:
+        os.environ["GROUP_COMMIT_ENABLED"] = "1"
+    return database
+
+
+class QueryCounter:
+    """
+    Счетчик SQL запросов через события движка SQLAlchemy.
+    """
+
+    def __init__(self, engine):
+        # pylint: disable=import-outside-toplevel
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def reset(self):
+        """
+        Обнуление счетчика.
+        """
+        with self._lock:
+            self.count = 0
+
+
+def seed(args):
+    """
+    Заполнение базы складами, продуктами и пользователями.
+    Возвращает заголовок авторизации, списки id и функцию выпуска нового токена.
+    """
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import insert
+
+    import crud
+    from database import SessionLocal, engine
+    from hashing import get_pwd_context
+    from migrations import migrate, refresh_warehouse_stock
+    from models import User, Warehouse, Product
+
+    migrate(engine)
+    db = SessionLocal()
+    try:
+        password = get_pwd_context().hash("benchpassword")
+        db.execute(insert(User), [
+            {"username": f"bench{i}", "password": password} for i in range(args.users)
+        ])
+        db.execute(insert(Warehouse), [
+            {"name": f"Warehouse {i}", "location": f"Location {i}"}
+            for i in range(args.warehouses)
+        ])
+        warehouse_ids = [warehouse_id for (warehouse_id,) in db.query(Warehouse.id)]
+        db.execute(insert(Product), [
+            {"name": f"Product {w}-{p}", "quantity": 1000, "warehouse_id": warehouse_id}
+            for w, warehouse_id in enumerate(warehouse_ids)
+            for p in range(args.products)
+        ])
+        refresh_warehouse_stock(db)
+        db.commit()
+        product_ids = [product_id for (product_id,) in db.query(Product.id).order_by(Product.id)]
+        user = db.query(User).first()
+        token = crud.create_jwt_token(user)
+    finally:
+        db.close()
+    return (
+        {"Authorization": f"Bearer {token}"}, warehouse_ids, product_ids,
+        lambda: crud.create_jwt_token(user),
+    )
+
+
+def build_request(scenario: str, index: int, context: dict):
+    """
+    Параметры запроса сценария: метод, путь и аргументы httpx.
+    """
+    headers = context["headers"]
+    warehouse_ids = context["warehouse_ids"]
+    product_ids = context["product_ids"]
+    warehouse_id = warehouse_ids[index % len(warehouse_ids)]
+    product_id = product_ids[index % len(product_ids)]
+    run = context["run"]
+    if scenario == "register":
+        return "POST", "/register", {
+            "json": {"username": f"new-{run}-{index}", "password": "benchpassword"}
+        }
+    if scenario == "login":
+        return "POST", "/login", {
+            "json": {"username": f"bench{index % context['users']}", "password": "benchpassword"}
+        }
+    if scenario == "logout":
+        # Выход отзывает токен, поэтому каждый запрос выполняется со своим токеном
+        return "POST", "/logout", {
+            "headers": {"Authorization": f"Bearer {context['issue_token']()}"}
+        }
+    if scenario == "create_warehouse":
+        return "POST", "/warehouses/", {
+            "json": {"name": f"Bench {run}-{index}", "location": "Bench"}, "headers": headers
+        }
+    if scenario == "list_warehouses":
+        return "GET", "/warehouses/", {"headers": headers}
+    if scenario == "list_warehouses_paged":
+        return "GET", f"/warehouses/?limit=10&after={index % len(warehouse_ids)}", {
+            "headers": headers
+        }
+    if scenario == "warehouse_summary":
+        return "GET", "/warehouses/summary", {"headers": headers}
+    if scenario == "warehouses_stats":
+        return "GET", "/warehouses/stats", {"headers": headers}
+    if scenario == "warehouse_stats":
+        return "GET", f"/warehouses/{warehouse_id}/stats", {"headers": headers}
+    if scenario == "get_warehouse":
+        return "GET", f"/warehouses/{warehouse_id}", {"headers": headers}
+    if scenario == "create_product":
+        return "POST", "/products/", {
+            "json": {"name": f"Bench {run}-{index}", "quantity": 1, "warehouse_id": warehouse_id},
+            "headers": headers,
+        }
+    if scenario == "bulk_products":
+        return "POST", "/products/bulk", {
+            "json": [
+                {"name": f"Bulk {run}-{index}-{i}", "quantity": 1, "warehouse_id": warehouse_id}
+                for i in range(100)
+            ],
+            "headers": headers,
+        }
+    if scenario == "list_products":
+        return "GET", "/products/", {"headers": headers}
+    if scenario == "list_products_paged":
+        return "GET", f"/products/?limit=100&after={product_id}", {"headers": headers}
+    if scenario == "list_products_stream":
+        return "GET", f"/products/?stream=true&warehouse_id={warehouse_id}", {"headers": headers}
+    if scenario == "search_products":
+        # Префиксы слов названий "Product {склад}-{продукт}": совпадает часть продуктов
+        return "GET", f"/products/search?q=product+{index % len(warehouse_ids)}&limit=20", {
+            "headers": headers
+        }
+    if scenario == "update_product":
+        return "PUT", f"/products/{product_id}", {
+            "json": {"name": f"Updated {index}", "quantity": 500, "warehouse_id": warehouse_id},
+            "headers": headers,
+        }
+    if scenario == "adjust_product":
+        return "POST", f"/products/{product_id}/adjust", {
+            "json": {"delta": -1 if index % 2 else 1}, "headers": headers
+        }
+    if scenario == "adjust_products":
+        return "POST", "/products/adjust", {
+            "json": [
+                {"product_id": product_ids[(index + i) % len(product_ids)], "delta": 1}
+                for i in range(5)
+            ],
+            "headers": headers,
+        }
+    if scenario == "export_products":
+        return "GET", "/export/products", {"headers": headers}
+    if scenario == "import_products":
+        # Восстановление 100 существующих продуктов из NDJSON выгрузки
+        lines = [
+            json.dumps({
+                "id": product_ids[(index * 100 + i) % len(product_ids)],
+                "name": f"Imported {run}-{index}-{i}",
+                "quantity": 1000,
+                "warehouse_id": warehouse_id,
+            })
+            for i in range(100)
+        ]
+        return "POST", "/import/products", {
+            "content": "\n".join(lines),
+            "headers": {**headers, "Content-Type": "application/x-ndjson"},
+        }
+    if scenario == "events":
+        # Подписка с начала истории: первыми приходят события предыдущих сценариев
+        return "GET", "/events?after=0", {"headers": headers}
+    if scenario == "events_ws":
+        token = headers["Authorization"].split(" ", 1)[1]
+        return "WEBSOCKET", f"/events/ws?token={token}&after=0", {}
+    if scenario == "metrics":
+        return "GET", "/metrics", {}
+    if scenario == "delete_product":
+        # Удаляем продукты с конца, чтобы не мешать остальным сценариям;
+        # повторные прогоны продолжают с еще не удаленных продуктов
+        position = -1 - (context["deleted"] + index) % len(product_ids)
+        return "DELETE", f"/products/{product_ids[position]}", {
+            "headers": headers
+        }
+    raise ValueError(f"Неизвестный сценарий: {scenario}")
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга.
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+async def websocket_first_message(app, url: str, timeout: float = 60) -> bool:
+    """
+    Подключение к WebSocket маршруту приложения напрямую через ASGI и ожидание
+    первого сообщения. Возвращает False, если соединение закрыто без сообщений.
+    """
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "websocket",
+        "asgi": {"version": "3.0"},
+        "scheme": "ws",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+        "subprotocols": [],
+    }
+    incoming = asyncio.Queue()
+    incoming.put_nowait({"type": "websocket.connect"})
+    received = asyncio.get_running_loop().create_future()
+
+    async def send(message):
+        if message["type"] in ("websocket.send", "websocket.close") and not received.done():
+            received.set_result(message["type"] == "websocket.send")
+
+    task = asyncio.ensure_future(app(scope, incoming.get, send))
+    try:
+        await asyncio.wait({received, task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        return received.done() and received.result()
+    finally:
+        # Подписка завершается отменой обработчика, как при разрыве соединения
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def run_scenario(client, scenario: str, requests: int, concurrency: int, context: dict):
+    """
+    Выполнение сценария конкурентными клиентами и расчет метрик.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(index):
+        nonlocal errors
+        method, url, kwargs = build_request(scenario, index, context)
+        async with semaphore:
+            started = time.perf_counter()
+            if scenario in WEBSOCKET_SCENARIOS:
+                failed = not await websocket_first_message(context["app"], url)
+            elif scenario in STREAM_SCENARIOS:
+                async with client.stream(method, url, **kwargs) as response:
+                    async for _ in response.aiter_bytes():
+                        break
+                failed = response.status_code >= 400
+            else:
+                response = await client.request(method, url, **kwargs)
+                await response.aread()
+                failed = response.status_code >= 400
+            latencies.append(time.perf_counter() - started)
+        if failed:
+            errors += 1
+
+    context["queries"].reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "queries_per_request": round(context["queries"].count / requests, 2),
+    }
+
+
+def free_port() -> int:
+    """
+    Свободный TCP порт на localhost.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class UvicornThread:
+    """
+    Сервер uvicorn в фоновом потоке того же процесса,
+    чтобы счетчик SQL запросов видел запросы сервера.
+    """
+
+    def __init__(self, app):
+        # pylint: disable=import-outside-toplevel
+        import uvicorn
+
+        self.port = free_port()
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def run_mode(mode: str, app, scenarios: list, args, context: dict):
+    """
+    Прогон всех сценариев в одном режиме.
+    """
+    # pylint: disable=import-outside-toplevel
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async def run_all(client):
+        results = {}
+        for scenario in scenarios:
+            if mode == "inprocess" and scenario in STREAM_SCENARIOS:
+                continue
+            if mode != "inprocess" and scenario in WEBSOCKET_SCENARIOS:
+                continue
+            context["run"] = f"{mode}-{scenario}"
+            requests = max(1, args.requests // 10) if scenario in SLOW_SCENARIOS else args.requests
+            results[f"{mode}:{scenario}"] = await run_scenario(
+                client, scenario, requests, args.concurrency, context
+            )
+            if scenario == "delete_product":
+                context["deleted"] += requests
+            print(f"{mode:10} {scenario:24} {results[f'{mode}:{scenario}']}", file=sys.stderr)
+        return results
+
+    if mode == "inprocess":
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_all(client)
+    if mode == "uvicorn":
+        with UvicornThread(app) as base_url:
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+                return await run_all(client)
+    raise ValueError(f"Неизвестный режим: {mode}")
+
+
+def benchmark_serialization(repeat: int) -> dict:
+    """
+    Сравнение сериализации полных списков продуктов и складов:
+    ORM объекты с проверкой pydantic против кортежей столбцов и orjson.
+    Для каждого способа берется лучшее время из repeat повторов.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pydantic import TypeAdapter
+
+    import crud
+    import schemas
+    import serializers
+    from database import SessionLocal
+
+    def validated(schema, objects):
+        adapter = TypeAdapter(schema)
+        return adapter.dump_json(adapter.validate_python(objects, from_attributes=True))
+
+    def fast_warehouses(db):
+        warehouses = crud.get_warehouse_rows(db).all()
+        products = crud.get_warehouse_product_rows(db, [row.id for row in warehouses])
+        return serializers.warehouses_json(warehouses, products)
+
+    cases = {
+        "products": (
+            lambda db: validated(list[schemas.Product], crud.get_products(db).all()),
+            lambda db: serializers.products_json(crud.get_product_rows(db).all()),
+        ),
+        "warehouses": (
+            lambda db: validated(list[schemas.Warehouse], crud.get_warehouses(db).all()),
+            fast_warehouses,
+        ),
+    }
+    results = {}
+    for name, (pydantic_path, fast_path) in cases.items():
+        timings, bodies = {}, {}
+        for label, path in (("pydantic", pydantic_path), ("fast", fast_path)):
+            best = float("inf")
+            for _ in range(repeat):
+                db = SessionLocal()
+                try:
+                    started = time.perf_counter()
+                    bodies[label] = path(db)
+                    best = min(best, time.perf_counter() - started)
+                finally:
+                    db.close()
+            timings[label] = best
+        results[name] = {
+            "bytes": len(bodies["fast"]),
+            "identical": bodies["fast"] == bodies["pydantic"],
+            "pydantic_ms": round(timings["pydantic"] * 1000, 1),
+            "fast_ms": round(timings["fast"] * 1000, 1),
+            "speedup": round(timings["pydantic"] / timings["fast"], 2),
+        }
+        print(f"serialization {name:12} {results[name]}", file=sys.stderr)
+    return results
+
+
+def benchmark_export(repeat: int) -> dict:
+    """
+    Полная выгрузка продуктов во всех форматах: лучшее время из repeat повторов,
+    объем, скорость и пиковая память Python (tracemalloc, отдельным проходом).
+    Для сравнения измеряется сериализация полного списка, как в GET /products/.
+    """
+    # pylint: disable=import-outside-toplevel
+    import tracemalloc
+
+    import crud
+    import export
+    import serializers
+    from config import EXPORT_BATCH_SIZE, EXPORT_GZIP_LEVEL
+    from database import SessionLocal
+
+    def exported(export_format, gzip):
+        def run(db):
+            chunks = export.encode(
+                export_format, "products", crud.export_batches(db, "products", EXPORT_BATCH_SIZE)
+            )
+            if gzip:
+                chunks = export.gzip_chunks(chunks, EXPORT_GZIP_LEVEL)
+            return sum(len(chunk) for chunk in chunks)
+        return run
+
+    cases = {"list": lambda db: len(serializers.products_json(crud.get_product_rows(db).all()))}
+    for export_format in export.FORMATS:
+        cases[export_format] = exported(export_format, False)
+        cases[f"{export_format}_gzip"] = exported(export_format, True)
+
+    db = SessionLocal()
+    try:
+        rows = crud.get_products(db).count()
+    finally:
+        db.close()
+    results = {}
+    for name, run in cases.items():
+        best = float("inf")
+        for attempt in range(repeat + 1):
+            db = SessionLocal()
+            try:
+                if attempt == repeat:
+                    tracemalloc.start()
+                    run(db)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    continue
+                started = time.perf_counter()
+                size = run(db)
+                best = min(best, time.perf_counter() - started)
+            finally:
+                db.close()
+        results[name] = {
+            "bytes": size,
+            "ms": round(best * 1000, 1),
+            "rows_per_second": round(rows / best),
+            "mb_per_second": round(size / best / 1e6, 1),
+            "peak_memory_mb": round(peak / 1e6, 1),
+        }
+        print(f"export {name:14} {results[name]}", file=sys.stderr)
+    return results
+
+
+# Запуск приложения в отдельном процессе: время импорта main, старта (lifespan)
+# и первого запроса с токеном первого пользователя, в миллисекундах
+STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+from tokens import keyring, issue_claims
+client = TestClient(main.app)
+before_startup = time.perf_counter()
+with client:
+    ready = time.perf_counter()
+    headers = {"Authorization": "Bearer " + keyring.encode(issue_claims(1, "bench0"))}
+    response = client.get("/warehouses/summary", headers=headers)
+    answered = time.perf_counter()
+assert response.status_code == 200, response.text
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "lifespan_ms": (ready - before_startup) * 1000,
+    "first_request_ms": (answered - ready) * 1000,
+}))
+"""
+
+
+def benchmark_startup(repeat: int) -> dict:
+    """
+    Время запуска в новых процессах без прогрева и с прогревом.
+    Для каждой величины берется медиана из repeat запусков.
+    """
+    results = {}
+    for name, warmup in (("cold", "0"), ("warmup", "1")):
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=dict(os.environ, WARMUP_ENABLED=warmup),
+                capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[name] = {
+            key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]
+        }
+        print(f"startup {name:7} {results[name]}", file=sys.stderr)
+    return results
+
+
+def compare_reports(current: dict, baseline: dict, threshold: float) -> list:
+    """
+    Сравнение отчета с базовым.
+    Регрессия: падение rps или рост p99 больше порога, либо заметный рост числа
+    SQL запросов на запрос (небольшие колебания дают промахи кэшей при старте сценария).
+    Для времени запуска регрессией считается рост больше порога.
+    """
+    regressions = []
+    for name, base in baseline.get("startup", {}).items():
+        for key, base_ms in base.items():
+            current_ms = current.get("startup", {}).get(name, {}).get(key)
+            if current_ms is not None and current_ms > base_ms * (1 + threshold):
+                regressions.append(f"startup {name} {key}: {base_ms}ms -> {current_ms}ms")
+    for key, base in baseline.get("results", {}).items():
+        result = current.get("results", {}).get(key)
+        if result is None:
+            continue
+        if base["rps"] and result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{key}: rps {base['rps']} -> {result['rps']}")
+        if base["p99_ms"] and result["p99_ms"] > base["p99_ms"] * (1 + threshold):
+            regressions.append(f"{key}: p99 {base['p99_ms']}ms -> {result['p99_ms']}ms")
+        allowed_queries = max(0.5, base["queries_per_request"] * threshold)
+        if result["queries_per_request"] > base["queries_per_request"] + allowed_queries:
+            regressions.append(
+                f"{key}: queries/request {base['queries_per_request']} "
+                f"-> {result['queries_per_request']}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    """
+    Точка входа бенчмарка.
+    """
+    args = parse_args(argv)
+    database = configure_environment(args)
+
+    # pylint: disable=import-outside-toplevel
+    from main import app
+    from database import engine
+    from group_commit import group_writer
+
+    headers, warehouse_ids, product_ids, issue_token = seed(args)
+    context = {
+        "app": app,
+        "headers": headers,
+        "warehouse_ids": warehouse_ids,
+        "product_ids": product_ids,
+        "issue_token": issue_token,
+        "users": args.users,
+        "deleted": 0,
+        "queries": QueryCounter(engine),
+    }
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    results = {}
+    if args.group_commit:
+        # В режиме inprocess lifespan приложения не выполняется
+        group_writer.start()
+    for mode in [name for name in args.modes.split(",") if name]:
+        results.update(asyncio.run(run_mode(mode, app, scenarios, args, context)))
+    group_writer.stop()
+
+    report = {
+        "meta": {
+            "warehouses": args.warehouses,
+            "products_per_warehouse": args.products,
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "response_cache": not args.no_response_cache,
+            "group_commit": args.group_commit,
+            "python": platform.python_version(),
+            "database": database,
+        },
+        "results": results,
+    }
+    if args.serialization:
+        report["serialization"] = benchmark_serialization(args.repeat)
+    if args.export:
+        report["export"] = benchmark_export(args.repeat)
+    if args.startup:
+        report["startup"] = benchmark_startup(args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = compare_reports(report, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
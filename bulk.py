@@ -0,0 +1,203 @@
+"""
+Модуль разбора данных массовой загрузки продуктов и складов.
+Поддерживает JSON массив, а также потоковые NDJSON, CSV и двоичный формат выгрузки
+(export.py) без чтения всего тела в память. Тело может быть сжато gzip
+(заголовок Content-Encoding: gzip).
+"""
+import csv
+import json
+import zlib
+
+from fastapi import Request
+from pydantic import ValidationError
+
+from export import COLUMNAR_TYPE, ColumnarDecoder, ColumnarFormatError
+from schemas import ProductBulkItem, WarehouseBulkItem
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+CSV_TYPES = ("text/csv", "application/csv")
+# Наибольший объем распакованных данных за один шаг распаковки gzip
+MAX_INFLATE_CHUNK = 1 << 20
+
+
+class BulkFormatError(Exception):
+    """
+    Исключение при неподдерживаемом или поврежденном формате тела запроса.
+    """
+
+
+async def _iter_body(request: Request):
+    """
+    Чтение тела запроса порциями с потоковой распаковкой gzip.
+    """
+    encoding = request.headers.get("content-encoding", "identity").strip().lower()
+    if encoding == "identity":
+        async for chunk in request.stream():
+            yield chunk
+        return
+    if encoding != "gzip":
+        raise BulkFormatError(f"Неподдерживаемое сжатие: {encoding}")
+    decompressor = zlib.decompressobj(wbits=31)
+    try:
+        async for chunk in request.stream():
+            data = decompressor.decompress(chunk, MAX_INFLATE_CHUNK)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, MAX_INFLATE_CHUNK)
+        yield decompressor.flush()
+    except zlib.error as exc:
+        raise BulkFormatError(f"Некорректные данные gzip: {exc}") from exc
+
+
+def _decode_line(line: bytes) -> str:
+    try:
+        return line.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError as exc:
+        raise BulkFormatError(f"Некорректная кодировка UTF-8: {exc}") from exc
+
+
+async def _iter_lines(chunks):
+    """
+    Построчное чтение тела запроса по мере поступления данных.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield _decode_line(line)
+    if buffer:
+        yield _decode_line(buffer)
+
+
+async def _iter_ndjson(chunks):
+    """
+    Разбор NDJSON: одна JSON запись на строку, пустые строки пропускаются.
+    """
+    index = 0
+    async for line in _iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            yield index, json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield index, exc
+        index += 1
+
+
+async def _iter_csv(chunks):
+    """
+    Разбор CSV с заголовком (для продуктов name,quantity,warehouse_id[,id]).
+    Значения в кавычках могут содержать переводы строк.
+    """
+    header = None
+    index = 0
+    pending = ""
+    async for line in _iter_lines(chunks):
+        if pending:
+            line = f"{pending}\n{line}"
+        # Нечетное число кавычек: строка продолжается в следующей строке файла
+        if line.count('"') % 2:
+            pending = line
+            continue
+        pending = ""
+        if not line.strip():
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        record = dict(zip(header, values))
+        if record.get("id") == "":
+            record["id"] = None
+        yield index, record
+        index += 1
+    if pending:
+        yield index, ValueError("незакрытая кавычка")
+
+
+async def _iter_columnar(chunks):
+    """
+    Разбор двоичного формата выгрузки по мере поступления блоков.
+    """
+    decoder = ColumnarDecoder()
+    index = 0
+    try:
+        async for chunk in chunks:
+            for record in decoder.feed(chunk):
+                yield index, record
+                index += 1
+        decoder.close()
+    except ColumnarFormatError as exc:
+        raise BulkFormatError(str(exc)) from exc
+
+
+async def iter_records(request: Request):
+    """
+    Асинхронный генератор пар (номер строки, запись) в зависимости от Content-Type.
+    Вместо записи может возвращаться исключение разбора этой строки.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    chunks = _iter_body(request)
+    if content_type in NDJSON_TYPES:
+        async for item in _iter_ndjson(chunks):
+            yield item
+    elif content_type in CSV_TYPES:
+        async for item in _iter_csv(chunks):
+            yield item
+    elif content_type == COLUMNAR_TYPE:
+        async for item in _iter_columnar(chunks):
+            yield item
+    elif content_type in ("", "application/json"):
+        try:
+            records = json.loads(b"".join([chunk async for chunk in chunks]))
+        except UnicodeDecodeError as exc:
+            raise BulkFormatError(f"Некорректная кодировка UTF-8: {exc}") from exc
+        except json.JSONDecodeError as exc:
+            raise BulkFormatError(f"Некорректный JSON: {exc}") from exc
+        if not isinstance(records, list):
+            raise BulkFormatError("Ожидается JSON массив продуктов")
+        for index, record in enumerate(records):
+            yield index, record
+    else:
+        raise BulkFormatError(f"Неподдерживаемый тип содержимого: {content_type}")
+
+
+def _validate(schema, record):
+    """
+    Проверка записи по схеме.
+    Возвращает модель или строку с описанием ошибки.
+    """
+    if isinstance(record, Exception):
+        return f"Некорректная строка: {record}"
+    try:
+        return schema.model_validate(record)
+    except ValidationError as exc:
+        return "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in exc.errors()
+        )
+
+
+def validate_record(record, warehouse_ids: set):
+    """
+    Проверка записи и существования склада по заранее загруженному множеству id.
+    Возвращает словарь значений для вставки или строку с описанием ошибки.
+    """
+    item = _validate(ProductBulkItem, record)
+    if isinstance(item, str):
+        return item
+    if item.warehouse_id not in warehouse_ids:
+        return "Склад не найден"
+    return item.model_dump()
+
+
+def validate_warehouse_record(record):
+    """
+    Проверка записи склада.
+    Возвращает словарь значений для записи или строку с описанием ошибки.
+    """
+    item = _validate(WarehouseBulkItem, record)
+    if isinstance(item, str):
+        return item
+    return item.model_dump()
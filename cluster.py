@@ -0,0 +1,230 @@
+"""
+Согласование состояния нескольких рабочих процессов uvicorn.
+Кэши, версии данных для ETag и шина событий хранятся в памяти каждого процесса.
+Функции записи в crud.py сообщают об изменениях через cluster.emit(): изменение
+записывается в общий канал - файл SQLite, который остальные процессы опрашивают
+в фоновом потоке, и применяется в текущем процессе. Внешние сервисы не нужны.
+
+Номер сообщения в канале общий для всех процессов. Обработчик изменения получает
+его через cluster.sequence, а получатели, зарегистрированные add_listener(),
+узнают о каждом примененном сообщении (так шина событий нумерует события
+одинаково во всех процессах).
+"""
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import CLUSTER_CHANNEL_PATH, CLUSTER_POLL_SECONDS, CLUSTER_RETENTION_SECONDS
+
+logger = logging.getLogger("warehouse.cluster")
+
+
+class InvalidationChannel:
+    """
+    Канал сообщений между процессами на одной машине в файле SQLite.
+    Каждый процесс читает сообщения с номерами больше последнего прочитанного
+    и пропускает собственные сообщения.
+    """
+
+    def __init__(
+        self,
+        path: str = CLUSTER_CHANNEL_PATH,
+        retention: float = CLUSTER_RETENTION_SECONDS,
+    ):
+        self.path = path
+        self.retention = retention
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.published = 0
+        self.received = 0
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, kind TEXT, "
+            "payload TEXT, created REAL)"
+        )
+        # Сообщения, записанные до запуска процесса, уже отражены в базе данных
+        self.last_seq = connection.execute(
+            "SELECT coalesce(max(seq), 0) FROM messages"
+        ).fetchone()[0]
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def publish(self, kind: str, payload: dict) -> int:
+        """
+        Запись сообщения для остальных процессов.
+        Возвращает номер сообщения в канале.
+        """
+        connection = self._connection()
+        cursor = connection.execute(
+            "INSERT INTO messages (origin, kind, payload, created) VALUES (?, ?, ?, ?)",
+            (self.origin, kind, json.dumps(payload), time.time()),
+        )
+        self.published += 1
+        return cursor.lastrowid
+
+    def receive(self):
+        """
+        Новые сообщения других процессов в виде троек (seq, kind, payload)
+        и номера сообщений, удаленных до чтения (процесс отстал больше чем на retention).
+        Заодно удаляются сообщения старше retention секунд.
+        """
+        connection = self._connection()
+        rows = connection.execute(
+            "SELECT seq, origin, kind, payload FROM messages WHERE seq > ? ORDER BY seq",
+            (self.last_seq,),
+        ).fetchall()
+        messages, missing = [], []
+        for seq, origin, kind, payload in rows:
+            missing.extend(range(self.last_seq + 1, seq))
+            self.last_seq = seq
+            if origin != self.origin:
+                messages.append((seq, kind, json.loads(payload)))
+        self.received += len(messages)
+        connection.execute(
+            "DELETE FROM messages WHERE created < ?", (time.time() - self.retention,)
+        )
+        return messages, missing
+
+
+class Cluster:
+    """
+    Реестр обработчиков изменений состояния и фоновый поток чтения канала.
+    Без канала (один процесс) emit() только применяет изменение локально.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.channel = None
+        # Номер сообщения канала, которое применяет текущий поток (None - без канала)
+        self.sequence = contextvars.ContextVar("cluster_sequence", default=None)
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def handler(self, kind: str):
+        """
+        Декоратор регистрации функции, применяющей изменение в текущем процессе.
+        Аргументы функции должны сериализоваться в JSON.
+        """
+        def register(func):
+            self.handlers[kind] = func
+            return func
+        return register
+
+    def add_listener(self, listener):
+        """
+        Регистрация получателя номеров сообщений. Получатель вызывается:
+        cluster_started(last_seq) при подключении канала, message_applied(seq)
+        после применения каждого сообщения канала и cluster_stopped() при отключении.
+        """
+        self._listeners.append(listener)
+
+    def _message_applied(self, seq: int):
+        for listener in self._listeners:
+            listener.message_applied(seq)
+
+    def _apply(self, seq: int, kind: str, payload: dict):
+        token = self.sequence.set(seq)
+        try:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                logger.warning("Неизвестное сообщение канала процессов: %s", kind)
+                return
+            handler(**payload)
+        finally:
+            self.sequence.reset(token)
+            self._message_applied(seq)
+
+    def emit(self, kind: str, **payload):
+        """
+        Рассылка изменения остальным процессам и применение в текущем процессе.
+        """
+        channel = self.channel
+        if channel is None:
+            self.handlers[kind](**payload)
+            return
+        try:
+            seq = channel.publish(kind, payload)
+        except sqlite3.Error:
+            logger.exception("Не удалось отправить сообщение %s в канал процессов", kind)
+            self.handlers[kind](**payload)
+            return
+        self._apply(seq, kind, payload)
+
+    def apply_pending(self):
+        """
+        Применение сообщений, полученных от остальных процессов.
+        Ошибка одного обработчика не мешает применению следующих сообщений.
+        """
+        messages, missing = self.channel.receive()
+        for seq in missing:
+            self._message_applied(seq)
+        for seq, kind, payload in messages:
+            try:
+                self._apply(seq, kind, payload)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Ошибка применения сообщения %s канала процессов", kind)
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.apply_pending()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Ошибка чтения канала процессов")
+
+    def start(self, channel: InvalidationChannel = None, interval: float = CLUSTER_POLL_SECONDS):
+        """
+        Подключение канала и запуск фонового чтения в текущем процессе.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.channel = channel or InvalidationChannel()
+        for listener in self._listeners:
+            listener.cluster_started(self.channel.last_seq)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="cluster-channel", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Остановка фонового чтения и отключение канала.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.channel is not None:
+            for listener in self._listeners:
+                listener.cluster_stopped()
+        self.channel = None
+
+    def stats(self):
+        """
+        Счетчики отправленных и полученных сообщений.
+        """
+        channel = self.channel
+        return {
+            "enabled": channel is not None,
+            "published": channel.published if channel else 0,
+            "received": channel.received if channel else 0,
+        }
+
+
+cluster = Cluster()
+
@@ -0,0 +1,358 @@
+"""
+Сжатие ответов с согласованием кодировки по заголовку Accept-Encoding
+(включено по умолчанию, COMPRESSION_ENABLED=0 отключает).
+
+Поддерживаются gzip, а при установленных пакетах brotli и zstandard - br и zstd;
+из принимаемых клиентом кодировок выбирается кодировка с наибольшим q,
+при равных q - первая в COMPRESSION_ENCODINGS. Сжимаются только текстовые
+типы содержимого (JSON, NDJSON, CSV, текст, HTML) от COMPRESSION_MIN_SIZE байт.
+Уровень сжатия зависит от размера тела: небольшие тела сжимаются сильнее,
+большие - быстрее. Большие тела сжимаются в пуле потоков, чтобы не занимать
+цикл событий.
+
+Потоковые ответы (stream=true, выгрузка) сжимаются по частям: после каждой
+части сжатый поток сбрасывается, и клиент получает данные без задержки.
+
+Сжатые тела ответов с ETag (списки и карточки из кэша ответов) сохраняются
+в кэше с ключом (ETag, кодировка). ETag меняется вместе с версией данных,
+поэтому повторные запросы неизмененного списка не сжимаются заново.
+Ответы с заголовком Content-Encoding (выгрузка с gzip=true) не изменяются.
+"""
+import zlib
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import (
+    COMPRESSION_ENCODINGS, COMPRESSION_MIN_SIZE, COMPRESSION_CACHE_BYTES,
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Кодировки, доступные в текущем окружении
+AVAILABLE_ENCODINGS = {"gzip"}
+if brotli is not None:
+    AVAILABLE_ENCODINGS.add("br")
+if zstandard is not None:
+    AVAILABLE_ENCODINGS.add("zstd")
+
+# Уровни сжатия по размеру тела: (наибольший размер в байтах, уровень);
+# последний уровень используется и для потоковых ответов неизвестного размера
+LEVELS = {
+    "gzip": ((64 * 1024, 6), (1024 * 1024, 4), (None, 1)),
+    "br": ((64 * 1024, 6), (1024 * 1024, 4), (None, 1)),
+    "zstd": ((64 * 1024, 9), (1024 * 1024, 6), (None, 3)),
+}
+# Поток событий (text/event-stream) не сжимается
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html",
+)
+# Тела больше этого размера сжимаются в пуле потоков
+THREAD_MIN_SIZE = 64 * 1024
+
+
+def negotiate(accept_encoding: str, encodings) -> str:
+    """
+    Кодировка ответа из заголовка Accept-Encoding или None, если сжимать не нужно.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def choose_level(encoding: str, size: int = None) -> int:
+    """
+    Уровень сжатия для тела размера size (None - потоковый ответ).
+    """
+    levels = LEVELS[encoding]
+    if size is not None:
+        for limit, level in levels:
+            if limit is None or size <= limit:
+                return level
+    return levels[-1][1]
+
+
+class StreamCompressor:
+    """
+    Потоковое сжатие в кодировке encoding.
+    """
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Сжатие очередной части и сброс сжатого потока: клиент может разобрать
+        все данные, полученные к этому моменту.
+        """
+        compressor = self._compressor
+        if self.encoding == "gzip":
+            return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return compressor.process(data) + compressor.flush()
+        return compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        """
+        Сжатие последней части и завершение потока.
+        """
+        compressor = self._compressor
+        if self.encoding == "br":
+            return compressor.process(data) + compressor.finish()
+        return compressor.compress(data) + compressor.flush()
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    """
+    Сжатие тела целиком с уровнем по его размеру.
+    """
+    return StreamCompressor(encoding, choose_level(encoding, len(body))).finish(body)
+
+
+class CompressedCache:
+    """
+    LRU кэш сжатых тел с ключом (ETag, кодировка) и ограничением общего объема.
+    Используется только из цикла событий, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, max_bytes: int = COMPRESSION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Сжатое тело или None.
+        """
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def set(self, key, body: bytes):
+        """
+        Сохранение сжатого тела с вытеснением давно не использованных.
+        """
+        if len(body) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self):
+        """
+        Очистка кэша.
+        """
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """
+        Счетчики попаданий и промахов, число записей и объем в байтах.
+        """
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "size": len(self._entries), "bytes": self.size,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+async def _run(func, *args, size: int = 0):
+    if size > THREAD_MIN_SIZE:
+        return await run_in_threadpool(func, *args)
+    return func(*args)
+
+
+def _compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return (
+        "content-encoding" not in headers
+        and "no-transform" not in headers.get("cache-control", "")
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+class CompressionStats:
+    """
+    Счетчики сжатых ответов и объемов до и после сжатия по кодировкам.
+    """
+
+    def __init__(self):
+        self._encodings = {}
+
+    def _counters(self, encoding: str) -> dict:
+        return self._encodings.setdefault(
+            encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0}
+        )
+
+    def response(self, encoding: str):
+        """
+        Учет сжатого ответа.
+        """
+        self._counters(encoding)["responses"] += 1
+
+    def record(self, encoding: str, original: int, compressed: int):
+        """
+        Учет сжатой части ответа.
+        """
+        counters = self._counters(encoding)
+        counters["bytes_in"] += original
+        counters["bytes_out"] += compressed
+
+    def stats(self):
+        """
+        Копия счетчиков по кодировкам.
+        """
+        return {encoding: dict(counters) for encoding, counters in self._encodings.items()}
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware сжатия ответов.
+    """
+
+    def __init__(self, app, encodings=COMPRESSION_ENCODINGS, min_size: int = COMPRESSION_MIN_SIZE,
+                 cache: CompressedCache = None):
+        self.app = app
+        self.encodings = [encoding for encoding in encodings if encoding in AVAILABLE_ENCODINGS]
+        self.min_size = min_size
+        self.cache = cache or compressed_cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _Responder(send, encoding, self.min_size, self.cache)
+        await self.app(scope, receive, responder.send)
+
+
+class _Responder:
+    """
+    Обработка сообщений ответа одного запроса: решение о сжатии принимается
+    по заголовкам и первой части тела.
+    """
+
+    def __init__(self, send, encoding: str, min_size: int, cache: CompressedCache):
+        self._send = send
+        self.encoding = encoding
+        self.min_size = min_size
+        self.cache = cache
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    def _start_compressed(self, headers: MutableHeaders):
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            # Сжатое представление не совпадает побайтно с исходным
+            headers["ETag"] = f"W/{etag}"
+        compression_stats.response(self.encoding)
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+        if self.compressor is not None:
+            await self._send_stream_part(message)
+            return
+        headers = MutableHeaders(raw=self.start["headers"])
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start["status"] in (204, 206, 304) or not _compressible(headers) or (
+            not more_body and len(body) < self.min_size
+        ):
+            self.passthrough = True
+            await self._send(self.start)
+            await self._send(message)
+            return
+        self._start_compressed(headers)
+        if more_body:
+            del headers["Content-Length"]
+            self.compressor = StreamCompressor(self.encoding, choose_level(self.encoding))
+            await self._send(self.start)
+            await self._send_stream_part(message)
+            return
+        compressed = await self._compress_body(headers.get("etag"), body)
+        headers["Content-Length"] = str(len(compressed))
+        await self._send(self.start)
+        await self._send({"type": "http.response.body", "body": compressed})
+
+    async def _compress_body(self, etag: str, body: bytes) -> bytes:
+        key = (etag, self.encoding)
+        if etag:
+            compressed = self.cache.get(key)
+            if compressed is not None:
+                compression_stats.record(self.encoding, len(body), len(compressed))
+                return compressed
+        compressed = await _run(compress, self.encoding, body, size=len(body))
+        compression_stats.record(self.encoding, len(body), len(compressed))
+        if etag:
+            self.cache.set(key, compressed)
+        return compressed
+
+    async def _send_stream_part(self, message):
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        operation = self.compressor.compress if more_body else self.compressor.finish
+        compressed = await _run(operation, body, size=len(body))
+        compression_stats.record(self.encoding, len(body), len(compressed))
+        if compressed or not more_body:
+            await self._send({
+                "type": "http.response.body", "body": compressed, "more_body": more_body,
+            })
+
+
+compressed_cache = CompressedCache()
+compression_stats = CompressionStats()
@@ -3,9 +3,129 @@
 Содержит настройки безопасности и другие константы.
 """
 import os
-from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # Добавляем значение по умолчанию, если переменная окружения не установлена
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your_super_secret_key_for_jwt_encoding_keep_it_safe")
-ALGORITHM = "HS256"
\ No newline at end of file
+ALGORITHM = "HS256"
+# Ключи подписи JWT в формате "kid:secret,kid:secret" для ротации ключей;
+# новые токены подписываются ключом JWT_ACTIVE_KID (по умолчанию первым)
+JWT_KEYS = dict(
+    item.split(":", 1) for item in os.getenv("JWT_KEYS", "").split(",") if ":" in item
+) or {"default": SECRET_KEY}
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", next(iter(JWT_KEYS)))
+ACCESS_TOKEN_EXPIRE_SECONDS = int(os.getenv("ACCESS_TOKEN_EXPIRE_SECONDS", "86400"))
+# Проверка токенов: database - пользователь загружается из базы (с кэшем),
+# stateless - пользователь берется из подписанных утверждений без запроса к базе
+TOKEN_VERIFICATION = os.getenv("TOKEN_VERIFICATION", "database")
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "30"))
+REVOCATION_FALSE_POSITIVE_RATE = float(os.getenv("REVOCATION_FALSE_POSITIVE_RATE", "0.01"))
+
+# Настройки кэша аутентифицированных пользователей
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+# Настройки пула потоков для хеширования паролей
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "4"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))
+
+# Настройки постраничной навигации и потоковой выдачи списков
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Размер пакета при массовой загрузке продуктов
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "5000"))
+
+# Групповая фиксация одиночных изменений: не более GROUP_COMMIT_MAX_OPS изменений,
+# собранных за GROUP_COMMIT_WINDOW_MS миллисекунд, в одной транзакции
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "0") == "1"
+GROUP_COMMIT_MAX_OPS = int(os.getenv("GROUP_COMMIT_MAX_OPS", "64"))
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+
+# Сжатие ответов: кодировки в порядке предпочтения (br и zstd - при установленных
+# пакетах brotli и zstandard), минимальный размер тела и объем кэша сжатых тел в байтах
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") == "1"
+COMPRESSION_ENCODINGS = [
+    name.strip() for name in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",")
+    if name.strip()
+]
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_CACHE_BYTES = int(os.getenv("COMPRESSION_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+# Размер порции строк и уровень сжатия gzip при полной выгрузке
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+# Настройки подключения к базе данных
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# Таймаут выполнения запроса (PostgreSQL) и ожидания блокировки (SQLite), мс
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+DB_SQLITE_WAL = os.getenv("DB_SQLITE_WAL", "1") == "1"
+# Реплики для маршрутов чтения (URL через запятую), выбор реплики (round_robin или least_busy)
+# и время после изменения, в течение которого клиент читает из основной базы
+DB_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()
+]
+DB_REPLICA_SELECTION = os.getenv("DB_REPLICA_SELECTION", "round_robin")
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+# Настройки шины событий изменения остатков
+EVENT_HISTORY_SIZE = int(os.getenv("EVENT_HISTORY_SIZE", "10000"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+EVENT_KEEPALIVE_SECONDS = float(os.getenv("EVENT_KEEPALIVE_SECONDS", "15"))
+
+# Настройки кэша сериализованных ответов (memory, sqlite или none)
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "./response_cache.db")
+
+# Уникальность названия продукта в пределах склада
+PRODUCT_NAME_UNIQUE_PER_WAREHOUSE = os.getenv("PRODUCT_NAME_UNIQUE_PER_WAREHOUSE", "0") == "1"
+
+# Порог медленного запроса (секунды) и число SQL запросов, сохраняемых для журнала
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "50"))
+
+# Профилировщик (только для администраторов из ADMIN_USERNAMES, через запятую)
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+ADMIN_USERNAMES = {
+    name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()
+}
+
+# Несколько рабочих процессов: WORKERS > 1 при запуске через python main.py.
+# Кэши и версии данных процессов согласуются через канал в файле SQLite;
+# при запуске через uvicorn --workers канал включается CLUSTER_ENABLED=1
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8080"))
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_GRACEFUL_TIMEOUT = float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+CLUSTER_ENABLED = os.getenv("CLUSTER_ENABLED", "1" if WORKERS > 1 else "0") == "1"
+CLUSTER_CHANNEL_PATH = os.getenv("CLUSTER_CHANNEL_PATH", "./cluster.db")
+CLUSTER_POLL_SECONDS = float(os.getenv("CLUSTER_POLL_SECONDS", "0.1"))
+CLUSTER_RETENTION_SECONDS = float(os.getenv("CLUSTER_RETENTION_SECONDS", "60"))
+MIGRATION_LOCK_PATH = os.getenv("MIGRATION_LOCK_PATH", "./.migrate.lock")
+
+# Синхронизация схемы при запуске: startup - migrate() при старте приложения (lifespan),
+# off - схема обновляется отдельно командой python migrations.py
+SCHEMA_SYNC = os.getenv("SCHEMA_SYNC", "startup")
+# Прогрев соединений пула, bcrypt и типовых запросов чтения при запуске
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+
+# Контроль допуска: лимит одновременных запросов (из них тяжелых - ADMISSION_SCAN_CONCURRENCY),
+# очередь ожидания каждого класса и время ожидания в ней (секунды), корзина токенов
+# клиента (запросов в секунду и запас) и стоимость тяжелого запроса в токенах
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "0") == "1"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_SCAN_CONCURRENCY = int(os.getenv("ADMISSION_SCAN_CONCURRENCY", "4"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "1.0"))
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "50"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "100"))
+ADMISSION_SCAN_COST = float(os.getenv("ADMISSION_SCAN_COST", "5"))
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "100000"))
@@ -2,14 +2,91 @@
 Модуль для работы с базой данных.
 Содержит функции для выполнения операций CRUD (Create, Read, Update, Delete).
 """
-from sqlalchemy.orm import Session
+import re
+import sys
+import time
+
+from sqlalchemy import bindparam, column, delete, func, insert, select, table, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload, noload
 from sqlalchemy.exc import IntegrityError
-import jwt
 from jwt.exceptions import InvalidTokenError
 
-from config import pwd_context, SECRET_KEY, ALGORITHM
+from config import ACCESS_TOKEN_EXPIRE_SECONDS
 from schemas import UserRegister, WarehouseCreate, ProductCreate
-from models import User, Warehouse, Product
+from models import User, Warehouse, Product, WarehouseStock, RevokedToken
+from token_cache import token_cache
+from tokens import keyring, revocations, issue_claims
+from hashing import get_pwd_context
+from cluster import cluster
+from group_commit import group_writer, WriterStopped
+from events import event_bus
+from versions import data_versions
+from response_cache import (
+    response_cache, warehouse_tag, WAREHOUSES_TAG, PRODUCTS_TAG, ALL_WAREHOUSES_TAG,
+)
+
+
+# Столбцы, выбираемые быстрым путем сериализации списков вместо ORM объектов
+PRODUCT_COLUMNS = (Product.id, Product.name, Product.quantity, Product.warehouse_id)
+WAREHOUSE_COLUMNS = (Warehouse.id, Warehouse.name, Warehouse.location)
+
+# Размер порции id складов при загрузке их продуктов (как у selectinload)
+WAREHOUSE_ID_BATCH_SIZE = 500
+
+# Полнотекстовый индекс названий продуктов (создается в migrations.sync_search_index)
+_PRODUCT_SEARCH = table("products_fts", column("rowid"), column("rank"), column("products_fts"))
+_SEARCH_WORD = re.compile(r"\w+")
+
+
+class DuplicateProduct(Exception):
+    """
+    Исключение при нарушении уникальности названия продукта в пределах склада.
+    """
+
+
+class InsufficientStock(Exception):
+    """
+    Исключение при попытке уменьшить остаток продукта ниже нуля.
+    """
+
+    def __init__(self, product_id: int):
+        super().__init__(f"Недостаточно товара для продукта {product_id}")
+        self.product_id = product_id
+
+
+class _ProductMissing(Exception):
+    """
+    Продукт пакетного изменения остатков не найден; изменение откатывается.
+    """
+
+    def __init__(self, product_id: int):
+        super().__init__(product_id)
+        self.product_id = product_id
+
+
+def _write(db: Session, apply, *args):
+    """
+    Выполнение изменения apply(db, *args) и фиксация транзакции.
+    apply возвращает результат и уведомление, вызываемое после фиксации (или None).
+    При групповой фиксации изменение выполняет поток записи group_writer
+    вместе с изменениями других запросов, а сессия db не используется.
+    """
+    if group_writer.enabled:
+        try:
+            return group_writer.submit(apply, *args)
+        except WriterStopped:
+            # Поток записи остановлен после проверки: изменение выполняется в сессии db
+            pass
+    try:
+        result, notify = apply(db, *args)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if notify is not None:
+        notify()
+    return result
 
 
 def get_user_by_username(db: Session, username: str):
@@ -19,70 +96,378 @@ def get_user_by_username(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
 
-def create_user(db: Session, user: UserRegister):
+def create_user(db: Session, user: UserRegister, hashed_password: str = None):
     """
     Создание нового пользователя.
     Проверяет существование пользователя и возвращает None, если пользователь уже существует.
+    Если хеш пароля уже вычислен (например, в пуле хеширования), он используется как есть.
     """
     # Проверяем, существует ли пользователь с таким именем
     db_user = get_user_by_username(db, username=user.username)
     if db_user:
         return None  # Пользователь уже существует
     
-    hashed_password = pwd_context.hash(user.password)
-    db_user = User(username=user.username, password=hashed_password)
-    
+    if hashed_password is None:
+        hashed_password = get_pwd_context().hash(user.password)
     try:
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
-        return db_user
+        return _write(db, _insert_user, user.username, hashed_password)
     except IntegrityError:
-        db.rollback()
         return None  # Обработка случая, если произошла ошибка уникальности
 
 
-def authenticate_user(db: Session, username: str, password: str):
+def _insert_user(db: Session, username: str, hashed_password: str):
+    row = db.execute(
+        insert(User).values(username=username, password=hashed_password).returning(User.id)
+    ).one()
+    db_user = User(id=row.id, username=username, password=hashed_password)
+    return db_user, lambda: cluster.emit("user_tokens_changed", username=username)
+
+
+def update_user_password(db: Session, username: str, password: str):
+    """
+    Смена пароля пользователя.
+    Сбрасывает кэшированные токены пользователя.
+    """
+    if get_user_by_username(db, username=username) is None:
+        return None
+    return _write(db, _update_password, username, get_pwd_context().hash(password))
+
+
+def _update_password(db: Session, username: str, hashed_password: str):
+    row = db.execute(
+        update(User)
+        .where(User.username == username)
+        .values(password=hashed_password)
+        .returning(User.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None, None
+    revoked_before = _revoke(db, user_id=row.id, revoked_before=time.time())
+    db_user = User(id=row.id, username=username, password=hashed_password)
+    return db_user, lambda: cluster.emit(
+        "user_tokens_changed",
+        username=username, user_id=row.id, revoked_before=revoked_before,
+    )
+
+
+def delete_user(db: Session, username: str):
+    """
+    Удаление пользователя.
+    Сбрасывает кэшированные токены пользователя.
+    """
+    return _write(db, _delete_user, username)
+
+
+def _delete_user(db: Session, username: str):
+    row = db.execute(
+        delete(User)
+        .where(User.username == username)
+        .returning(User.id, User.password)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None, None
+    revoked_before = _revoke(db, user_id=row.id, revoked_before=time.time())
+    db_user = User(id=row.id, username=username, password=row.password)
+    return db_user, lambda: cluster.emit(
+        "user_tokens_changed",
+        username=username, user_id=row.id, revoked_before=revoked_before,
+    )
+
+
+@cluster.handler("user_tokens_changed")
+def _user_tokens_changed(username: str, user_id: int = None, revoked_before: float = None,
+                         jti: str = None):
     """
-    Аутентификация пользователя по имени пользователя и паролю.
+    Сброс кэша токенов пользователя и учет отзыва токенов в текущем процессе.
     """
-    user = db.query(User).filter(User.username == username).first()
-    if user and pwd_context.verify(password, user.password):
-        return user
-    return None
+    revocations.add(jti=jti, user_id=user_id, revoked_before=revoked_before)
+    token_cache.invalidate_user(username)
 
 
 def create_jwt_token(user: User):
     """
     Создание JWT токена для аутентифицированного пользователя.
+    Токен содержит имя и id пользователя, время выпуска и истечения и уникальный jti;
+    kid активного ключа подписи передается в заголовке.
+    """
+    return keyring.encode(issue_claims(user.id, user.username))
+
+
+def _revoke(db: Session, jti: str = None, user_id: int = None, revoked_before: float = None):
+    """
+    Запись отзыва в текущей транзакции и удаление отзывов, срок которых истек.
+    Возвращает revoked_before.
+    """
+    now = time.time()
+    db.query(RevokedToken).filter(RevokedToken.expires_at <= now).delete(
+        synchronize_session=False
+    )
+    db.add(RevokedToken(
+        jti=jti,
+        user_id=user_id,
+        revoked_before=revoked_before,
+        expires_at=now + ACCESS_TOKEN_EXPIRE_SECONDS,
+    ))
+    return revoked_before
+
+
+def revoke_token(db: Session, token: str):
     """
-    token = jwt.encode({"sub": user.username}, SECRET_KEY, algorithm=ALGORITHM)
-    return token
+    Отзыв одного токена (выход из системы).
+    Возвращает False, если токен недействителен.
+    """
+    try:
+        claims = keyring.decode(token)
+    except InvalidTokenError:
+        return False
+    return _write(db, _insert_revocation, claims["sub"], claims["jti"])
+
+
+def _insert_revocation(db: Session, username: str, jti: str):
+    _revoke(db, jti=jti)
+    return True, lambda: cluster.emit("user_tokens_changed", username=username, jti=jti)
 
 
-def get_user_from_token(db: Session, token: str):
+def get_user_from_token(db: Session, token: str, stateless: bool = False):
     """
     Получение пользователя из JWT токена.
+    Подпись, срок действия и отзыв проверяются всегда. В режиме stateless пользователь
+    создается из утверждений токена без запроса к базе данных; иначе загружается
+    из базы, а при попадании в кэш запрос к базе данных не выполняется.
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if username is None:
-            return None
-        return get_user_by_username(db, username=username)
+        claims = keyring.decode(token)
     except InvalidTokenError:
         return None
+    if revocations.is_revoked(db, claims):
+        return None
+    if stateless:
+        return User(id=claims["uid"], username=claims["sub"])
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+    db_user = get_user_by_username(db, username=claims["sub"])
+    if db_user is not None and db_user.id != claims["uid"]:
+        # Пользователь был удален и создан заново с тем же именем
+        return None
+    if db_user is not None:
+        # Отсоединяем объект от сессии, чтобы его можно было разделять между запросами
+        db.expunge(db_user)
+        token_cache.set(token, db_user)
+    return db_user
+
+
+def _product_from_row(row) -> Product:
+    """
+    Объект продукта, не связанный с сессией, из строки RETURNING.
+    """
+    return Product(id=row.id, name=row.name, quantity=row.quantity, warehouse_id=row.warehouse_id)
+
+
+def _product_data(product):
+    """
+    Представление продукта (модели или строки RETURNING) для событий.
+    """
+    return {
+        "id": product.id,
+        "name": product.name,
+        "quantity": product.quantity,
+        "warehouse_id": product.warehouse_id,
+    }
+
+
+def _products_changed(event_type: str, warehouse_ids, data, all_warehouses: bool = False):
+    """
+    Уведомление об изменении продуктов после фиксации транзакции.
+    all_warehouses указывается, если могли измениться продукты неизвестных складов.
+    """
+    cluster.emit(
+        "products_changed",
+        event_type=event_type,
+        warehouse_ids=list(warehouse_ids),
+        data=data,
+        all_warehouses=all_warehouses,
+    )
+
+
+@cluster.handler("products_changed")
+def _apply_products_changed(event_type: str, warehouse_ids: list, data: dict,
+                            all_warehouses: bool = False):
+    """
+    Сброс версий и кэшей и публикация события об изменении продуктов в текущем процессе.
+    """
+    data_versions.bump_products(warehouse_ids, all_warehouses=all_warehouses)
+    tags = {PRODUCTS_TAG, *(warehouse_tag(i) for i in warehouse_ids if i is not None)}
+    if all_warehouses:
+        tags.add(ALL_WAREHOUSES_TAG)
+    response_cache.invalidate(tags)
+    event_bus.publish(event_type, warehouse_ids, data)
+
+
+_STOCK_TABLE = WarehouseStock.__table__
+
+# Инкрементальное изменение итогов склада; выполняется через executemany
+_STOCK_UPDATE = (
+    update(_STOCK_TABLE)
+    .where(_STOCK_TABLE.c.warehouse_id == bindparam("b_warehouse_id"))
+    .values(
+        product_count=_STOCK_TABLE.c.product_count + bindparam("b_products"),
+        total_quantity=_STOCK_TABLE.c.total_quantity + bindparam("b_quantity"),
+    )
+)
+
+
+def _change_stock(db: Session, *changes):
+    """
+    Изменение итогов складов в текущей транзакции.
+    changes - тройки (id склада, изменение количества продуктов, изменение остатка).
+    """
+    deltas = {}
+    for warehouse_id, products, quantity in changes:
+        delta = deltas.setdefault(warehouse_id, [0, 0])
+        delta[0] += products
+        delta[1] += quantity or 0
+    params = [
+        {"b_warehouse_id": warehouse_id, "b_products": products, "b_quantity": quantity}
+        for warehouse_id, (products, quantity) in deltas.items()
+        if warehouse_id is not None and (products or quantity)
+    ]
+    if params:
+        db.execute(_STOCK_UPDATE, params)
 
 
 def create_warehouse(db: Session, warehouse: WarehouseCreate):
     """
     Создание нового склада.
     """
-    db_warehouse = Warehouse(**warehouse.dict())
-    db.add(db_warehouse)
+    return _write(db, _insert_warehouse, warehouse.name, warehouse.location)
+
+
+def _insert_warehouse(db: Session, name: str, location: str):
+    row = db.execute(
+        insert(Warehouse).values(name=name, location=location).returning(*WAREHOUSE_COLUMNS)
+    ).one()
+    db.execute(
+        insert(WarehouseStock).values(warehouse_id=row.id, product_count=0, total_quantity=0)
+    )
+    data = {"id": row.id, "name": row.name, "location": row.location}
+    return Warehouse(**data), lambda: cluster.emit("warehouse_created", data=data)
+
+
+@cluster.handler("warehouse_created")
+def _apply_warehouse_created(data: dict):
+    """
+    Сброс версий и кэшей и публикация события о новом складе в текущем процессе.
+    """
+    data_versions.bump_warehouses([data["id"]])
+    response_cache.invalidate([WAREHOUSES_TAG, warehouse_tag(data["id"])])
+    event_bus.publish("warehouse.created", [data["id"]], data)
+
+
+@cluster.handler("warehouses_changed")
+def _apply_warehouses_changed(event_type: str, warehouse_ids: list, data: dict):
+    """
+    Сброс версий и кэшей и публикация события о записи нескольких складов в текущем процессе.
+    """
+    data_versions.bump_warehouses(warehouse_ids)
+    response_cache.invalidate([WAREHOUSES_TAG, *(warehouse_tag(i) for i in warehouse_ids)])
+    event_bus.publish(event_type, warehouse_ids, data)
+
+
+def _write_warehouse_rows(db: Session, rows: list):
+    """
+    Запись пакета складов: строки без id вставляются, строки с id вставляются
+    или обновляются. Для новых складов создаются нулевые итоги warehouse_stock.
+    """
+    new_rows = [values for values in rows if values.get("id") is None]
+    keyed_rows = [values for values in rows if values.get("id") is not None]
+    for values in new_rows:
+        warehouse = Warehouse(name=values["name"], location=values["location"])
+        db.add(warehouse)
+        db.flush()
+        values["id"] = warehouse.id
+    if keyed_rows:
+        stmt = _upsert_statement(db, Warehouse, ("name", "location"))
+        if stmt is not None:
+            db.execute(stmt, keyed_rows)
+        else:
+            for values in keyed_rows:
+                db.merge(Warehouse(**values))
+    ids = [values["id"] for values in rows]
+    existing = {
+        warehouse_id for (warehouse_id,) in
+        db.query(WarehouseStock.warehouse_id).filter(WarehouseStock.warehouse_id.in_(ids))
+    }
+    missing = sorted(set(ids) - existing)
+    if missing:
+        db.execute(insert(WarehouseStock), [
+            {"warehouse_id": warehouse_id, "product_count": 0, "total_quantity": 0}
+            for warehouse_id in missing
+        ])
+
+
+def bulk_write_warehouses(db: Session, rows: list):
+    """
+    Массовая запись складов (восстановление из выгрузки).
+    rows - список пар (номер строки, значения); ошибки возвращаются по строкам.
+    Возвращает количество записанных строк и список пар (номер строки, ошибка).
+    """
+    written_rows, errors = _write_batch(db, rows, _write_warehouse_rows)
+    if written_rows:
+        cluster.emit(
+            "warehouses_changed",
+            event_type="warehouses.bulk",
+            warehouse_ids=sorted({values["id"] for _, values in written_rows}),
+            data={"written": len(written_rows)},
+        )
+    return len(written_rows), errors
+
+
+def export_batches(db: Session, kind: str, batch_size: int):
+    """
+    Строки выгрузки kind (products, warehouses) кортежами столбцов, порциями
+    по batch_size через серверный курсор, в порядке id.
+    На SQLite и PostgreSQL весь обход выполняется одним запросом и видит один снимок данных.
+    """
+    columns = PRODUCT_COLUMNS if kind == "products" else WAREHOUSE_COLUMNS
+    statement = select(*columns).order_by(columns[0])
+    connection = db.connection()
+    if connection.dialect.name != "sqlite":
+        result = connection.execution_options(
+            stream_results=True, yield_per=batch_size
+        ).execute(statement)
+        yield from result.partitions()
+        return
+    # Курсор sqlite3 и так читает строки по мере выборки; его кортежи
+    # используются напрямую, без создания объектов Row для каждой строки
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(str(statement.compile(connection)))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+def sync_id_sequences(db: Session):
+    """
+    Продвижение последовательностей id после записи строк с явными id (PostgreSQL).
+    На других базах ничего не делает.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for model in (Warehouse, Product):
+        table_name = model.__tablename__
+        db.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+            f"coalesce((SELECT max(id) FROM {table_name}), 0) + 1, false)"
+        ))
     db.commit()
-    db.refresh(db_warehouse)
-    return db_warehouse
 
 
 def create_product(db: Session, product: ProductCreate):
@@ -90,40 +475,471 @@ def create_product(db: Session, product: ProductCreate):
     Создание нового продукта.
     Проверяет существование склада и возвращает None, если склад не найден.
     """
+    return _write(db, _insert_product, product.name, product.quantity, product.warehouse_id)
+
+
+def _insert_product(db: Session, name: str, quantity: int, warehouse_id: int):
     # Проверяем, существует ли склад с таким id
-    warehouse = db.query(Warehouse).filter(Warehouse.id == product.warehouse_id).first()
-    if warehouse is None:
+    if db.query(Warehouse.id).filter(Warehouse.id == warehouse_id).first() is None:
+        return None, None
+    try:
+        row = db.execute(
+            insert(Product)
+            .values(name=name, quantity=quantity, warehouse_id=warehouse_id)
+            .returning(*PRODUCT_COLUMNS)
+        ).one()
+    except IntegrityError as exc:
+        raise DuplicateProduct(str(exc.orig)) from exc
+    _change_stock(db, (warehouse_id, 1, quantity))
+    return _product_from_row(row), lambda: _products_changed(
+        "product.created", [warehouse_id], _product_data(row)
+    )
+
+
+def get_warehouse_ids(db: Session):
+    """
+    Множество id всех складов для проверки строк массовой загрузки без запроса на каждую строку.
+    """
+    return {warehouse_id for (warehouse_id,) in db.query(Warehouse.id)}
+
+
+def _upsert_statement(db: Session, model, columns):
+    """
+    Оператор INSERT ... ON CONFLICT (id) DO UPDATE столбцов columns для текущего диалекта.
+    Возвращает None, если диалект не поддерживает upsert.
+    """
+    dialects = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+    dialect_insert = dialects.get(db.get_bind().dialect.name)
+    if dialect_insert is None:
         return None
-    db_product = Product(**product.dict())
-    db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    stmt = dialect_insert(model)
+    return stmt.on_conflict_do_update(
+        index_elements=[model.id],
+        set_={name: stmt.excluded[name] for name in columns},
+    )
+
+
+def _product_upsert_statement(db: Session):
+    return _upsert_statement(db, Product, ("name", "quantity", "warehouse_id"))
+
+
+def _bulk_stock_changes(db: Session, rows: list, upsert: bool):
+    """
+    Изменения итогов складов для пакета строк.
+    При upsert учитываются прежние склад и остаток обновляемых продуктов,
+    включая повторы одного id внутри пакета.
+    """
+    current = {}
+    keyed_ids = [values["id"] for values in rows if values.get("id") is not None]
+    if upsert and keyed_ids:
+        current = {
+            product_id: (warehouse_id, quantity)
+            for product_id, warehouse_id, quantity in db.query(
+                Product.id, Product.warehouse_id, Product.quantity
+            ).filter(Product.id.in_(keyed_ids))
+        }
+    changes = []
+    for values in rows:
+        product_id = values.get("id")
+        if product_id in current:
+            old_warehouse_id, old_quantity = current[product_id]
+            changes.append((old_warehouse_id, -1, -(old_quantity or 0)))
+        if product_id is not None:
+            current[product_id] = (values["warehouse_id"], values["quantity"])
+        changes.append((values["warehouse_id"], 1, values["quantity"]))
+    return changes
+
+
+def _write_product_rows(db: Session, rows: list, upsert: bool):
+    """
+    Запись пакета строк через executemany.
+    Строки без id вставляются, строки с id вставляются или обновляются при upsert.
+    """
+    _change_stock(db, *_bulk_stock_changes(db, rows, upsert))
+    new_rows = [values for values in rows if values.get("id") is None]
+    keyed_rows = [values for values in rows if values.get("id") is not None]
+    if new_rows:
+        db.execute(insert(Product), [
+            {key: value for key, value in values.items() if key != "id"} for values in new_rows
+        ])
+    if keyed_rows:
+        stmt = _product_upsert_statement(db) if upsert else None
+        if stmt is not None:
+            db.execute(stmt, keyed_rows)
+        elif upsert:
+            for values in keyed_rows:
+                db.merge(Product(**values))
+        else:
+            db.execute(insert(Product), keyed_rows)
+
+
+def _write_batch(db: Session, rows: list, write):
+    """
+    Запись пакета одной транзакцией функцией write(db, список значений).
+    rows - список пар (номер строки, значения). Если пакет целиком не записывается
+    (например, из-за дублирующегося id), строки записываются по одной, чтобы
+    вернуть ошибки для конкретных строк.
+    Возвращает записанные пары и список пар (номер строки, ошибка).
+    """
+    try:
+        write(db, [values for _, values in rows])
+        db.commit()
+        return rows, []
+    except IntegrityError:
+        db.rollback()
+    written_rows, errors = [], []
+    for index, values in rows:
+        try:
+            write(db, [values])
+            db.commit()
+            written_rows.append((index, values))
+        except IntegrityError as exc:
+            db.rollback()
+            errors.append((index, str(exc.orig)))
+    return written_rows, errors
+
+
+def bulk_write_products(db: Session, rows: list, upsert: bool = False):
+    """
+    Массовая запись продуктов одним пакетом в одной транзакции.
+    rows - список пар (номер строки, значения); ошибки возвращаются по строкам.
+    Возвращает количество записанных строк и список пар (номер строки, ошибка).
+    """
+    written_rows, errors = _write_batch(
+        db, rows, lambda session, values: _write_product_rows(session, values, upsert)
+    )
+    if written_rows:
+        warehouse_ids = {values["warehouse_id"] for _, values in written_rows}
+        # При upsert продукты могли быть перенесены из других складов
+        moved = upsert and any(values.get("id") is not None for _, values in written_rows)
+        _products_changed(
+            "products.bulk", warehouse_ids, {"written": len(written_rows)}, all_warehouses=moved
+        )
+    return len(written_rows), errors
 
 
 def update_product(db: Session, product_id: int, product: ProductCreate):
     """
     Обновление информации о продукте.
     """
-    db_product = db.query(Product).filter(Product.id == product_id).first()
-    if db_product is None:
+    return _write(
+        db, _update_product, product_id, product.name, product.quantity, product.warehouse_id
+    )
+
+
+def _update_product(db: Session, product_id: int, name: str, quantity: int, warehouse_id: int):
+    current = (
+        db.query(Product.warehouse_id, Product.quantity).filter(Product.id == product_id).first()
+    )
+    if current is None:
+        return None, None
+    try:
+        row = db.execute(
+            update(Product)
+            .where(Product.id == product_id)
+            .values(name=name, quantity=quantity, warehouse_id=warehouse_id)
+            .returning(*PRODUCT_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).one()
+    except IntegrityError as exc:
+        raise DuplicateProduct(str(exc.orig)) from exc
+    _change_stock(
+        db,
+        (current.warehouse_id, -1, -(current.quantity or 0)),
+        (warehouse_id, 1, quantity),
+    )
+    return _product_from_row(row), lambda: _products_changed(
+        "product.updated", [current.warehouse_id, warehouse_id], _product_data(row)
+    )
+
+
+def _apply_adjustment(db: Session, product_id: int, delta: int):
+    """
+    Изменение остатка одним оператором UPDATE ... RETURNING.
+    Условие на неотрицательный результат проверяется в том же операторе,
+    поэтому параллельные изменения не теряются.
+    """
+    new_quantity = func.coalesce(Product.quantity, 0) + delta
+    row = db.execute(
+        update(Product)
+        .where(Product.id == product_id, new_quantity >= 0)
+        .values(quantity=new_quantity)
+        .returning(Product.id, Product.name, Product.quantity, Product.warehouse_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is not None:
+        _change_stock(db, (row.warehouse_id, 0, delta))
+        return row
+    # Оператор ничего не изменил: продукта нет или остатка недостаточно
+    if db.query(Product.id).filter(Product.id == product_id).first() is None:
         return None
-    db_product.name = product.name
-    db_product.quantity = product.quantity
-    db_product.warehouse_id = product.warehouse_id
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    raise InsufficientStock(product_id)
+
+
+def adjust_product_quantity(db: Session, product_id: int, delta: int):
+    """
+    Атомарное изменение остатка продукта на delta.
+    Возвращает обновленную строку или None, если продукт не найден.
+    Вызывает InsufficientStock, если остаток стал бы отрицательным.
+    """
+    return _write(db, _adjust_products, [(product_id, delta)])[0]
+
+
+def adjust_product_quantities(db: Session, adjustments: list):
+    """
+    Атомарное изменение остатков нескольких продуктов в одной транзакции.
+    adjustments - список пар (id продукта, delta). При ошибке ни одно изменение не применяется.
+    Возвращает список обновленных строк или None, если какой-либо продукт не найден
+    (id такого продукта возвращается вторым значением).
+    """
+    try:
+        return _write(db, _adjust_products, adjustments, True), None
+    except _ProductMissing as exc:
+        return None, exc.product_id
+
+
+def _adjust_products(db: Session, adjustments: list, require_all: bool = False):
+    """
+    Изменение остатков; отсутствующий продукт дает None в списке результатов
+    или, при require_all, исключение _ProductMissing.
+    """
+    rows = []
+    for product_id, delta in adjustments:
+        row = _apply_adjustment(db, product_id, delta)
+        if row is None and require_all:
+            raise _ProductMissing(product_id)
+        rows.append(row)
+
+    def notify():
+        for row in rows:
+            if row is not None:
+                _products_changed("product.adjusted", [row.warehouse_id], _product_data(row))
+
+    return rows, notify
 
 
 def delete_product(db: Session, product_id: int):
     """
     Удаление продукта.
     """
-    db_product = db.query(Product).filter(Product.id == product_id).first()
-    if db_product is None:
-        return None
-    db.delete(db_product)
-    db.commit()
-    return db_product
+    return _write(db, _delete_product, product_id)
 
+
+def _delete_product(db: Session, product_id: int):
+    row = db.execute(
+        delete(Product)
+        .where(Product.id == product_id)
+        .returning(*PRODUCT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None, None
+    _change_stock(db, (row.warehouse_id, -1, -(row.quantity or 0)))
+    return _product_from_row(row), lambda: _products_changed(
+        "product.deleted", [row.warehouse_id], _product_data(row)
+    )
+
+
+def _prefix_range(column, prefix: str):
+    """
+    Условие поиска по префиксу в виде диапазона column >= prefix AND column < следующий префикс.
+    В отличие от LIKE диапазон всегда использует B-tree индекс (сравнение с учетом регистра).
+    Последние символы U+10FFFF увеличить нельзя: следующий префикс получается
+    из оставшейся части, а без нее верхней границы нет.
+    """
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return (column >= prefix,)
+    upper = stem[:-1] + chr(ord(stem[-1]) + 1)
+    return column >= prefix, column < upper
+
+
+def _warehouse_loader(include_products: bool):
+    """
+    Стратегия загрузки продуктов склада.
+    selectinload загружает продукты всех складов одним запросом вместо запроса на каждый склад.
+    """
+    if include_products:
+        return selectinload(Warehouse.products)
+    return noload(Warehouse.products)
+
+
+def get_warehouse(db: Session, warehouse_id: int, include_products: bool = True):
+    """
+    Получение склада по id вместе с продуктами.
+    """
+    return (
+        db.query(Warehouse)
+        .options(_warehouse_loader(include_products))
+        .filter(Warehouse.id == warehouse_id)
+        .first()
+    )
+
+
+def _paged_warehouses(query, after: int = None, limit: int = None, name: str = None):
+    """
+    Фильтр по префиксу названия и постраничная навигация по ключу id для запросов складов.
+    """
+    if after is not None:
+        query = query.filter(Warehouse.id > after)
+    if name:
+        query = query.filter(*_prefix_range(Warehouse.name, name))
+    query = query.order_by(Warehouse.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def get_warehouses(
+    db: Session,
+    after: int = None,
+    limit: int = None,
+    name: str = None,
+    include_products: bool = True,
+):
+    """
+    Запрос списка складов с постраничной навигацией по ключу id.
+    Возвращает склады с id больше after, отсортированные по id.
+    """
+    query = db.query(Warehouse).options(_warehouse_loader(include_products))
+    return _paged_warehouses(query, after=after, limit=limit, name=name)
+
+
+def get_warehouse_rows(db: Session, after: int = None, limit: int = None, name: str = None):
+    """
+    Тот же запрос, что get_warehouses, но кортежами столбцов WAREHOUSE_COLUMNS без продуктов.
+    """
+    return _paged_warehouses(db.query(*WAREHOUSE_COLUMNS), after=after, limit=limit, name=name)
+
+
+def get_warehouse_product_rows(db: Session, warehouse_ids: list):
+    """
+    Продукты складов кортежами столбцов PRODUCT_COLUMNS, упорядоченные по складу и id.
+    id складов передаются порциями по WAREHOUSE_ID_BATCH_SIZE.
+    """
+    rows = []
+    for start in range(0, len(warehouse_ids), WAREHOUSE_ID_BATCH_SIZE):
+        batch = warehouse_ids[start:start + WAREHOUSE_ID_BATCH_SIZE]
+        rows.extend(
+            db.query(*PRODUCT_COLUMNS)
+            .filter(Product.warehouse_id.in_(batch))
+            .order_by(Product.warehouse_id, Product.id)
+        )
+    return rows
+
+
+def get_warehouse_summaries(db: Session, after: int = None, limit: int = None, name: str = None):
+    """
+    Сводка по складам: количество продуктов и суммарный остаток.
+    Итоги читаются из таблицы warehouse_stock без обхода продуктов.
+    """
+    query = (
+        db.query(
+            Warehouse.id,
+            Warehouse.name,
+            Warehouse.location,
+            func.coalesce(WarehouseStock.product_count, 0).label("product_count"),
+            func.coalesce(WarehouseStock.total_quantity, 0).label("total_quantity"),
+        )
+        .outerjoin(WarehouseStock, WarehouseStock.warehouse_id == Warehouse.id)
+    )
+    return _paged_warehouses(query, after=after, limit=limit, name=name)
+
+
+def _warehouse_stats_query(db: Session):
+    return db.query(
+        Warehouse.id.label("warehouse_id"),
+        func.coalesce(WarehouseStock.product_count, 0).label("product_count"),
+        func.coalesce(WarehouseStock.total_quantity, 0).label("total_quantity"),
+    ).outerjoin(WarehouseStock, WarehouseStock.warehouse_id == Warehouse.id)
+
+
+def get_warehouse_stats(db: Session, warehouse_id: int):
+    """
+    Итоги одного склада: чтение одной строки по первичному ключу.
+    Возвращает None, если склад не найден.
+    """
+    return _warehouse_stats_query(db).filter(Warehouse.id == warehouse_id).first()
+
+
+def get_warehouses_stats(db: Session, after: int = None, limit: int = None):
+    """
+    Итоги складов с постраничной навигацией по ключу id.
+    """
+    return _paged_warehouses(_warehouse_stats_query(db), after=after, limit=limit)
+
+
+def get_products(
+    db: Session,
+    after: int = None,
+    limit: int = None,
+    warehouse_id: int = None,
+    name: str = None,
+    min_quantity: int = None,
+    max_quantity: int = None,
+):
+    """
+    Запрос списка продуктов с фильтрами и постраничной навигацией по ключу id.
+    Фильтр name выполняет поиск по префиксу названия.
+    """
+    query = db.query(Product)
+    if after is not None:
+        query = query.filter(Product.id > after)
+    if warehouse_id is not None:
+        query = query.filter(Product.warehouse_id == warehouse_id)
+    if name:
+        query = query.filter(*_prefix_range(Product.name, name))
+    if min_quantity is not None:
+        query = query.filter(Product.quantity >= min_quantity)
+    if max_quantity is not None:
+        query = query.filter(Product.quantity <= max_quantity)
+    query = query.order_by(Product.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def get_product_rows(db: Session, **filters):
+    """
+    Тот же запрос, что get_products, но кортежами столбцов PRODUCT_COLUMNS.
+    """
+    return get_products(db, **filters).with_entities(*PRODUCT_COLUMNS)
+
+
+def search_products(db: Session, q: str, warehouse_id: int = None, limit: int = 20):
+    """
+    Поиск продуктов по началу слов названия, упорядоченный по релевантности (bm25).
+    Каждое слово запроса должно быть префиксом какого-либо слова названия.
+    На SQLite используется индекс FTS5 products_fts: склад проверяется внутри MATCH,
+    а лучшие limit совпадений выбираются внутри FTS5 (ORDER BY rank LIMIT), поэтому
+    продукты загружаются только для них. На других базах выполняется поиск
+    подстрок без ранжирования.
+    Возвращает кортежи столбцов PRODUCT_COLUMNS.
+    """
+    words = _SEARCH_WORD.findall(q)
+    if not words:
+        return []
+    query = db.query(*PRODUCT_COLUMNS)
+    if db.get_bind().dialect.name == "sqlite":
+        match = " AND ".join(f'name : "{word}"*' for word in words)
+        if warehouse_id is not None:
+            match += f' AND warehouse_id : "{int(warehouse_id)}"'
+        candidates = (
+            select(_PRODUCT_SEARCH.c.rowid, _PRODUCT_SEARCH.c.rank)
+            .where(_PRODUCT_SEARCH.c.products_fts.op("MATCH")(match))
+            .order_by(_PRODUCT_SEARCH.c.rank, _PRODUCT_SEARCH.c.rowid)
+            .limit(limit)
+            .subquery()
+        )
+        return (
+            query.join(candidates, candidates.c.rowid == Product.id)
+            .order_by(candidates.c.rank, Product.id)
+            .limit(limit)
+            .all()
+        )
+    for word in words:
+        pattern = "%" + word.replace("_", "\\_") + "%"
+        query = query.filter(Product.name.ilike(pattern, escape="\\"))
+    if warehouse_id is not None:
+        query = query.filter(Product.warehouse_id == warehouse_id)
+    return query.order_by(Product.id).limit(limit).all()
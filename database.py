@@ -1,17 +1,154 @@
 """
 Модуль для настройки базы данных SQLAlchemy.
 Создает подключение к базе данных и сессии.
+Параметры пула соединений и SQLite задаются переменными окружения (см. config.py).
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(DATABASE_URL)
+from config import (
+    DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_POOL_TIMEOUT,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT_MS,
+    DB_SQLITE_WAL,
+)
+
+# Асинхронные драйверы для синхронных схем подключения
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _engine_options(url) -> dict:
+    """
+    Параметры create_engine для указанного URL: пул соединений и таймауты.
+    """
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        # Соединения SQLite используются из разных потоков пула FastAPI
+        options["connect_args"] = {"check_same_thread": False}
+        if _is_memory_sqlite(url):
+            return options
+    elif backend == "postgresql" and DB_STATEMENT_TIMEOUT_MS and url.get_driver_name() != "asyncpg":
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Настройка нового соединения SQLite: WAL, synchronous=NORMAL и ожидание блокировки.
+    """
+    cursor = dbapi_connection.cursor()
+    if DB_SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_STATEMENT_TIMEOUT_MS}")
+    cursor.close()
+
+
+def _set_sqlite_replica_pragmas(dbapi_connection, connection_record):
+    """
+    Настройка соединения SQLite реплики: только чтение, режим журнала не меняется.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=1")
+    cursor.execute(f"PRAGMA busy_timeout={DB_STATEMENT_TIMEOUT_MS}")
+    cursor.close()
+
+
+def _begin_sqlite_write_transaction(connection):
+    """
+    Явное начало транзакции на соединениях с параметром sqlite_begin_immediate
+    (поток групповой фиксации). pysqlite не выполняет BEGIN перед SAVEPOINT,
+    и без этого каждый RELEASE SAVEPOINT фиксировал бы изменения; BEGIN IMMEDIATE
+    сразу берет блокировку записи (с ожиданием busy_timeout). Остальные транзакции
+    драйвер начинает перед первым изменением, поэтому чтение не блокирует запись.
+    """
+    if connection.get_execution_options().get("sqlite_begin_immediate"):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def create_db_engine(database_url: str = DATABASE_URL, replica: bool = False):
+    """
+    Создание синхронного движка с настройками пула из окружения.
+    replica=True - движок реплики для чтения.
+    """
+    url = make_url(database_url)
+    db_engine = create_engine(url, **_engine_options(url))
+    if url.get_backend_name() == "sqlite" and not _is_memory_sqlite(url):
+        pragmas = _set_sqlite_replica_pragmas if replica else _set_sqlite_pragmas
+        event.listen(db_engine, "connect", pragmas)
+        if url.get_driver_name() == "pysqlite":
+            event.listen(db_engine, "begin", _begin_sqlite_write_transaction)
+    return db_engine
+
+
+def create_async_db_engine(database_url: str = DATABASE_URL):
+    """
+    Создание асинхронного движка (aiosqlite, asyncpg).
+    Синхронная схема URL заменяется на асинхронный драйвер автоматически.
+    """
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if url.get_driver_name() in ("pysqlite", "psycopg2") and backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    options = _engine_options(url)
+    options.pop("connect_args", None)
+    if url.get_driver_name() == "asyncpg" and DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {
+            "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        }
+    db_engine = create_async_engine(url, **options)
+    if backend == "sqlite" and not _is_memory_sqlite(url):
+        event.listen(db_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return db_engine
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+_async_session_factory = None
+
+
+def get_async_sessionmaker():
+    """
+    Фабрика асинхронных сессий, создаваемая при первом обращении.
+    Драйвер aiosqlite/asyncpg нужен только при использовании асинхронных сессий.
+    """
+    global _async_session_factory  # pylint: disable=global-statement
+    if _async_session_factory is None:
+        # pylint: disable=import-outside-toplevel
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        _async_session_factory = async_sessionmaker(
+            create_async_db_engine(), autoflush=False, expire_on_commit=False
+        )
+    return _async_session_factory
+
+
 def get_db():
     """
     Генератор сессий базы данных для использования с FastAPI Depends().
@@ -23,6 +160,15 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """
+    Асинхронный вариант get_db для async обработчиков FastAPI.
+    Выдает AsyncSession, не занимая поток на время запроса.
+    """
+    async with get_async_sessionmaker()() as db:
+        yield db
+
 # Импортировать модели для создания таблиц
 # Не используется напрямую, но необходимо для создания таблиц в main.py
 # from models import User, Warehouse, Product
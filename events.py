@@ -0,0 +1,197 @@
+"""
+Шина событий изменения остатков внутри процесса.
+Функции crud.py публикуют события после фиксации транзакции,
+а маршрут /events рассылает их подписчикам (SSE и WebSocket).
+
+В режиме нескольких процессов номер события - номер сообщения канала процессов
+(cluster.py), одинаковый во всех процессах. События доставляются строго
+по возрастанию номеров: событие ждет, пока не будут применены все сообщения
+канала с меньшими номерами. Поэтому Last-Event-ID, полученный от одного
+рабочего процесса, пригоден для возобновления в любом другом. Событие, сообщение
+которого не удалось записать в канал, доставляется без номера.
+"""
+import asyncio
+import threading
+from collections import deque
+
+from cluster import cluster
+from config import EVENT_HISTORY_SIZE, EVENT_QUEUE_SIZE
+
+
+class Subscription:
+    """
+    Подписка на события, опционально ограниченная одним складом.
+    События доставляются в asyncio очередь цикла событий подписчика.
+    """
+
+    def __init__(self, loop, warehouse_id: int = None, queue_size: int = EVENT_QUEUE_SIZE,
+                 after: int = None):
+        self.loop = loop
+        self.warehouse_id = warehouse_id
+        self.after = after
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def matches(self, event: dict) -> bool:
+        """
+        Проверка, относится ли событие к складу подписки и не получено ли оно клиентом раньше.
+        """
+        seq = event["seq"]
+        return (self.after is None or seq is None or seq > self.after) and (
+            self.warehouse_id is None or self.warehouse_id in event["warehouse_ids"]
+        )
+
+    def _put(self, event: dict):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Медленный клиент: прекращаем доставку, он должен переподключиться
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    def deliver(self, event):
+        """
+        Потокобезопасная передача события в цикл событий подписчика.
+        """
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Цикл событий уже закрыт
+            pass
+
+
+class EventBus:
+    """
+    Шина событий с монотонным номером последовательности и историей для возобновления.
+    """
+
+    def __init__(self, history_size: int = EVENT_HISTORY_SIZE):
+        self.sequence = 0
+        self.history_size = history_size
+        # История содержит все события с номерами больше _floor
+        self._floor = 0
+        self._history = deque()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        # Нумерация сообщениями канала процессов: события, ожидающие применения
+        # своего сообщения, и примененные сообщения, ожидающие меньших номеров
+        self._ordered = False
+        self._staged = {}
+        self._applied = {}
+
+    def _append(self, event: dict):
+        self._history.append(event)
+        if len(self._history) > self.history_size:
+            self._floor = self._history.popleft()["seq"]
+        for subscription in self._subscribers:
+            if subscription.matches(event):
+                subscription.deliver(event)
+
+    def publish(self, event_type: str, warehouse_ids, data):
+        """
+        Публикация события. Может вызываться из любого потока.
+        При применении сообщения канала процессов событие получает его номер
+        и доставляется после применения сообщения.
+        """
+        event = {
+            "seq": None,
+            "type": event_type,
+            "warehouse_ids": sorted({i for i in warehouse_ids if i is not None}),
+            "data": data,
+        }
+        seq = cluster.sequence.get()
+        with self._lock:
+            if self._ordered and seq is not None:
+                event["seq"] = seq
+                if seq > self.sequence:
+                    self._staged[seq] = event
+                return event
+            if self._ordered:
+                # Сообщение не удалось записать в канал: событие доставляется подписчикам
+                # этого процесса без номера (seq = None) и не попадает в историю.
+                # Номер уже выданного события повторил бы Last-Event-ID клиента
+                for subscription in self._subscribers:
+                    if subscription.matches(event):
+                        subscription.deliver(event)
+                return event
+            self.sequence += 1
+            event["seq"] = self.sequence
+            self._append(event)
+        return event
+
+    def cluster_started(self, last_seq: int):
+        """
+        Переход на нумерацию сообщениями канала процессов, начиная после last_seq.
+        """
+        with self._lock:
+            self._ordered = True
+            self.sequence = self._floor = last_seq
+            self._history.clear()
+            self._staged.clear()
+            self._applied.clear()
+
+    def cluster_stopped(self):
+        """
+        Возврат к собственной нумерации процесса.
+        """
+        with self._lock:
+            self._ordered = False
+            self._staged.clear()
+            self._applied.clear()
+
+    def message_applied(self, seq: int):
+        """
+        Сообщение канала seq применено: доставка его события (если есть)
+        и событий следующих сообщений, применение которых ждало его.
+        """
+        with self._lock:
+            event = self._staged.pop(seq, None)
+            if not self._ordered or seq <= self.sequence:
+                return
+            self._applied[seq] = event
+            while self.sequence + 1 in self._applied:
+                self.sequence += 1
+                event = self._applied.pop(self.sequence)
+                if event is not None:
+                    self._append(event)
+
+    def subscribe(self, warehouse_id: int = None, last_seq: int = None):
+        """
+        Создание подписки в текущем цикле событий.
+        Если указан last_seq, пропущенные события из истории возвращаются вторым значением;
+        None вместо списка означает, что история уже вытеснена (или last_seq выдан
+        до перезапуска процесса) и клиенту нужна полная синхронизация.
+        """
+        subscription = Subscription(asyncio.get_running_loop(), warehouse_id, after=last_seq)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if last_seq is None:
+                return subscription, []
+            # Без канала процессов номер больше текущего выдан до перезапуска процесса;
+            # с каналом это событие, которое еще не дошло до этого процесса
+            if last_seq < self._floor or (not self._ordered and last_seq > self.sequence):
+                subscription.after = None
+                return subscription, None
+            missed = [event for event in self._history if subscription.matches(event)]
+        return subscription, missed
+
+    def unsubscribe(self, subscription: Subscription):
+        """
+        Удаление подписки.
+        """
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self) -> int:
+        """
+        Количество активных подписок.
+        """
+        with self._lock:
+            return len(self._subscribers)
+
+
+event_bus = EventBus()
+cluster.add_listener(event_bus)
@@ -0,0 +1,245 @@
+"""
+Форматы полной выгрузки (снимка) складов и продуктов и обратной загрузки.
+Строки читаются из базы кортежами столбцов порциями по EXPORT_BATCH_SIZE,
+и каждая порция кодируется целиком, поэтому память не растет с размером таблицы.
+
+Форматы:
+- ndjson - одна JSON запись на строку (orjson);
+- csv - строка заголовка и строки значений (модуль csv);
+- columnar - компактный двоичный формат по столбцам.
+
+Формат columnar (все числа little-endian):
+
+    "WHC1", uint16 длина заголовка, заголовок JSON {"kind": ..., "columns": [[имя, тип], ...]}
+    блоки: uint32 число строк n, затем столбцы в порядке заголовка:
+        int - n значений int64 (NULL = -2**63)
+        str - n длин uint32 (NULL = 0xFFFFFFFF), затем строки UTF-8 подряд
+    конец: блок с n = 0
+"""
+import csv
+import io
+import struct
+import sys
+import zlib
+from array import array
+
+import orjson
+
+COLUMNAR_TYPE = "application/x-warehouse-columnar"
+
+# Тип содержимого каждого формата
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "columnar": COLUMNAR_TYPE,
+}
+
+# Столбцы выгрузки: имя и тип (int или str)
+EXPORT_COLUMNS = {
+    "products": (("id", "int"), ("name", "str"), ("quantity", "int"), ("warehouse_id", "int")),
+    "warehouses": (("id", "int"), ("name", "str"), ("location", "str")),
+}
+
+COLUMNAR_MAGIC = b"WHC1"
+NULL_INT = -2 ** 63
+NULL_LENGTH = 0xFFFFFFFF
+# Ограничение числа строк в блоке при чтении, чтобы поврежденный блок не занял всю память
+MAX_BLOCK_ROWS = 1_000_000
+
+_HEADER_LENGTH = struct.Struct("<H")
+_ROW_COUNT = struct.Struct("<I")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+class ColumnarFormatError(Exception):
+    """
+    Исключение при поврежденных данных формата columnar.
+    """
+
+
+def _little_endian(values: array) -> bytes:
+    if _BIG_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_ndjson(columns, batches):
+    """
+    Порции строк в NDJSON.
+    """
+    names = [name for name, _ in columns]
+    for rows in batches:
+        yield b"".join([orjson.dumps(dict(zip(names, row))) + b"\n" for row in rows])
+
+
+def encode_csv(columns, batches):
+    """
+    Порции строк в CSV со строкой заголовка.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([name for name, _ in columns])
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _encode_column(kind: str, values) -> bytes:
+    if kind == "int":
+        if None in values:
+            values = [NULL_INT if value is None else value for value in values]
+        return _little_endian(array("q", values))
+    encoded = [None if value is None else value.encode("utf-8") for value in values]
+    lengths = array("I", [NULL_LENGTH if value is None else len(value) for value in encoded])
+    return _little_endian(lengths) + b"".join([value for value in encoded if value])
+
+
+def encode_columnar(kind: str, columns, batches):
+    """
+    Порции строк в формате columnar: заголовок, блок на порцию и завершающий блок.
+    """
+    header = orjson.dumps({"kind": kind, "columns": [list(column) for column in columns]})
+    yield COLUMNAR_MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+    for rows in batches:
+        if not rows:
+            continue
+        parts = [_ROW_COUNT.pack(len(rows))]
+        for (_, column_kind), values in zip(columns, zip(*rows)):
+            parts.append(_encode_column(column_kind, values))
+        yield b"".join(parts)
+    yield _ROW_COUNT.pack(0)
+
+
+def encode(export_format: str, kind: str, batches):
+    """
+    Генератор байтов выгрузки kind (products, warehouses) в формате export_format.
+    """
+    columns = EXPORT_COLUMNS[kind]
+    if export_format == "ndjson":
+        return encode_ndjson(columns, batches)
+    if export_format == "csv":
+        return encode_csv(columns, batches)
+    return encode_columnar(kind, columns, batches)
+
+
+def gzip_chunks(chunks, level: int):
+    """
+    Потоковое сжатие gzip.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ColumnarDecoder:
+    """
+    Пошаговое чтение формата columnar из поступающих порций байтов.
+    feed() возвращает записи (словари) из полностью полученных блоков.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.finished = False
+        self._buffer = bytearray()
+
+    def _read_header(self) -> int:
+        if len(self._buffer) < 6:
+            return 0
+        if self._buffer[:4] != COLUMNAR_MAGIC:
+            raise ColumnarFormatError("Неизвестный формат двоичных данных")
+        (length,) = _HEADER_LENGTH.unpack_from(self._buffer, 4)
+        if len(self._buffer) < 6 + length:
+            return 0
+        try:
+            header = orjson.loads(bytes(self._buffer[6:6 + length]))
+            self.columns = [(name, kind) for name, kind in header["columns"]]
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValueError) as exc:
+            raise ColumnarFormatError(f"Некорректный заголовок: {exc}") from exc
+        if any(kind not in ("int", "str") for _, kind in self.columns):
+            raise ColumnarFormatError("Неизвестный тип столбца")
+        return 6 + length
+
+    def _read_block(self, offset: int):
+        """
+        Разбор блока, начинающегося с offset.
+        Возвращает (записи, смещение после блока) или None, если блок получен не полностью.
+        """
+        buffer = self._buffer
+        if len(buffer) < offset + 4:
+            return None
+        (count,) = _ROW_COUNT.unpack_from(buffer, offset)
+        offset += 4
+        if count == 0:
+            self.finished = True
+            return [], offset
+        if count > MAX_BLOCK_ROWS:
+            raise ColumnarFormatError(f"Слишком большой блок: {count} строк")
+        values = []
+        for _, kind in self.columns:
+            width = count * (8 if kind == "int" else 4)
+            if len(buffer) < offset + width:
+                return None
+            numbers = array("q" if kind == "int" else "I")
+            numbers.frombytes(bytes(buffer[offset:offset + width]))
+            if _BIG_ENDIAN:
+                numbers.byteswap()
+            offset += width
+            if kind == "int":
+                values.append([None if number == NULL_INT else number for number in numbers])
+                continue
+            size = sum(length for length in numbers if length != NULL_LENGTH)
+            if len(buffer) < offset + size:
+                return None
+            strings = []
+            for length in numbers:
+                if length == NULL_LENGTH:
+                    strings.append(None)
+                    continue
+                strings.append(bytes(buffer[offset:offset + length]).decode("utf-8"))
+                offset += length
+            values.append(strings)
+        names = [name for name, _ in self.columns]
+        return [dict(zip(names, row)) for row in zip(*values)], offset
+
+    def feed(self, data: bytes) -> list:
+        """
+        Добавление очередной порции байтов.
+        """
+        if self.finished:
+            if data:
+                raise ColumnarFormatError("Данные после завершающего блока")
+            return []
+        self._buffer += data
+        offset = 0
+        if self.columns is None:
+            offset = self._read_header()
+            if self.columns is None:
+                return []
+        records = []
+        try:
+            while not self.finished:
+                block = self._read_block(offset)
+                if block is None:
+                    break
+                block_records, offset = block
+                records.extend(block_records)
+        except UnicodeDecodeError as exc:
+            raise ColumnarFormatError(f"Некорректная строка UTF-8: {exc}") from exc
+        if self.finished and offset < len(self._buffer):
+            raise ColumnarFormatError("Данные после завершающего блока")
+        del self._buffer[:offset]
+        return records
+
+    def close(self):
+        """
+        Проверка, что данные завершились завершающим блоком.
+        """
+        if not self.finished:
+            raise ColumnarFormatError("Данные оборваны до завершающего блока")
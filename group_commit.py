@@ -0,0 +1,194 @@
+"""
+Групповая фиксация изменений (включается GROUP_COMMIT_ENABLED=1).
+Одиночные изменения из параллельных запросов ставятся в очередь единственному
+потоку записи, который применяет их в одной транзакции: до GROUP_COMMIT_MAX_OPS
+изменений, собранных за GROUP_COMMIT_WINDOW_MS миллисекунд. На SQLite каждая
+фиксация берет глобальную блокировку записи, а без WAL еще и выполняет fsync,
+поэтому одна фиксация на пакет вместо фиксации на запрос избавляет параллельные
+запросы от очереди за блокировкой.
+
+Каждое изменение пакета выполняется внутри SAVEPOINT: ошибка одного изменения
+откатывает только его и возвращается вызвавшему запросу, остальные изменения
+пакета фиксируются. Уведомления об изменениях (кэши, события) отправляются
+после фиксации пакета. Изменения, не принятые остановленным потоком записи,
+вызывающий выполняет в своей сессии.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config import GROUP_COMMIT_MAX_OPS, GROUP_COMMIT_WINDOW_MS
+from database import SessionLocal
+
+logger = logging.getLogger("warehouse.group_commit")
+
+
+class WriterStopped(Exception):
+    """
+    Исключение, если поток записи остановлен и изменение не было применено.
+    """
+
+
+class GroupCommitWriter:
+    """
+    Поток записи, фиксирующий изменения пакетами.
+    Изменение - функция apply(db, *args), возвращающая пару
+    (результат, уведомление после фиксации или None).
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        max_ops: int = GROUP_COMMIT_MAX_OPS,
+        window: float = GROUP_COMMIT_WINDOW_MS / 1000,
+    ):
+        self.session_factory = session_factory
+        self.max_ops = max_ops
+        self.window = window
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "operations": 0, "failed": 0, "max_batch": 0}
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Запущен ли поток записи.
+        """
+        return self._thread is not None
+
+    def start(self):
+        """
+        Запуск потока записи; повторный вызов ничего не делает.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Применение уже поставленных изменений и остановка потока записи.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                # Под блокировкой: после признака остановки изменения в очередь не попадают
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+            self._fail_pending()
+
+    def _fail_pending(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                item[2].set_exception(WriterStopped())
+
+    def submit(self, apply, *args):
+        """
+        Постановка изменения в очередь и ожидание фиксации пакета.
+        Возвращает результат изменения или вызывает его исключение;
+        WriterStopped - поток записи остановлен и изменение не применено.
+        """
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                raise WriterStopped()
+            self._queue.put((apply, args, future))
+        return future.result()
+
+    def _collect(self, first):
+        """
+        Пакет: первое изменение и изменения, поступившие в течение окна.
+        Возвращает пакет и признак остановки.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_ops:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, stopping = self._collect(item)
+            try:
+                self._apply(batch)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Ошибка групповой фиксации")
+
+    def _apply(self, batch: list):
+        outcomes = []
+        # Единственному изменению пакета SAVEPOINT не нужен: при ошибке откатывается транзакция
+        nested = len(batch) > 1
+        db = self.session_factory()
+        try:
+            # Транзакция пакета начинается явно, чтобы SAVEPOINT выполнялись внутри нее
+            db.connection(execution_options={"sqlite_begin_immediate": True})
+            for apply, args, future in batch:
+                savepoint = db.begin_nested() if nested else None
+                try:
+                    result, notify = apply(db, *args)
+                    if savepoint is not None:
+                        savepoint.commit()
+                except Exception as exc:  # pylint: disable=broad-except
+                    if savepoint is not None:
+                        savepoint.rollback()
+                    else:
+                        db.rollback()
+                    outcomes.append((future, None, None, exc))
+                    continue
+                outcomes.append((future, result, notify, None))
+            db.commit()
+        except Exception as exc:  # pylint: disable=broad-except
+            db.rollback()
+            for future, _, _, error in outcomes:
+                future.set_exception(error or exc)
+            for _, _, future in batch[len(outcomes):]:
+                future.set_exception(exc)
+            raise
+        finally:
+            db.close()
+        failed = 0
+        for future, result, notify, error in outcomes:
+            if error is not None:
+                failed += 1
+                future.set_exception(error)
+                continue
+            if notify is not None:
+                try:
+                    notify()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Ошибка уведомления после групповой фиксации")
+            future.set_result(result)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["operations"] += len(batch)
+            self._stats["failed"] += failed
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+
+    def stats(self):
+        """
+        Счетчики пакетов и изменений.
+        """
+        with self._lock:
+            return {"enabled": self.enabled, **self._stats}
+
+
+group_writer = GroupCommitWriter()
@@ -0,0 +1,119 @@
+"""
+Модуль хеширования паролей в отдельном пуле потоков.
+Вычисления bcrypt выносятся из потоков обработки запросов,
+а ограничение очереди защищает сервис от всплесков авторизации.
+passlib импортируется и загружает bcrypt при первом обращении, а не при импорте.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import HASH_WORKERS, HASH_QUEUE_LIMIT
+from metrics import record_hash_time
+
+_pwd_context = None
+
+
+def get_pwd_context():
+    """
+    Контекст passlib для bcrypt, создаваемый при первом обращении.
+    """
+    global _pwd_context  # pylint: disable=global-statement
+    if _pwd_context is None:
+        # pylint: disable=import-outside-toplevel
+        from passlib.context import CryptContext
+
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
+
+def load_hashing_backend():
+    """
+    Загрузка бэкенда bcrypt без вычисления хеша (для прогрева при запуске).
+    """
+    get_pwd_context().handler("bcrypt").get_backend()
+
+
+class HashingOverloaded(Exception):
+    """
+    Исключение при переполнении очереди хеширования.
+    """
+
+
+class PasswordHasher:
+    """
+    Пул потоков для bcrypt с ограничением глубины очереди и метриками задержек.
+    """
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._metrics = {
+            "hash": {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+            "verify": {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+        }
+
+    def _acquire(self):
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_limit:
+                self._rejected += 1
+                raise HashingOverloaded("Очередь хеширования паролей переполнена")
+            self._in_flight += 1
+
+    def _release(self, operation: str, elapsed: float):
+        with self._lock:
+            self._in_flight -= 1
+            metric = self._metrics[operation]
+            metric["count"] += 1
+            metric["total_seconds"] += elapsed
+            metric["max_seconds"] = max(metric["max_seconds"], elapsed)
+
+    async def _run(self, operation: str, func, *args):
+        self._acquire()
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._release(operation, elapsed)
+            record_hash_time(elapsed)
+
+    async def hash(self, password: str) -> str:
+        """
+        Асинхронное хеширование пароля.
+        """
+        return await self._run("hash", get_pwd_context().hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """
+        Асинхронная проверка пароля.
+        """
+        return await self._run("verify", get_pwd_context().verify, password, hashed_password)
+
+    def stats(self):
+        """
+        Метрики пула: глубина очереди, отказы и задержки по операциям.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected,
+                "operations": {name: dict(metric) for name, metric in self._metrics.items()},
+            }
+
+    def shutdown(self):
+        """
+        Остановка пула потоков.
+        """
+        self._executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher()
@@ -2,22 +2,79 @@
 Основной модуль приложения FastAPI.
 Содержит определения маршрутов API и конфигурацию приложения.
 """
-from fastapi import FastAPI, Depends, HTTPException, Security
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import (
+    APIRouter, FastAPI, Depends, HTTPException, Security, Query, Path, Request, Response,
+    WebSocket, WebSocketDisconnect, Header,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import TypeAdapter
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 
-import uvicorn
 import schemas
 import crud
 import models
-from database import get_db, engine, Base
-
-# Создаем таблицы
-Base.metadata.create_all(bind=engine)
+import bulk
+import export
+import metrics
+import config
+import serializers
+from hashing import password_hasher, HashingOverloaded
+from token_cache import token_cache
+from profiler import profiler, ProfilerBusy, ProfilerMiddleware
+from events import event_bus
+from cluster import cluster
+from group_commit import group_writer
+from admission import admission, AdmissionMiddleware
+from replicas import replica_router, get_read_db, may_cache, ReadYourWritesMiddleware
+from compression import CompressionMiddleware, compressed_cache, compression_stats
+from versions import data_versions, make_etag, etag_matches
+from response_cache import (
+    response_cache, warehouse_tag, WAREHOUSES_TAG, PRODUCTS_TAG, ALL_WAREHOUSES_TAG,
+)
+from config import (
+    MAX_PAGE_SIZE, STREAM_BATCH_SIZE, BULK_CHUNK_SIZE, EVENT_KEEPALIVE_SECONDS,
+    EXPORT_BATCH_SIZE, EXPORT_GZIP_LEVEL,
+)
+from database import get_db, engine
+from migrations import migrate
+from warmup import warm_up
 
-app = FastAPI()
+metrics.instrument_engine(engine)
+router = APIRouter()
 security = HTTPBearer()
 
+
+def _validated_json(schema):
+    """
+    Сериализатор ответа через pydantic с проверкой ORM объектов по схеме.
+    """
+    adapter = TypeAdapter(schema)
+
+    def dump(data) -> bytes:
+        return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+    return dump
+
+
+# Сериализаторы ответов маршрутов чтения, использующих кэш ответов.
+# Списки складов и продуктов сериализуются быстрым путем (модуль serializers).
+WAREHOUSE_SUMMARY_LIST_JSON = _validated_json(list[schemas.WarehouseSummary])
+WAREHOUSE_JSON = _validated_json(schemas.Warehouse)
+WAREHOUSE_STATS_LIST_JSON = _validated_json(list[schemas.WarehouseStats])
+WAREHOUSE_STATS_JSON = _validated_json(schemas.WarehouseStats)
+
+
+def _stateless_tokens() -> bool:
+    return config.TOKEN_VERIFICATION == "stateless"
+
+
 # Функция для получения текущего пользователя по токену
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Security(security),
@@ -26,8 +83,9 @@ async def get_current_user(
     """
     Получение текущего пользователя из JWT токена.
     Используется для защиты маршрутов API с помощью Depends().
+    При TOKEN_VERIFICATION=stateless пользователь берется из утверждений токена.
     """
-    user = crud.get_user_from_token(db, credentials.credentials)
+    user = crud.get_user_from_token(db, credentials.credentials, stateless=_stateless_tokens())
     if user is None:
         raise HTTPException(
             status_code=401,
@@ -37,13 +95,123 @@ async def get_current_user(
     return user
 
 
-@app.post("/register", response_model=schemas.UserResponse)
-def register(user: schemas.UserRegister, db: Session = Depends(get_db)):
+async def get_admin_user(current_user: models.User = Depends(get_current_user)):
+    """
+    Проверка, что текущий пользователь указан в ADMIN_USERNAMES.
+    """
+    if current_user.username not in config.ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Требуются права администратора")
+    return current_user
+
+
+def _stream_ndjson(db: Session, query, dump_line):
+    """
+    Потоковая выдача результатов запроса в формате NDJSON.
+    Строки читаются серверным курсором порциями, поэтому память не растет с размером таблицы.
+    dump_line(row) возвращает строку NDJSON для одной записи.
+    """
+    try:
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield dump_line(row)
+    finally:
+        db.close()
+
+
+def _warehouse_ndjson(warehouse) -> str:
+    return schemas.Warehouse.model_validate(warehouse).model_dump_json() + "\n"
+
+
+def _etag(request: Request, *versions) -> str:
+    """
+    ETag ответа из версий данных, пути и параметров запроса.
+    Версии нужно читать до выполнения запроса к базе данных.
+    """
+    return make_etag(request.url.path, sorted(request.query_params.multi_items()), *versions)
+
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    """
+    Ответ 304, если ETag клиента совпадает с текущим.
+    """
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+def _next_cursor_headers(rows: list, limit: Optional[int], key: str = "id") -> dict:
+    """
+    Курсор следующей страницы для заголовка X-Next-After.
+    """
+    if limit is not None and len(rows) == limit:
+        return {"X-Next-After": str(getattr(rows[-1], key))}
+    return {}
+
+
+def _cached_json(request: Request, etag: str, tags: list, dump, load):
+    """
+    Ответ из кэша сериализованных ответов либо вычисление и сохранение нового.
+    load() возвращает данные для сериализации и дополнительные заголовки ответа,
+    dump(data) возвращает тело ответа в JSON.
+    """
+    key = response_cache.key(request.url.path, request.query_params.multi_items())
+    cached = response_cache.get(key)
+    if cached is None:
+        token = response_cache.begin(tags)
+        data, headers = load()
+        body = dump(data)
+        if not may_cache(request):
+            # Данные реплики сразу после изменения могут быть устаревшими:
+            # ответ не сохраняется ни в кэше, ни у клиента по ETag
+            return Response(content=body, media_type="application/json", headers=headers)
+        cached = response_cache.store(key, body, headers, tags, token)
+    return Response(
+        content=cached.body,
+        media_type="application/json",
+        headers={**cached.headers, "ETag": etag},
+    )
+
+
+def _duplicate_product():
+    """
+    Ответ 409 при повторяющемся названии продукта в пределах склада.
+    """
+    return HTTPException(
+        status_code=409,
+        detail="Продукт с таким названием уже есть на складе"
+    )
+
+
+def _hashing_unavailable():
+    """
+    Ответ 503 при переполнении очереди хеширования паролей.
+    """
+    return HTTPException(
+        status_code=503,
+        detail="Сервис авторизации перегружен, повторите попытку позже",
+        headers={"Retry-After": "1"},
+    )
+
+
+@router.post("/register", response_model=schemas.UserResponse)
+async def register(user: schemas.UserRegister, db: Session = Depends(get_db)):
     """
     Регистрация нового пользователя.
+    Хеширование пароля выполняется в отдельном пуле потоков,
+    запросы к базе данных - в пуле потоков FastAPI, чтобы не блокировать цикл событий.
     """
-    # Проверяем, существует ли пользователь с таким именем
-    db_user = crud.create_user(db=db, user=user)
+    # Проверяем, существует ли пользователь с таким именем до вычисления хеша
+    if await run_in_threadpool(crud.get_user_by_username, db, username=user.username):
+        raise HTTPException(
+            status_code=400,
+            detail="Пользователь с таким именем уже существует"
+        )
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except HashingOverloaded as exc:
+        raise _hashing_unavailable() from exc
+    db_user = await run_in_threadpool(
+        crud.create_user, db=db, user=user, hashed_password=hashed_password
+    )
     if not db_user:
         raise HTTPException(
             status_code=400,
@@ -52,19 +220,37 @@ def register(user: schemas.UserRegister, db: Session = Depends(get_db)):
     return db_user
 
 
-@app.post("/login")
-def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
+@router.post("/login")
+async def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
     """
     Аутентификация пользователя и выдача JWT токена.
+    Проверка пароля выполняется в отдельном пуле потоков,
+    запрос пользователя - в пуле потоков FastAPI.
     """
-    db_user = crud.authenticate_user(db=db, username=user.username, password=user.password)
-    if not db_user:
-        raise HTTPException(status_code=400, detail="Invalid credentials")
+    db_user = await run_in_threadpool(crud.get_user_by_username, db, username=user.username)
+    try:
+        if not db_user or not await password_hasher.verify(user.password, db_user.password):
+            raise HTTPException(status_code=400, detail="Invalid credentials")
+    except HashingOverloaded as exc:
+        raise _hashing_unavailable() from exc
     token = crud.create_jwt_token(user=db_user)
     return {"access_token": token, "token_type": "bearer"}
 
 
-@app.post("/warehouses/", response_model=schemas.Warehouse)
+@router.post("/logout")
+def logout(
+    credentials: HTTPAuthorizationCredentials = Security(security),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Отзыв текущего токена.
+    """
+    crud.revoke_token(db, credentials.credentials)
+    return {"detail": "Токен отозван"}
+
+
+@router.post("/warehouses/", response_model=schemas.Warehouse)
 def create_warehouse(
     warehouse: schemas.WarehouseCreate,
     current_user: models.User = Depends(get_current_user),
@@ -76,34 +262,158 @@ def create_warehouse(
     return crud.create_warehouse(db=db, warehouse=warehouse)
 
 
-@app.get("/warehouses/", response_model=list[schemas.Warehouse])
+@router.get("/warehouses/", response_model=list[schemas.Warehouse])
 def get_warehouses(
+    request: Request,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    name: Optional[str] = None,
+    include_products: bool = True,
+    stream: bool = False,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
+):
+    """
+    Получение списка складов.
+    Поддерживает постраничную навигацию (after, limit), фильтр по префиксу названия
+    и потоковую выдачу в формате NDJSON (stream=true).
+    Продукты всех складов загружаются одним запросом; при include_products=false не загружаются.
+    Список выбирается кортежами столбцов и сериализуется без моделей pydantic.
+    """
+    etag = _etag(request, data_versions.warehouses, data_versions.products)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    if stream:
+        query = crud.get_warehouses(
+            db, after=after, limit=limit, name=name, include_products=include_products
+        )
+        return StreamingResponse(
+            _stream_ndjson(db, query, _warehouse_ndjson),
+            media_type="application/x-ndjson",
+            headers={"ETag": etag},
+        )
+
+    def load():
+        warehouses = crud.get_warehouse_rows(db, after=after, limit=limit, name=name).all()
+        products = []
+        if include_products:
+            products = crud.get_warehouse_product_rows(db, [row.id for row in warehouses])
+        return (warehouses, products), _next_cursor_headers(warehouses, limit)
+
+    return _cached_json(
+        request, etag, [WAREHOUSES_TAG, PRODUCTS_TAG],
+        lambda data: serializers.warehouses_json(*data), load,
+    )
+
+
+@router.get("/warehouses/summary", response_model=list[schemas.WarehouseSummary])
+def get_warehouse_summaries(
+    request: Request,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    name: Optional[str] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
 ):
     """
-    Получение списка всех складов.
+    Получение сводки по складам: количество продуктов и суммарный остаток.
     """
-    warehouses = db.query(models.Warehouse).all()
-    return warehouses
+    etag = _etag(request, data_versions.warehouses, data_versions.products)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    def load():
+        summaries = crud.get_warehouse_summaries(db, after=after, limit=limit, name=name).all()
+        return summaries, _next_cursor_headers(summaries, limit)
 
+    return _cached_json(
+        request, etag, [WAREHOUSES_TAG, PRODUCTS_TAG], WAREHOUSE_SUMMARY_LIST_JSON, load
+    )
+
+
+@router.get("/warehouses/stats", response_model=list[schemas.WarehouseStats])
+def get_warehouses_stats(
+    request: Request,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Получение итогов складов: количество продуктов и суммарный остаток.
+    Итоги поддерживаются при изменении продуктов и не требуют обхода продуктов.
+    """
+    etag = _etag(request, data_versions.warehouses, data_versions.products)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
 
-@app.get("/warehouses/{warehouse_id}", response_model=schemas.Warehouse)
+    def load():
+        stats = crud.get_warehouses_stats(db, after=after, limit=limit).all()
+        return stats, _next_cursor_headers(stats, limit, key="warehouse_id")
+
+    return _cached_json(
+        request, etag, [WAREHOUSES_TAG, PRODUCTS_TAG], WAREHOUSE_STATS_LIST_JSON, load
+    )
+
+
+@router.get("/warehouses/{warehouse_id}/stats", response_model=schemas.WarehouseStats)
+def get_warehouse_stats(
+    request: Request,
+    warehouse_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Получение итогов конкретного склада.
+    """
+    etag = _etag(request, data_versions.warehouse(warehouse_id))
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    def load():
+        stats = crud.get_warehouse_stats(db, warehouse_id)
+        if stats is None:
+            raise HTTPException(status_code=404, detail="Склад не найден")
+        return stats, {}
+
+    return _cached_json(
+        request, etag, [warehouse_tag(warehouse_id), ALL_WAREHOUSES_TAG],
+        WAREHOUSE_STATS_JSON, load,
+    )
+
+
+@router.get("/warehouses/{warehouse_id}", response_model=schemas.Warehouse)
 def get_warehouse(
+    request: Request,
     warehouse_id: int,
+    include_products: bool = True,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Получение информации о конкретном складе по его ID.
     """
-    warehouse = db.query(models.Warehouse).filter(models.Warehouse.id == warehouse_id).first()
-    if warehouse is None:
-        raise HTTPException(status_code=404, detail="Склад не найден")
-    return warehouse
+    etag = _etag(request, data_versions.warehouse(warehouse_id))
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    def load():
+        warehouse = crud.get_warehouse(db, warehouse_id, include_products=include_products)
+        if warehouse is None:
+            raise HTTPException(status_code=404, detail="Склад не найден")
+        return warehouse, {}
+
+    return _cached_json(
+        request, etag, [warehouse_tag(warehouse_id), ALL_WAREHOUSES_TAG], WAREHOUSE_JSON, load
+    )
 
 
-@app.post("/products/", response_model=schemas.Product)
+@router.post("/products/", response_model=schemas.Product)
 def create_product(
     product: schemas.ProductCreate,
     current_user: models.User = Depends(get_current_user),
@@ -112,25 +422,145 @@ def create_product(
     """
     Создание нового продукта.
     """
-    product = crud.create_product(db=db, product=product)
+    try:
+        product = crud.create_product(db=db, product=product)
+    except crud.DuplicateProduct as exc:
+        raise _duplicate_product() from exc
     if product is None:
         raise HTTPException(status_code=404, detail="Склад не найден")
     return product
 
 
-@app.get("/products/", response_model=list[schemas.Product])
-def get_products(
+@router.post("/products/bulk", response_model=schemas.BulkResult)
+async def bulk_create_products(
+    request: Request,
+    upsert: bool = False,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Получение списка всех продуктов.
+    Массовая загрузка продуктов.
+    Принимает JSON массив, NDJSON (application/x-ndjson) или CSV (text/csv).
+    Строки записываются пакетами по BULK_CHUNK_SIZE; при upsert=true строки с id
+    обновляют существующие продукты. Ошибки возвращаются для каждой строки.
+    """
+    warehouse_ids = await run_in_threadpool(crud.get_warehouse_ids, db)
+    return await _bulk_write(
+        request,
+        lambda record: bulk.validate_record(record, warehouse_ids),
+        lambda batch: crud.bulk_write_products(db, batch, upsert),
+    )
+
+
+async def _bulk_write(request: Request, validate, write_batch) -> schemas.BulkResult:
+    """
+    Потоковая запись строк тела запроса пакетами по BULK_CHUNK_SIZE.
+    validate(запись) возвращает значения или строку ошибки,
+    write_batch(пакет) выполняется в пуле потоков и возвращает (записано, ошибки).
+    """
+    written, errors, batch = 0, [], []
+
+    async def flush():
+        nonlocal written
+        batch_written, batch_errors = await run_in_threadpool(write_batch, list(batch))
+        written += batch_written
+        errors.extend(batch_errors)
+        batch.clear()
+
+    try:
+        async for index, record in bulk.iter_records(request):
+            values = validate(record)
+            if isinstance(values, str):
+                errors.append((index, values))
+                continue
+            batch.append((index, values))
+            if len(batch) >= BULK_CHUNK_SIZE:
+                await flush()
+    except bulk.BulkFormatError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if batch:
+        await flush()
+
+    errors.sort()
+    return schemas.BulkResult(
+        written=written,
+        failed=len(errors),
+        errors=[schemas.BulkRowError(row=index, error=error) for index, error in errors],
+    )
+
+
+@router.get("/products/", response_model=list[schemas.Product])
+def get_products(
+    request: Request,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    warehouse_id: Optional[int] = None,
+    name: Optional[str] = None,
+    min_quantity: Optional[int] = None,
+    max_quantity: Optional[int] = None,
+    stream: bool = False,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Получение списка продуктов.
+    Поддерживает постраничную навигацию (after, limit), фильтры по складу,
+    префиксу названия и диапазону количества, а также потоковую выдачу NDJSON (stream=true).
+    Список выбирается кортежами столбцов и сериализуется без моделей pydantic.
+    """
+    etag = _etag(request, data_versions.products)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    query = crud.get_product_rows(
+        db,
+        after=after,
+        limit=limit,
+        warehouse_id=warehouse_id,
+        name=name,
+        min_quantity=min_quantity,
+        max_quantity=max_quantity,
+    )
+    if stream:
+        return StreamingResponse(
+            _stream_ndjson(db, query, serializers.product_ndjson),
+            media_type="application/x-ndjson",
+            headers={"ETag": etag},
+        )
+
+    def load():
+        products = query.all()
+        return products, _next_cursor_headers(products, limit)
+
+    return _cached_json(request, etag, [PRODUCTS_TAG], serializers.products_json, load)
+
+
+@router.get("/products/search", response_model=list[schemas.Product])
+def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    warehouse_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Поиск продуктов по названию.
+    Каждое слово запроса ищется как префикс слов названия (без учета регистра),
+    результаты упорядочены по релевантности; warehouse_id ограничивает поиск складом.
     """
-    products = db.query(models.Product).all()
-    return products
+    etag = _etag(request, data_versions.products)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    def load():
+        return crud.search_products(db, q, warehouse_id=warehouse_id, limit=limit), {}
+
+    return _cached_json(request, etag, [PRODUCTS_TAG], serializers.products_json, load)
 
 
-@app.put("/products/{product_id}", response_model=schemas.Product)
+@router.put("/products/{product_id}", response_model=schemas.Product)
 def update_product(
     product_id: int,
     product: schemas.ProductCreate,
@@ -140,13 +570,63 @@ def update_product(
     """
     Обновление информации о продукте.
     """
-    db_product = crud.update_product(db=db, product_id=product_id, product=product)
+    try:
+        db_product = crud.update_product(db=db, product_id=product_id, product=product)
+    except crud.DuplicateProduct as exc:
+        raise _duplicate_product() from exc
     if db_product is None:
         raise HTTPException(status_code=404, detail="Продукт не найден")
     return db_product
 
 
-@app.delete("/products/{product_id}", response_model=schemas.Product)
+def _insufficient_stock(exc: crud.InsufficientStock):
+    """
+    Ответ 409 при попытке уменьшить остаток ниже нуля.
+    """
+    return HTTPException(status_code=409, detail=str(exc))
+
+
+@router.post("/products/adjust", response_model=list[schemas.Product])
+def adjust_products(
+    adjustments: list[schemas.StockAdjustmentItem],
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Атомарное изменение остатков нескольких продуктов.
+    Все изменения применяются в одной транзакции либо не применяются вовсе.
+    """
+    try:
+        rows, missing_id = crud.adjust_product_quantities(
+            db, [(item.product_id, item.delta) for item in adjustments]
+        )
+    except crud.InsufficientStock as exc:
+        raise _insufficient_stock(exc) from exc
+    if rows is None:
+        raise HTTPException(status_code=404, detail=f"Продукт не найден: {missing_id}")
+    return rows
+
+
+@router.post("/products/{product_id}/adjust", response_model=schemas.Product)
+def adjust_product(
+    product_id: int,
+    adjustment: schemas.StockAdjustment,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Атомарное изменение остатка продукта на delta одним оператором UPDATE.
+    """
+    try:
+        row = crud.adjust_product_quantity(db, product_id, adjustment.delta)
+    except crud.InsufficientStock as exc:
+        raise _insufficient_stock(exc) from exc
+    if row is None:
+        raise HTTPException(status_code=404, detail="Продукт не найден")
+    return row
+
+
+@router.delete("/products/{product_id}", response_model=schemas.Product)
 def delete_product(
     product_id: int,
     current_user: models.User = Depends(get_current_user),
@@ -161,5 +641,298 @@ def delete_product(
     return db_product
 
 
+# Расширения файлов выгрузки для заголовка Content-Disposition
+EXPORT_EXTENSIONS = {"ndjson": "ndjson", "csv": "csv", "columnar": "whc"}
+
+
+def _export_stream(db: Session, kind: str, export_format: str, gzip: bool):
+    """
+    Генератор байтов выгрузки; сессия закрывается после выдачи последней порции.
+    """
+    try:
+        chunks = export.encode(
+            export_format, kind, crud.export_batches(db, kind, EXPORT_BATCH_SIZE)
+        )
+        if gzip:
+            chunks = export.gzip_chunks(chunks, EXPORT_GZIP_LEVEL)
+        yield from chunks
+    finally:
+        db.close()
+
+
+@router.get("/export/{kind}")
+def export_snapshot(
+    kind: str = Path(pattern="^(products|warehouses)$"),
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv|columnar)$"),
+    gzip: bool = False,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Полная выгрузка продуктов или складов (без вложенных продуктов) в порядке id.
+    Строки читаются серверным курсором порциями по EXPORT_BATCH_SIZE и кодируются
+    в NDJSON, CSV или двоичный формат columnar (см. export.py) без создания
+    ORM объектов и моделей pydantic. При gzip=true ответ сжимается потоково
+    (Content-Encoding: gzip).
+    """
+    headers = {
+        "Content-Disposition": f'attachment; filename="{kind}.{EXPORT_EXTENSIONS[export_format]}"',
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        _export_stream(db, kind, export_format, gzip),
+        media_type=export.FORMATS[export_format],
+        headers=headers,
+    )
+
+
+@router.post("/import/{kind}", response_model=schemas.BulkResult)
+async def import_snapshot(
+    request: Request,
+    kind: str = Path(pattern="^(products|warehouses)$"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Восстановление из выгрузки GET /export/{kind}: тело в том же формате
+    (тип определяется по Content-Type, сжатие - по Content-Encoding) читается потоково.
+    Строки с id вставляются или обновляют существующие записи;
+    склады нужно загружать раньше их продуктов.
+    """
+    if kind == "warehouses":
+        result = await _bulk_write(
+            request,
+            bulk.validate_warehouse_record,
+            lambda batch: crud.bulk_write_warehouses(db, batch),
+        )
+    else:
+        warehouse_ids = await run_in_threadpool(crud.get_warehouse_ids, db)
+        result = await _bulk_write(
+            request,
+            lambda record: bulk.validate_record(record, warehouse_ids),
+            lambda batch: crud.bulk_write_products(db, batch, True),
+        )
+    await run_in_threadpool(crud.sync_id_sequences, db)
+    return result
+
+
+def _resync_event():
+    """
+    Служебное событие: пропущенные события недоступны, клиенту нужно перечитать данные.
+    """
+    return {"seq": event_bus.sequence, "type": "resync", "warehouse_ids": [], "data": None}
+
+
+async def _iter_events(warehouse_id: Optional[int], last_seq: Optional[int]):
+    """
+    Асинхронный генератор событий подписки: сначала пропущенные события из истории,
+    затем новые. None означает таймаут ожидания (для keep-alive).
+    """
+    subscription, missed = event_bus.subscribe(warehouse_id=warehouse_id, last_seq=last_seq)
+    try:
+        for event in missed if missed is not None else [_resync_event()]:
+            yield event
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(), timeout=EVENT_KEEPALIVE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if event is None:
+                # Очередь подписчика переполнена
+                yield _resync_event()
+                return
+            yield event
+    finally:
+        event_bus.unsubscribe(subscription)
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    warehouse_id: Optional[int] = None,
+    last_event_id: Optional[int] = Header(None),
+    after: Optional[int] = None,
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    Поток событий изменения складов и продуктов (Server-Sent Events).
+    warehouse_id ограничивает события одним складом. Для возобновления после
+    разрыва передается заголовок Last-Event-ID или параметр after.
+    """
+    last_seq = last_event_id if last_event_id is not None else after
+
+    async def event_source():
+        async for event in _iter_events(warehouse_id, last_seq):
+            if await request.is_disconnected():
+                return
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            # Событие без номера не меняет Last-Event-ID клиента
+            event_id = f"id: {event['seq']}\n" if event["seq"] is not None else ""
+            yield f"{event_id}event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/events/ws")
+async def events_websocket(
+    websocket: WebSocket,
+    token: str,
+    warehouse_id: Optional[int] = None,
+    after: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Поток событий изменения складов и продуктов через WebSocket.
+    Токен передается параметром token, так как браузеры не позволяют задать заголовки.
+    """
+    if crud.get_user_from_token(db, token, stateless=_stateless_tokens()) is None:
+        await websocket.close(code=1008)
+        return
+    db.close()
+    await websocket.accept()
+    try:
+        async for event in _iter_events(warehouse_id, after):
+            if event is not None:
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Метрики производительности в текстовом формате Prometheus.
+    """
+    return PlainTextResponse(
+        metrics.render([
+            lambda: metrics.cache_metrics("token_cache", token_cache.stats()),
+            lambda: metrics.cache_metrics("response_cache", response_cache.stats()),
+            lambda: metrics.hashing_metrics(password_hasher.stats()),
+            lambda: metrics.cluster_metrics(cluster.stats()),
+            lambda: metrics.group_commit_metrics(group_writer.stats()),
+            lambda: metrics.admission_metrics(admission.stats()),
+            lambda: metrics.replica_metrics(replica_router.stats()),
+            lambda: metrics.cache_metrics("compressed_cache", compressed_cache.stats()),
+            lambda: metrics.compression_metrics(compression_stats.stats()),
+        ]),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@router.post("/admin/profile", response_class=PlainTextResponse)
+async def profile(
+    request: Request,
+    seconds: float = Query(10, gt=0),
+    requests: Optional[int] = Query(None, ge=1),
+    route: Optional[str] = None,
+    interval_ms: float = Query(5, ge=1, le=1000),
+    admin_user: models.User = Depends(get_admin_user),
+):
+    """
+    Семплирующее профилирование процесса в течение seconds секунд
+    или до завершения requests запросов (с фильтром route - к этому маршруту).
+    При фильтре route учитываются стеки, проходящие через обработчик маршрута.
+    Возвращает collapsed stacks для построения flamegraph.
+    Доступно только при PROFILER_ENABLED=1.
+    """
+    if not config.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Профилировщик отключен")
+    route_codes = []
+    if route is not None:
+        route_codes = [
+            r.endpoint.__code__ for r in request.app.routes
+            if getattr(r, "path", None) == route and hasattr(r.endpoint, "__code__")
+        ]
+        if not route_codes:
+            raise HTTPException(status_code=404, detail="Маршрут не найден")
+    try:
+        session = profiler.start(
+            seconds=min(seconds, config.PROFILER_MAX_SECONDS),
+            interval=interval_ms / 1000,
+            requests=requests,
+            route=route,
+            route_codes=route_codes,
+        )
+    except ProfilerBusy as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    while not session.done.is_set():
+        await asyncio.sleep(0.05)
+    return PlainTextResponse(
+        session.collapsed(),
+        headers={"X-Profile-Samples": str(session.sample_count)},
+    )
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """
+    Запуск и остановка процесса: синхронизация схемы, канал согласования кэшей
+    (в режиме нескольких процессов), поток групповой фиксации и прогрев.
+    """
+    if application.state.schema_sync == "startup":
+        # Миграция выполняется под файловой блокировкой,
+        # поэтому одновременно запускаемые процессы не мешают друг другу
+        await run_in_threadpool(migrate, engine)
+    if config.CLUSTER_ENABLED:
+        cluster.start()
+    if config.GROUP_COMMIT_ENABLED:
+        group_writer.start()
+    if application.state.warmup:
+        await run_in_threadpool(warm_up)
+    yield
+    await run_in_threadpool(group_writer.stop)
+    cluster.stop()
+
+
+def create_app(
+    schema_sync: str = config.SCHEMA_SYNC, warmup: bool = config.WARMUP_ENABLED
+) -> FastAPI:
+    """
+    Создание приложения FastAPI.
+    Импорт модуля не обращается к базе данных: схема синхронизируется
+    и процесс прогревается при запуске приложения (lifespan).
+    """
+    application = FastAPI(lifespan=lifespan)
+    application.state.schema_sync = schema_sync
+    application.state.warmup = warmup
+    if config.COMPRESSION_ENABLED:
+        # Время сжатия учитывается в метриках маршрутов
+        application.add_middleware(CompressionMiddleware, cache=compressed_cache)
+    application.add_middleware(metrics.MetricsMiddleware)
+    if replica_router.enabled:
+        application.add_middleware(ReadYourWritesMiddleware, router=replica_router)
+    if config.ADMISSION_ENABLED:
+        # Отклоненные запросы не попадают в метрики маршрутов
+        application.add_middleware(AdmissionMiddleware, controller=admission)
+    if config.PROFILER_ENABLED:
+        application.add_middleware(ProfilerMiddleware, profiler=profiler)
+    application.include_router(router)
+    return application
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    # pylint: disable=import-outside-toplevel
+    if config.WORKERS > 1:
+        from server import serve
+
+        # Схема обновляется один раз в родительском процессе до запуска рабочих
+        if config.SCHEMA_SYNC == "startup":
+            migrate(engine)
+        serve(create_app(schema_sync="off"), config.SERVER_HOST, config.SERVER_PORT, config.WORKERS)
+    else:
+        import uvicorn
+
+        uvicorn.run(app, host=config.SERVER_HOST, port=config.SERVER_PORT)
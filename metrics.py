@@ -0,0 +1,356 @@
+"""
+Метрики производительности запросов в формате Prometheus.
+Middleware измеряет время обработки каждого маршрута, обработчики событий
+SQLAlchemy считают количество и время SQL запросов, а пул хеширования
+сообщает время bcrypt. Медленные запросы записываются в журнал вместе с SQL.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+from config import SLOW_REQUEST_SECONDS, SLOW_REQUEST_MAX_STATEMENTS
+
+logger = logging.getLogger("warehouse.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class RequestStats:
+    """
+    Статистика одного запроса: SQL запросы, их суммарное время и время bcrypt.
+    """
+
+    __slots__ = ("sql_count", "sql_seconds", "hash_seconds", "statements")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.statements = []
+
+
+# Статистика текущего запроса; переносится в потоки пула вместе с контекстом
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class Histogram:
+    """
+    Гистограмма с метками в формате Prometheus.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """
+        Добавление наблюдения.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        """
+        Строки текстового формата Prometheus.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(buckets), count, total)
+                     for key, (buckets, count, total) in sorted(self._series.items())]
+        for key, buckets, count, total in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(key, le=_number(bound))} {cumulative}")
+            lines.append(f'{self.name}_bucket{_labels(key, le="+Inf")} {count}')
+            lines.append(f"{self.name}_count{_labels(key)} {count}")
+            lines.append(f"{self.name}_sum{_labels(key)} {_number(total)}")
+        return lines
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key, **extra) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _sample(name: str, kind: str, documentation: str, value, **labels):
+    return [
+        f"# HELP {name} {documentation}",
+        f"# TYPE {name} {kind}",
+        f"{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}",
+    ]
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP запроса по маршрутам"
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements", "Количество SQL запросов на HTTP запрос", COUNT_BUCKETS
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "http_request_sql_duration_seconds", "Суммарное время SQL запросов на HTTP запрос"
+)
+REQUEST_HASH_SECONDS = Histogram(
+    "http_request_bcrypt_duration_seconds", "Время bcrypt на HTTP запрос (/login, /register)"
+)
+
+
+def record_hash_time(seconds: float):
+    """
+    Учет времени bcrypt в статистике текущего запроса.
+    """
+    stats = current_request.get()
+    if stats is not None:
+        stats.hash_seconds += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_statement(conn, statement)
+
+
+def _handle_error(context):
+    # Для запроса, завершившегося ошибкой, after_cursor_execute не вызывается:
+    # время начала снимается со стека здесь, иначе оно достанется следующему запросу
+    connection = context.connection
+    if (
+        connection is not None
+        and context.execution_context is not None
+        and connection.info.get("query_started")
+    ):
+        _record_statement(connection, context.statement)
+
+
+def _record_statement(conn, statement):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = current_request.get()
+    if stats is None:
+        return
+    stats.sql_count += 1
+    stats.sql_seconds += elapsed
+    if len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+def instrument_engine(engine):
+    """
+    Подключение обработчиков событий SQLAlchemy к движку.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware, измеряющее каждый HTTP запрос.
+    Метка route - шаблон пути маршрута, чтобы число рядов метрик не зависело от id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            labels = {"method": scope["method"], "route": route}
+            REQUEST_SECONDS.observe(elapsed, status=status["code"], **labels)
+            REQUEST_SQL_STATEMENTS.observe(stats.sql_count, **labels)
+            REQUEST_SQL_SECONDS.observe(stats.sql_seconds, **labels)
+            if stats.hash_seconds:
+                REQUEST_HASH_SECONDS.observe(stats.hash_seconds, **labels)
+            if elapsed >= SLOW_REQUEST_SECONDS:
+                _log_slow_request(scope, route, elapsed, stats)
+
+
+def _log_slow_request(scope, route: str, elapsed: float, stats: RequestStats):
+    statements = "\n".join(
+        f"  [{seconds * 1000:.1f} ms] {statement}" for seconds, statement in stats.statements
+    )
+    logger.warning(
+        "Медленный запрос %s %s (%s): %.1f ms, SQL: %d запросов, %.1f ms, bcrypt: %.1f ms\n%s",
+        scope["method"], scope["path"], route, elapsed * 1000,
+        stats.sql_count, stats.sql_seconds * 1000, stats.hash_seconds * 1000, statements,
+    )
+
+
+def render(extra_collectors=()):
+    """
+    Все метрики в текстовом формате Prometheus.
+    extra_collectors - функции, возвращающие дополнительные строки метрик.
+    """
+    lines = []
+    for histogram in (REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS,
+                      REQUEST_HASH_SECONDS):
+        lines.extend(histogram.render())
+    for collector in extra_collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+def cache_metrics(name: str, stats: dict):
+    """
+    Метрики кэша из словаря stats() с ключами hits, misses и size.
+    """
+    return (
+        _sample(f"{name}_hits_total", "counter", f"Попадания в кэш {name}", stats["hits"])
+        + _sample(f"{name}_misses_total", "counter", f"Промахи кэша {name}", stats["misses"])
+        + _sample(f"{name}_entries", "gauge", f"Записей в кэше {name}", stats["size"])
+    )
+
+
+def hashing_metrics(stats: dict):
+    """
+    Метрики пула хеширования паролей.
+    """
+    lines = (
+        _sample("password_hash_in_flight", "gauge",
+                "Операции bcrypt в работе и в очереди", stats["in_flight"])
+        + _sample("password_hash_rejected_total", "counter",
+                  "Отказы из-за переполнения очереди bcrypt", stats["rejected"])
+    )
+    lines += ["# HELP password_hash_seconds Время операций bcrypt",
+              "# TYPE password_hash_seconds summary"]
+    for operation, metric in sorted(stats["operations"].items()):
+        labels = _labels((("operation", operation),))
+        lines.append(f"password_hash_seconds_count{labels} {metric['count']}")
+        lines.append(f"password_hash_seconds_sum{labels} {_number(metric['total_seconds'])}")
+    return lines
+
+
+def cluster_metrics(stats: dict):
+    """
+    Метрики канала согласования рабочих процессов.
+    """
+    return (
+        _sample("cluster_messages_published_total", "counter",
+                "Сообщения, отправленные остальным рабочим процессам", stats["published"])
+        + _sample("cluster_messages_received_total", "counter",
+                  "Сообщения, полученные от остальных рабочих процессов", stats["received"])
+    )
+
+
+def group_commit_metrics(stats: dict):
+    """
+    Метрики групповой фиксации изменений.
+    """
+    return (
+        _sample("group_commit_batches_total", "counter",
+                "Транзакции потока групповой фиксации", stats["batches"])
+        + _sample("group_commit_operations_total", "counter",
+                  "Изменения, примененные потоком групповой фиксации", stats["operations"])
+        + _sample("group_commit_failed_operations_total", "counter",
+                  "Изменения, завершившиеся ошибкой", stats["failed"])
+        + _sample("group_commit_max_batch_size", "gauge",
+                  "Наибольшее число изменений в одной транзакции", stats["max_batch"])
+    )
+
+
+def admission_metrics(stats: dict):
+    """
+    Метрики контроля допуска запросов.
+    """
+    lines = (
+        _sample("admission_in_flight", "gauge",
+                "Допущенные запросы в работе", stats["in_flight"])
+        + _sample("admission_queued", "gauge",
+                  "Запросы в очередях ожидания", stats["queued"])
+        + _sample("admission_clients", "gauge",
+                  "Клиенты с корзиной токенов", stats["clients"])
+    )
+    lines += ["# HELP admission_requests_total Исходы контроля допуска по классам запросов",
+              "# TYPE admission_requests_total counter"]
+    for (request_class, outcome), count in sorted(stats["outcomes"].items()):
+        labels = _labels((("class", request_class), ("outcome", outcome)))
+        lines.append(f"admission_requests_total{labels} {count}")
+    lines += ["# HELP admission_queue_wait_seconds Время ожидания места в очереди",
+              "# TYPE admission_queue_wait_seconds summary"]
+    for request_class, metric in sorted(stats["queue_wait"].items()):
+        labels = _labels((("class", request_class),))
+        lines.append(f"admission_queue_wait_seconds_count{labels} {metric['count']}")
+        lines.append(f"admission_queue_wait_seconds_sum{labels} {_number(metric['total_seconds'])}")
+    return lines
+
+
+def replica_metrics(stats: dict):
+    """
+    Метрики чтения из реплик базы данных.
+    """
+    lines = (
+        _sample("replica_primary_reads_total", "counter",
+                "Чтения из основной базы после изменения клиента", stats["primary_reads"])
+        + _sample("replica_read_your_writes_clients", "gauge",
+                  "Клиенты, читающие из основной базы после изменения", stats["clients"])
+    )
+    lines += ["# HELP replica_reads_total Сессии чтения по репликам",
+              "# TYPE replica_reads_total counter"]
+    for index, replica in enumerate(stats["replicas"]):
+        lines.append(f'replica_reads_total{_labels((("replica", index),))} {replica["reads"]}')
+    lines += ["# HELP replica_sessions_busy Открытые сессии чтения по репликам",
+              "# TYPE replica_sessions_busy gauge"]
+    for index, replica in enumerate(stats["replicas"]):
+        lines.append(f'replica_sessions_busy{_labels((("replica", index),))} {replica["busy"]}')
+    return lines
+
+
+def compression_metrics(stats: dict):
+    """
+    Метрики сжатия ответов по кодировкам.
+    """
+    lines = []
+    for name, documentation, field in (
+        ("http_compressed_responses_total", "Сжатые ответы", "responses"),
+        ("http_compression_input_bytes_total", "Объем ответов до сжатия", "bytes_in"),
+        ("http_compression_output_bytes_total", "Объем ответов после сжатия", "bytes_out"),
+    ):
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} counter"]
+        for encoding, counters in sorted(stats.items()):
+            lines.append(f"{name}{_labels((('encoding', encoding),))} {counters[field]}")
+    return lines
@@ -0,0 +1,186 @@
+"""
+Синхронизация схемы базы данных с моделями.
+Base.metadata.create_all создает только отсутствующие таблицы, а индексы,
+добавленные в модели позже, на существующих таблицах не появляются.
+migrate() создает недостающие таблицы и индексы, удаляет замененные индексы,
+заполняет итоги складов при создании таблицы warehouse_stock и создает
+полнотекстовый индекс названий продуктов (SQLite FTS5).
+
+Миграция выполняется под файловой блокировкой MIGRATION_LOCK_PATH, поэтому
+рабочие процессы, запускаемые одновременно, выполняют ее по очереди: первый
+процесс изменяет схему, остальные находят ее актуальной.
+
+Запуск вручную:
+
+    python migrations.py
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import delete, func, insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from models import Product, Warehouse, WarehouseStock
+from config import PRODUCT_NAME_UNIQUE_PER_WAREHOUSE, MIGRATION_LOCK_PATH
+from database import Base, engine
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+# Индексы, которые заменяются другим вариантом в зависимости от настроек
+REPLACED_INDEXES = {
+    "products": [
+        "ix_products_warehouse_id_name" if PRODUCT_NAME_UNIQUE_PER_WAREHOUSE
+        else "uq_products_warehouse_id_name",
+    ],
+}
+
+
+def sync_indexes(connection):
+    """
+    Создание индексов моделей, отсутствующих в базе, и удаление замененных индексов.
+    Возвращает список выполненных изменений.
+    """
+    inspector = inspect(connection)
+    changes = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for name in REPLACED_INDEXES.get(table.name, []):
+            if name in existing:
+                connection.execute(text(f"DROP INDEX {name}"))
+                changes.append(f"drop index {name}")
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(connection)
+            except IntegrityError as exc:
+                raise RuntimeError(
+                    f"Не удалось создать уникальный индекс {index.name}: "
+                    "в таблице есть повторяющиеся значения"
+                ) from exc
+            changes.append(f"create index {index.name}")
+    return changes
+
+
+# Полнотекстовый индекс продуктов: внешнее содержимое из таблицы products,
+# синхронизация триггерами, поэтому индекс обновляется при любой записи в products.
+# warehouse_id индексируется как токен для ограничения поиска складом внутри MATCH
+# и не участвует в ранжировании (вес bm25 равен 0).
+SEARCH_TABLE = "products_fts"
+SEARCH_DDL = {
+    SEARCH_TABLE: (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "name, warehouse_id, content='products', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    ),
+    "products_fts_insert": (
+        "CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}(rowid, name, warehouse_id) "
+        "VALUES (new.id, new.name, new.warehouse_id); END"
+    ),
+    "products_fts_delete": (
+        "CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, warehouse_id) "
+        "VALUES ('delete', old.id, old.name, old.warehouse_id); END"
+    ),
+    "products_fts_update": (
+        "CREATE TRIGGER IF NOT EXISTS products_fts_update "
+        "AFTER UPDATE OF id, name, warehouse_id ON products BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, warehouse_id) "
+        "VALUES ('delete', old.id, old.name, old.warehouse_id); "
+        f"INSERT INTO {SEARCH_TABLE}(rowid, name, warehouse_id) "
+        "VALUES (new.id, new.name, new.warehouse_id); END"
+    ),
+}
+
+
+def sync_search_index(connection):
+    """
+    Создание полнотекстового индекса и триггеров синхронизации, если их нет.
+    Если чего-то не хватало, индекс перестраивается по таблице products.
+    Для баз, отличных от SQLite, ничего не делает.
+    Возвращает список выполненных изменений.
+    """
+    if connection.dialect.name != "sqlite":
+        return []
+    existing = {
+        name for (name,) in connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+        )
+    }
+    missing = [name for name in SEARCH_DDL if name not in existing]
+    if not missing:
+        return []
+    for name in missing:
+        connection.exec_driver_sql(SEARCH_DDL[name])
+    connection.exec_driver_sql(
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(1.0, 0.0)')"
+    )
+    connection.exec_driver_sql(
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"
+    )
+    return [f"create {name}" for name in missing] + [f"rebuild {SEARCH_TABLE}"]
+
+
+def refresh_warehouse_stock(db, warehouse_ids=None):
+    """
+    Полный пересчет итогов складов по таблице продуктов (db - сессия или соединение).
+    Без warehouse_ids пересчитываются все склады. Используется при миграции
+    и для восстановления итогов; изменения продуктов обновляют итоги инкрементально.
+    """
+    stock = WarehouseStock.__table__
+    totals = (
+        select(
+            Warehouse.id,
+            func.count(Product.id),
+            func.coalesce(func.sum(Product.quantity), 0),
+        )
+        .outerjoin(Product, Product.warehouse_id == Warehouse.id)
+        .group_by(Warehouse.id)
+    )
+    clear = delete(stock)
+    if warehouse_ids is not None:
+        totals = totals.where(Warehouse.id.in_(list(warehouse_ids)))
+        clear = clear.where(stock.c.warehouse_id.in_(list(warehouse_ids)))
+    db.execute(clear)
+    db.execute(insert(stock).from_select(
+        ["warehouse_id", "product_count", "total_quantity"], totals
+    ))
+
+
+@contextmanager
+def migration_lock(path: str = MIGRATION_LOCK_PATH):
+    """
+    Эксклюзивная файловая блокировка на время миграции.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def migrate(bind=engine):
+    """
+    Приведение схемы базы данных в соответствие с моделями.
+    """
+    with migration_lock(), bind.begin() as connection:
+        stock_missing = not inspect(connection).has_table(WarehouseStock.__tablename__)
+        Base.metadata.create_all(bind=connection)
+        changes = sync_indexes(connection)
+        if stock_missing:
+            refresh_warehouse_stock(connection)
+            changes.append("fill warehouse_stock")
+        changes.extend(sync_search_index(connection))
+        return changes
+
+
+if __name__ == "__main__":
+    for change in migrate() or ["schema is up to date"]:
+        print(change)
@@ -2,9 +2,10 @@
 Модели данных для приложения.
 Определяет структуру таблиц базы данных.
 """
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
+from config import PRODUCT_NAME_UNIQUE_PER_WAREHOUSE
 
 class User(Base):
     """
@@ -16,6 +17,20 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     password = Column(String)
 
+class RevokedToken(Base):
+    """
+    Модель отзыва токенов: одного токена по jti либо всех токенов пользователя,
+    выпущенных до revoked_before. Запись удаляется после expires_at,
+    когда все затронутые токены истекли.
+    """
+    __tablename__ = 'revoked_tokens'
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String, nullable=True, index=True)
+    user_id = Column(Integer, nullable=True)
+    revoked_before = Column(Float, nullable=True)
+    expires_at = Column(Float, nullable=False, index=True)
+
 class Warehouse(Base):
     """
     Модель склада для хранения информации о складах.
@@ -24,9 +39,9 @@ class Warehouse(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    location = Column(String, nullable=True)
+    location = Column(String, nullable=True, index=True)
 
-    products = relationship("Product", back_populates="warehouse")
+    products = relationship("Product", back_populates="warehouse", order_by="Product.id")
 
 class Product(Base):
     """
@@ -39,4 +54,28 @@ class Product(Base):
     quantity = Column(Integer)
     warehouse_id = Column(Integer, ForeignKey('warehouses.id'))
 
-    warehouse = relationship("Warehouse", back_populates="products")
\ No newline at end of file
+    warehouse = relationship("Warehouse", back_populates="products")
+
+    __table_args__ = (
+        # Продукты склада с навигацией по id и загрузка Warehouse.products
+        Index("ix_products_warehouse_id_id", "warehouse_id", "id"),
+        # Поиск по названию в пределах склада; уникальный при включенной настройке
+        Index(
+            "uq_products_warehouse_id_name" if PRODUCT_NAME_UNIQUE_PER_WAREHOUSE
+            else "ix_products_warehouse_id_name",
+            "warehouse_id",
+            "name",
+            unique=PRODUCT_NAME_UNIQUE_PER_WAREHOUSE,
+        ),
+    )
+
+class WarehouseStock(Base):
+    """
+    Денормализованные итоги склада: количество продуктов и суммарный остаток.
+    Обновляются в crud в той же транзакции, что и изменения продуктов.
+    """
+    __tablename__ = 'warehouse_stock'
+
+    warehouse_id = Column(Integer, ForeignKey('warehouses.id'), primary_key=True)
+    product_count = Column(Integer, nullable=False, default=0)
+    total_quantity = Column(Integer, nullable=False, default=0)
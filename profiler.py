@@ -0,0 +1,153 @@
+"""
+Семплирующий профилировщик для анализа горячих участков под нагрузкой.
+Фоновый поток с заданным интервалом снимает стеки всех потоков процесса
+и накапливает их в формате collapsed stacks (вход для flamegraph.pl, speedscope).
+
+Профилировщик включается только настройкой PROFILER_ENABLED: без нее
+middleware не регистрируется, маршрут отвечает 404, и накладных расходов нет.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Листовые функции ожидающих потоков, которые не относятся к обработке запросов
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(Exception):
+    """
+    Исключение при попытке запустить второй сеанс профилирования.
+    """
+
+
+class SamplingSession:
+    """
+    Сеанс профилирования: длится seconds секунд либо до завершения requests запросов.
+    route_codes - объекты кода обработчиков; если заданы, учитываются только стеки,
+    проходящие через эти обработчики.
+    """
+
+    def __init__(
+        self,
+        seconds: float,
+        interval: float,
+        requests: int = None,
+        route: str = None,
+        route_codes=(),
+    ):
+        self.seconds = seconds
+        self.interval = interval
+        self.requests = requests
+        self.route = route
+        self.route_codes = frozenset(route_codes)
+        self.samples = Counter()
+        self.sample_count = 0
+        self.completed_requests = 0
+        self.done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        """
+        Запуск потока семплирования.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Досрочная остановка сеанса.
+        """
+        self.done.set()
+
+    def request_finished(self, route: str):
+        """
+        Учет завершенного запроса для ограничения по количеству запросов.
+        """
+        if self.requests is None or (self.route is not None and route != self.route):
+            return
+        self.completed_requests += 1
+        if self.completed_requests >= self.requests:
+            self.done.set()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while not self.done.wait(self.interval):
+            if time.monotonic() >= deadline:
+                break
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for thread_id, frame in frames.items():
+                if thread_id != own_id:
+                    self._sample(frame)
+        self.done.set()
+
+    def _sample(self, frame):
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+            return
+        stack = []
+        matched = not self.route_codes
+        while frame is not None:
+            code = frame.f_code
+            matched = matched or code in self.route_codes
+            filename = os.path.basename(code.co_filename)
+            stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if matched:
+            self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def collapsed(self) -> str:
+        """
+        Результат в формате collapsed stacks: "кадр;кадр;кадр количество".
+        """
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
+
+
+class Profiler:
+    """
+    Управление единственным активным сеансом профилирования.
+    """
+
+    def __init__(self):
+        self.session = None
+        self._lock = threading.Lock()
+
+    def start(self, **options) -> SamplingSession:
+        """
+        Запуск нового сеанса; вызывает ProfilerBusy, если сеанс уже идет.
+        """
+        with self._lock:
+            if self.session is not None and not self.session.done.is_set():
+                raise ProfilerBusy("Профилирование уже выполняется")
+            self.session = SamplingSession(**options)
+            self.session.start()
+            return self.session
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware, сообщающее активному сеансу о завершенных запросах.
+    Регистрируется только при включенном профилировщике.
+    """
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        session = self.profiler.session
+        if scope["type"] == "http" and session is not None and not session.done.is_set():
+            session.request_finished(getattr(scope.get("route"), "path", None))
+
+
+profiler = Profiler()
@@ -0,0 +1,200 @@
+"""
+Маршрутизация чтения на реплики базы данных (DB_REPLICA_URLS).
+Маршруты чтения получают сессию через get_read_db: при заданных репликах она
+открывается на одной из них, по очереди (round_robin) или на реплике
+с наименьшим числом открытых сессий (least_busy). Изменения и проверка
+пользователя по-прежнему выполняются в основной базе (get_db), поэтому
+чтение масштабируется отдельно от записи.
+
+Реплика может отставать от основной базы. Клиент (пользователь из JWT токена
+или IP адрес), выполнивший изменение, DB_READ_YOUR_WRITES_SECONDS секунд читает
+из основной базы и видит свои изменения. Ответы, прочитанные из реплики в это
+время после любого изменения, не сохраняются в кэш ответов, чтобы кэш
+не закрепил устаревшие данные. Учет изменений ведется в пределах процесса.
+
+Локально репликой может быть та же база SQLite, открытая только для чтения
+(sqlite:///file:./test.db?mode=ro&uri=true), или ее снимок.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Depends, Request
+from sqlalchemy.orm import Session, sessionmaker
+
+from admission import client_key
+from config import DB_REPLICA_URLS, DB_REPLICA_SELECTION, DB_READ_YOUR_WRITES_SECONDS
+from database import create_db_engine, get_db
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Ограничение числа клиентов с недавними изменениями
+READ_YOUR_WRITES_MAX_CLIENTS = 100000
+
+
+class ReplicaRouter:
+    """
+    Выбор реплики для сессии чтения и учет недавних изменений клиентов.
+    """
+
+    def __init__(
+        self,
+        urls=DB_REPLICA_URLS,
+        selection: str = DB_REPLICA_SELECTION,
+        window: float = DB_READ_YOUR_WRITES_SECONDS,
+    ):
+        if selection not in ("round_robin", "least_busy"):
+            raise ValueError(f"Неизвестный способ выбора реплики: {selection}")
+        self.selection = selection
+        self.window = window
+        self.engines = [create_db_engine(url, replica=True) for url in urls]
+        self._factories = [
+            sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+            for replica_engine in self.engines
+        ]
+        self._busy = [0] * len(self.engines)
+        self._reads = [0] * len(self.engines)
+        self._next = 0
+        self._writes = OrderedDict()
+        self._last_write = float("-inf")
+        self._primary_reads = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Заданы ли реплики.
+        """
+        return bool(self.engines)
+
+    def _choose(self) -> int:
+        start = self._next
+        self._next = (start + 1) % len(self.engines)
+        if self.selection == "round_robin":
+            return start
+        # Среди одинаково занятых реплик выбирается следующая по очереди
+        order = [(start + offset) % len(self.engines) for offset in range(len(self.engines))]
+        return min(order, key=self._busy.__getitem__)
+
+    def open_session(self):
+        """
+        Сессия на выбранной реплике. Возвращает (номер реплики, сессия).
+        """
+        with self._lock:
+            index = self._choose()
+            self._busy[index] += 1
+            self._reads[index] += 1
+        return index, self._factories[index]()
+
+    def close_session(self, index: int, db: Session):
+        """
+        Закрытие сессии, открытой open_session().
+        """
+        try:
+            db.close()
+        finally:
+            with self._lock:
+                self._busy[index] -= 1
+
+    def mark_write(self, key: str):
+        """
+        Учет изменения, выполненного клиентом key.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._last_write = now
+            self._writes.pop(key, None)
+            self._writes[key] = now + self.window
+            while self._writes and (
+                next(iter(self._writes.values())) <= now
+                or len(self._writes) > READ_YOUR_WRITES_MAX_CLIENTS
+            ):
+                self._writes.popitem(last=False)
+
+    def reads_own_writes(self, scope) -> bool:
+        """
+        Должен ли клиент запроса читать из основной базы после своего изменения.
+        """
+        if not self._writes:
+            return False
+        deadline = self._writes.get(client_key(scope))
+        return deadline is not None and deadline > time.monotonic()
+
+    def recently_written(self) -> bool:
+        """
+        Было ли изменение в течение последних window секунд (реплики могут отставать).
+        """
+        return time.monotonic() - self._last_write < self.window
+
+    def count_primary_read(self):
+        """
+        Учет чтения из основной базы после изменения клиента.
+        """
+        with self._lock:
+            self._primary_reads += 1
+
+    def stats(self):
+        """
+        Счетчики чтений по репликам и открытые сессии.
+        """
+        with self._lock:
+            return {
+                "replicas": [
+                    {"reads": reads, "busy": busy} for reads, busy in zip(self._reads, self._busy)
+                ],
+                "primary_reads": self._primary_reads,
+                "clients": len(self._writes),
+            }
+
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+    """
+    Сессия для маршрутов чтения: на реплике, а без реплик и после
+    изменения клиента - сессия основной базы из get_db.
+    """
+    if not replica_router.enabled:
+        yield db
+        return
+    if replica_router.reads_own_writes(request.scope):
+        replica_router.count_primary_read()
+        yield db
+        return
+    index, replica_db = replica_router.open_session()
+    request.state.replica = True
+    try:
+        yield replica_db
+    finally:
+        replica_router.close_session(index, replica_db)
+
+
+def may_cache(request: Request) -> bool:
+    """
+    Можно ли сохранить в кэш ответ, прочитанный при обработке запроса.
+    """
+    return not (getattr(request.state, "replica", False) and replica_router.recently_written())
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware, отмечающее клиентов, успешно выполнивших изменяющий запрос.
+    Клиент отмечается до отправки тела ответа, поэтому следующий запрос уже читает
+    из основной базы. Регистрируется только при заданных репликах.
+    """
+
+    def __init__(self, app, router: ReplicaRouter = None):
+        self.app = app
+        self.router = router or replica_router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                self.router.mark_write(client_key(scope))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+replica_router = ReplicaRouter()
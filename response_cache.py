@@ -0,0 +1,382 @@
+"""
+Кэш сериализованных ответов маршрутов чтения.
+Хранит готовые JSON байты по ключу маршрут + параметры запроса.
+Записи помечаются тегами и сбрасываются функциями записи в crud.py.
+
+Бэкенды:
+- memory - LRU с TTL внутри процесса;
+- sqlite - файл SQLite, общий для нескольких процессов uvicorn на одной машине;
+- none - кэширование отключено.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from config import (
+    RESPONSE_CACHE_BACKEND,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_PATH,
+)
+
+CachedResponse = namedtuple("CachedResponse", ["body", "headers"])
+
+# Теги записей: список складов, список продуктов, отдельный склад и все склады сразу
+WAREHOUSES_TAG = "warehouses"
+PRODUCTS_TAG = "products"
+ALL_WAREHOUSES_TAG = "warehouse:*"
+# Наибольшее число поколений тегов в памяти. При превышении поколения сбрасываются
+# и начинается новая эпоха: ответы, вычисленные до сброса, не сохраняются
+MAX_TAG_GENERATIONS = 10000
+
+
+def warehouse_tag(warehouse_id: int) -> str:
+    """
+    Тег записей отдельного склада.
+    """
+    return f"warehouse:{warehouse_id}"
+
+
+class NullBackend:
+    """
+    Бэкенд без хранения: каждый запрос вычисляется заново.
+    """
+
+    def get(self, key):
+        """Всегда промах."""
+        return None
+
+    def begin(self, tags):
+        """Снимок поколений тегов не нужен."""
+        return None
+
+    def set(self, key, value, tags, token):
+        """Ничего не сохраняет."""
+
+    def invalidate(self, tags):
+        """Нечего сбрасывать."""
+
+    def clear(self):
+        """Нечего очищать."""
+
+    def __len__(self):
+        return 0
+
+
+class MemoryBackend:
+    """
+    LRU кэш с TTL внутри процесса.
+    Поколения тегов защищают от сохранения ответа, вычисленного до параллельной записи.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_generations: int = MAX_TAG_GENERATIONS,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_generations = max_generations
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Получение записи; просроченная запись удаляется.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, _, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def begin(self, tags):
+        """
+        Снимок поколений тегов перед чтением данных из базы.
+        """
+        with self._lock:
+            return self._token(tags)
+
+    def _token(self, tags):
+        return (self._epoch, *(self._generations.get(tag, 0) for tag in tags))
+
+    def set(self, key, value, tags, token):
+        """
+        Сохранение записи, если ее теги не сбрасывались после begin().
+        """
+        with self._lock:
+            if token != self._token(tags):
+                return
+            self._remove(key)
+            self._entries[key] = (value, tuple(tags), time.monotonic() + self.ttl)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        """
+        Сброс всех записей с указанными тегами.
+        """
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+            if len(self._generations) > self.max_generations:
+                self._generations.clear()
+                self._epoch += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def clear(self):
+        """
+        Полная очистка кэша.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """
+    Кэш в файле SQLite, разделяемый несколькими процессами.
+    Каждый поток использует собственное соединение.
+    """
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        maxsize: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+    ):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY, body BLOB, headers TEXT, expires REAL
+                );
+                CREATE TABLE IF NOT EXISTS entry_tags (
+                    tag TEXT, key TEXT, PRIMARY KEY (tag, key)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS tag_generations (
+                    tag TEXT PRIMARY KEY, generation INTEGER
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS ix_entries_expires ON entries (expires);
+                """
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        """
+        Получение записи, если срок ее жизни не истек.
+        """
+        row = self._connection().execute(
+            "SELECT body, headers FROM entries WHERE key = ? AND expires > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return CachedResponse(bytes(row[0]), json.loads(row[1]))
+
+    def _generations(self, connection, tags):
+        placeholders = ",".join("?" * len(tags))
+        generations = dict(connection.execute(
+            f"SELECT tag, generation FROM tag_generations WHERE tag IN ({placeholders})",
+            tuple(tags),
+        ).fetchall())
+        return tuple(generations.get(tag, 0) for tag in tags)
+
+    def begin(self, tags):
+        """
+        Снимок поколений тегов перед чтением данных из базы.
+        """
+        return self._generations(self._connection(), tags)
+
+    def set(self, key, value, tags, token):
+        """
+        Сохранение записи, если ее теги не сбрасывались после begin().
+        Просроченные и вытесненные записи удаляются вместе с их тегами.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if self._generations(connection, tags) != token:
+                connection.execute("ROLLBACK")
+                return
+            now = time.time()
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, body, headers, expires) VALUES (?, ?, ?, ?)",
+                (key, value.body, json.dumps(value.headers), now + self.ttl),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO entry_tags (tag, key) VALUES (?, ?)",
+                [(tag, key) for tag in tags],
+            )
+            removed = connection.execute(
+                "DELETE FROM entries WHERE expires <= ?", (now,)
+            ).rowcount
+            removed += connection.execute(
+                "DELETE FROM entries WHERE key IN ("
+                "SELECT key FROM entries ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            ).rowcount
+            if removed:
+                connection.execute(
+                    "DELETE FROM entry_tags WHERE key NOT IN (SELECT key FROM entries)"
+                )
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+
+    def invalidate(self, tags):
+        """
+        Сброс всех записей с указанными тегами во всех процессах.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for tag in tags:
+                connection.execute(
+                    "INSERT INTO tag_generations (tag, generation) VALUES (?, 1) "
+                    "ON CONFLICT (tag) DO UPDATE SET generation = generation + 1",
+                    (tag,),
+                )
+                connection.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entry_tags WHERE tag = ?)",
+                    (tag,),
+                )
+                connection.execute("DELETE FROM entry_tags WHERE tag = ?", (tag,))
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        """
+        Полная очистка кэша.
+        """
+        connection = self._connection()
+        connection.execute("DELETE FROM entries")
+        connection.execute("DELETE FROM entry_tags")
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM entries").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    Кэш ответов со счетчиками попаданий и промахов.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(path: str, query_items) -> str:
+        """
+        Ключ записи: путь и отсортированные параметры запроса.
+        """
+        query = "&".join(f"{name}={value}" for name, value in sorted(query_items))
+        return f"{path}?{query}"
+
+    def get(self, key):
+        """
+        Получение сохраненного ответа.
+        """
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def begin(self, tags):
+        """
+        Начало вычисления ответа: снимок поколений тегов.
+        """
+        return self.backend.begin(tags)
+
+    def store(self, key, body: bytes, headers: dict, tags, token):
+        """
+        Сохранение вычисленного ответа.
+        """
+        value = CachedResponse(body, headers)
+        self.backend.set(key, value, tags, token)
+        return value
+
+    def invalidate(self, tags):
+        """
+        Сброс ответов с указанными тегами.
+        """
+        self.backend.invalidate(list(tags))
+
+    def clear(self):
+        """
+        Полная очистка кэша и счетчиков.
+        """
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Счетчики кэша ответов.
+        """
+        return {"size": len(self.backend), "hits": self.hits, "misses": self.misses}
+
+
+def create_backend(name: str = RESPONSE_CACHE_BACKEND):
+    """
+    Создание бэкенда по имени из настроек.
+    """
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name == "none":
+        return NullBackend()
+    raise ValueError(f"Неизвестный бэкенд кэша ответов: {name}")
+
+
+response_cache = ResponseCache(create_backend())
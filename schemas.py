@@ -1,7 +1,7 @@
 """
 Схемы данных Pydantic для валидации запросов и ответов.
 """
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -49,6 +49,34 @@ class ProductCreate(ProductBase):
     pass
 
 
+class StockAdjustment(BaseModel):
+    """Схема изменения остатка продукта"""
+    delta: int
+
+
+class StockAdjustmentItem(StockAdjustment):
+    """Схема изменения остатка продукта в пакетном запросе"""
+    product_id: int
+
+
+class ProductBulkItem(ProductBase):
+    """Схема строки массовой загрузки продуктов; id указывается для обновления"""
+    id: Optional[int] = None
+
+
+class BulkRowError(BaseModel):
+    """Схема ошибки в строке массовой загрузки"""
+    row: int
+    error: str
+
+
+class BulkResult(BaseModel):
+    """Схема результата массовой загрузки продуктов"""
+    written: int
+    failed: int
+    errors: List[BulkRowError] = []
+
+
 class WarehouseBase(BaseModel):
     """Базовая схема склада"""
     name: str
@@ -60,6 +88,12 @@ class WarehouseCreate(WarehouseBase):
     pass
 
 
+class WarehouseBulkItem(WarehouseBase):
+    """Схема строки загрузки складов; id указывается для обновления"""
+    location: Optional[str] = None
+    id: Optional[int] = None
+
+
 class Warehouse(WarehouseBase):
     """Схема склада с id и списком продуктов"""
     id: int
@@ -69,3 +103,24 @@ class Warehouse(WarehouseBase):
         """Настройки Pydantic модели"""
         from_attributes = True
 
+
+class WarehouseSummary(WarehouseBase):
+    """Схема сводки по складу без списка продуктов"""
+    id: int
+    product_count: int
+    total_quantity: int
+
+    class Config:
+        """Настройки Pydantic модели"""
+        from_attributes = True
+
+
+class WarehouseStats(BaseModel):
+    """Схема итогов склада, поддерживаемых при изменении продуктов"""
+    warehouse_id: int
+    product_count: int
+    total_quantity: int
+
+    class Config:
+        """Настройки Pydantic модели"""
+        from_attributes = True
@@ -0,0 +1,50 @@
+"""
+Быстрая сериализация списков в JSON без создания моделей pydantic.
+Маршруты списков выбирают из базы кортежи столбцов вместо ORM объектов,
+а orjson кодирует их в тот же формат, что и схемы schemas.Product и schemas.Warehouse
+(порядок ключей совпадает с порядком полей схем).
+"""
+import orjson
+
+
+def product_dict(row) -> dict:
+    """
+    Словарь продукта из кортежа (id, name, quantity, warehouse_id).
+    """
+    product_id, name, quantity, warehouse_id = row
+    return {"name": name, "quantity": quantity, "warehouse_id": warehouse_id, "id": product_id}
+
+
+def products_json(rows) -> bytes:
+    """
+    JSON массив продуктов из кортежей столбцов.
+    """
+    return orjson.dumps([
+        {"name": name, "quantity": quantity, "warehouse_id": warehouse_id, "id": product_id}
+        for product_id, name, quantity, warehouse_id in rows
+    ])
+
+
+def product_ndjson(row) -> bytes:
+    """
+    Строка NDJSON для одного продукта.
+    """
+    return orjson.dumps(product_dict(row)) + b"\n"
+
+
+def warehouses_json(warehouses, products) -> bytes:
+    """
+    JSON массив складов из кортежей (id, name, location) и кортежей продуктов этих складов.
+    """
+    by_warehouse = {}
+    for row in products:
+        by_warehouse.setdefault(row[3], []).append(product_dict(row))
+    return orjson.dumps([
+        {
+            "name": name,
+            "location": location,
+            "id": warehouse_id,
+            "products": by_warehouse.get(warehouse_id, []),
+        }
+        for warehouse_id, name, location in warehouses
+    ])
@@ -0,0 +1,173 @@
+"""
+Запуск API в нескольких рабочих процессах (pre-fork).
+Родительский процесс один раз импортирует приложение (миграции выполняются
+в main.py до запуска рабочих процессов), открывает слушающий сокет и порождает
+рабочие процессы через fork. Каждый рабочий процесс обслуживает общий сокет
+своим сервером uvicorn и подключается к каналу согласования кэшей (cluster.py).
+
+Сигналы родительскому процессу:
+- SIGTERM, SIGINT - плавная остановка: рабочие процессы завершают начатые запросы;
+- SIGHUP - плавный перезапуск рабочих процессов: новые процессы запускаются
+  до остановки прежних. Код приложения при этом не перезагружается.
+
+Упавшие рабочие процессы перезапускаются.
+
+    WORKERS=4 python main.py
+"""
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from cluster import cluster
+from config import WORKER_GRACEFUL_TIMEOUT
+
+logger = logging.getLogger("warehouse.server")
+
+# Пауза перед повторным запуском процесса, который упал сразу после старта
+RESPAWN_DELAY_SECONDS = 1.0
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """
+    Слушающий сокет, наследуемый рабочими процессами.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """
+    Родительский процесс: запуск, перезапуск и остановка рабочих процессов.
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int,
+                 graceful_timeout: float = WORKER_GRACEFUL_TIMEOUT):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.sock = None
+        self.children = {}
+        self._retiring = {}
+        self._stopping = False
+        self._reload = False
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Рабочий процесс %s завершился с ошибкой", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)  # pylint: disable=protected-access
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def _run_worker(self):
+        # pylint: disable=import-outside-toplevel
+        from database import engine
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        # Соединения пула, открытые родителем, не используются совместно с ним
+        engine.dispose(close=False)
+        cluster.start()
+        config = uvicorn.Config(self.app, host=self.host, port=self.port, lifespan="on")
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if self._retiring.pop(pid, None) is not None or started is None:
+                continue
+            if not self._stopping:
+                logger.warning("Рабочий процесс %s завершился (%s), запуск нового", pid, status)
+                if time.monotonic() - started < RESPAWN_DELAY_SECONDS:
+                    time.sleep(RESPAWN_DELAY_SECONDS)
+                self._spawn()
+
+    def _restart_workers(self):
+        previous = [pid for pid in self.children if pid not in self._retiring]
+        for _ in range(self.workers):
+            self._spawn()
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in previous:
+            self._retiring[pid] = deadline
+            os.kill(pid, signal.SIGTERM)
+        logger.info("Перезапуск рабочих процессов, остановка прежних: %s", previous)
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self._retiring.items()):
+            if now > deadline and pid in self.children:
+                os.kill(pid, signal.SIGKILL)
+
+    def _shutdown(self):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in list(self.children):
+            self._retiring[pid] = deadline
+            os.kill(pid, signal.SIGTERM)
+        while self.children:
+            self._reap()
+            self._kill_overdue()
+            time.sleep(0.1)
+
+    def run(self):
+        """
+        Запуск рабочих процессов и наблюдение за ними до сигнала остановки.
+        """
+        # pylint: disable=import-outside-toplevel
+        from database import engine
+
+        self.sock = bind_socket(self.host, self.port)
+        # Соединения, открытые до запуска (миграции), не должны наследоваться
+        engine.dispose()
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        logger.info("Запуск %d рабочих процессов на %s:%d", self.workers, self.host, self.port)
+        for _ in range(self.workers):
+            self._spawn()
+        try:
+            while not self._stopping:
+                if self._reload:
+                    self._reload = False
+                    self._restart_workers()
+                self._reap()
+                self._kill_overdue()
+                time.sleep(0.1)
+        finally:
+            self._shutdown()
+            self.sock.close()
+
+
+def serve(app, host: str, port: int, workers: int):
+    """
+    Запуск приложения в workers рабочих процессах.
+    """
+    Supervisor(app, host, port, workers).run()
@@ -1,16 +1,27 @@
 """
 Тесты для API с использованием FastAPI TestClient.
 """
+import json
 import os
+import threading
+from contextlib import contextmanager
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+import config
+import crud
+import metrics
 from main import app
-from database import Base, get_db
-from models import User, Warehouse, Product
+from database import Base, get_db, create_db_engine, create_async_db_engine
+from models import User, Warehouse, Product, WarehouseStock
+from token_cache import token_cache
+from tokens import keyring, revocations
+from hashing import password_hasher
+from response_cache import response_cache, SQLiteBackend, CachedResponse, warehouse_tag
 
 # Настройка тестовой базы данных в памяти
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -20,6 +31,7 @@ engine = create_engine(
     poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+metrics.instrument_engine(engine)
 
 
 # Переопределяем зависимость get_db
@@ -59,6 +71,72 @@ def setup_db():
     # Очищаем базу данных после теста
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    token_cache.clear()
+    response_cache.clear()
+    revocations.clear()
+
+
+@contextmanager
+def count_queries():
+    """
+    Подсчет SQL запросов к тестовой базе данных внутри блока with.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def capture_statements():
+    """
+    Сохранение SQL запросов с параметрами внутри блока with.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def assert_queries_use_indexes(statements, allow_scan=()):
+    """
+    Проверка через EXPLAIN QUERY PLAN, что запросы SELECT не сканируют таблицы
+    целиком. allow_scan - таблицы, полное чтение которых ожидаемо (списки без фильтров).
+    """
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            if not statement.lstrip().upper().startswith("SELECT"):
+                continue
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).all()
+            for row in plan:
+                detail = row[-1]
+                if detail.startswith("SCAN") and " USING " not in detail:
+                    table = detail.split()[1]
+                    assert table in allow_scan, f"{detail}\n{statement}"
+
+
+def auth_headers(username="authuser", password="testpassword"):
+    """
+    Регистрация пользователя и получение заголовка авторизации.
+    """
+    client.post("/register", json={"username": username, "password": password})
+    response = client.post("/login", json={"username": username, "password": password})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
 
 
 def test_register_user():
@@ -347,4 +425,1609 @@ def test_delete_product_not_found():
     """
     response = client.delete("/products/999")
     assert response.status_code == 404
-    assert "Продукт не найден" in response.json()["detail"] 
\ No newline at end of file
+    assert "Продукт не найден" in response.json()["detail"]
+
+
+def test_token_cache_hit():
+    """
+    Тест кэширования пользователя по токену.
+    """
+    headers = auth_headers()
+    token_cache.clear()
+    response_cache.clear()
+
+    client.get("/products/", headers=headers)
+    client.get("/products/", headers=headers)
+    stats = token_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+
+def test_token_cache_invalidation():
+    """
+    Тест сброса кэша при удалении пользователя.
+    """
+    headers = auth_headers(username="cacheuser")
+    assert client.get("/products/", headers=headers).status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        crud.delete_user(db, username="cacheuser")
+    finally:
+        db.close()
+    assert token_cache.stats()["size"] == 0
+    assert client.get("/products/", headers=headers).status_code == 401
+
+
+def test_register_hashing_overloaded(monkeypatch):
+    """
+    Тест отказа с кодом 503 при переполнении очереди хеширования.
+    """
+    monkeypatch.setattr(password_hasher, "queue_limit", -password_hasher.workers)
+    response = client.post(
+        "/register",
+        json={"username": "busyuser", "password": "testpassword"}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert password_hasher.stats()["rejected"] >= 1
+
+
+def test_get_products_pagination_and_filters():
+    """
+    Тест постраничной навигации и фильтров списка продуктов.
+    """
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "Paging Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+    for i in range(5):
+        client.post(
+            "/products/",
+            json={"name": f"Item {i}", "quantity": i * 10, "warehouse_id": warehouse_id},
+            headers=headers,
+        )
+
+    response = client.get("/products/?limit=2", headers=headers)
+    assert [p["name"] for p in response.json()] == ["Item 0", "Item 1"]
+    next_after = response.headers["X-Next-After"]
+
+    response = client.get(f"/products/?limit=2&after={next_after}", headers=headers)
+    assert [p["name"] for p in response.json()] == ["Item 2", "Item 3"]
+
+    response = client.get(
+        f"/products/?warehouse_id={warehouse_id}&min_quantity=10&max_quantity=30",
+        headers=headers,
+    )
+    assert [p["quantity"] for p in response.json()] == [10, 20, 30]
+
+    response = client.get("/products/?name=Item%204", headers=headers)
+    assert len(response.json()) == 1
+
+    # Префикс с последним символом Unicode (U+10FFFF)
+    last = chr(0x10FFFF)
+    for name in (f"Max{last}", f"Max{last} tail", "May"):
+        client.post(
+            "/products/",
+            json={"name": name, "quantity": 1, "warehouse_id": warehouse_id},
+            headers=headers,
+        )
+    response = client.get("/products/", params={"name": f"Max{last}"}, headers=headers)
+    assert [p["name"] for p in response.json()] == [f"Max{last}", f"Max{last} tail"]
+    response = client.get("/warehouses/", params={"name": last}, headers=headers)
+    assert response.status_code == 200 and response.json() == []
+
+
+def test_get_products_stream():
+    """
+    Тест потоковой выдачи списка продуктов в формате NDJSON.
+    """
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "Stream Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+    for i in range(3):
+        client.post(
+            "/products/",
+            json={"name": f"Streamed {i}", "quantity": i, "warehouse_id": warehouse_id},
+            headers=headers,
+        )
+
+    response = client.get("/products/?stream=true", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["name"] for line in lines] == ["Streamed 0", "Streamed 1", "Streamed 2"]
+
+
+def test_get_warehouses_constant_query_count():
+    """
+    Тест отсутствия N+1 запросов при получении списка складов с продуктами.
+    """
+    headers = auth_headers()
+
+    def create_warehouses(count):
+        for i in range(count):
+            warehouse_id = client.post(
+                "/warehouses/",
+                json={"name": f"Warehouse {i}", "location": "Test Location"},
+                headers=headers,
+            ).json()["id"]
+            client.post(
+                "/products/",
+                json={"name": f"Product {i}", "quantity": 5, "warehouse_id": warehouse_id},
+                headers=headers,
+            )
+
+    create_warehouses(2)
+    with count_queries() as few:
+        response = client.get("/warehouses/", headers=headers)
+    assert all(len(w["products"]) == 1 for w in response.json())
+
+    create_warehouses(8)
+    with count_queries() as many:
+        response = client.get("/warehouses/", headers=headers)
+    assert len(response.json()) == 10
+    assert len(many) == len(few)
+
+
+def test_get_warehouse_summaries():
+    """
+    Тест сводки по складам.
+    """
+    headers = auth_headers()
+    full_id = client.post(
+        "/warehouses/",
+        json={"name": "Full Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+    client.post(
+        "/warehouses/",
+        json={"name": "Empty Warehouse", "location": "Test Location"},
+        headers=headers,
+    )
+    for quantity in (3, 7):
+        client.post(
+            "/products/",
+            json={"name": "Summary Product", "quantity": quantity, "warehouse_id": full_id},
+            headers=headers,
+        )
+
+    with count_queries() as statements:
+        response = client.get("/warehouses/summary", headers=headers)
+    assert response.status_code == 200
+    assert len(statements) == 1
+    data = response.json()
+    assert data[0]["product_count"] == 2
+    assert data[0]["total_quantity"] == 10
+    assert data[1]["product_count"] == 0
+    assert data[1]["total_quantity"] == 0
+
+
+def test_bulk_create_products():
+    """
+    Тест массовой загрузки продуктов JSON массивом с ошибками в отдельных строках.
+    """
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "Bulk Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+
+    response = client.post(
+        "/products/bulk",
+        json=[
+            {"name": "Bulk 1", "quantity": 1, "warehouse_id": warehouse_id},
+            {"name": "Bulk 2", "quantity": 2, "warehouse_id": 999},
+            {"name": "Bulk 3", "quantity": "many", "warehouse_id": warehouse_id},
+            {"name": "Bulk 4", "quantity": 4, "warehouse_id": warehouse_id},
+        ],
+        headers=headers,
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["written"] == 2
+    assert data["failed"] == 2
+    assert [error["row"] for error in data["errors"]] == [1, 2]
+    assert "Склад не найден" in data["errors"][0]["error"]
+
+    products = client.get("/products/", headers=headers).json()
+    assert [p["name"] for p in products] == ["Bulk 1", "Bulk 4"]
+
+
+def test_bulk_upsert_products_csv():
+    """
+    Тест массовой загрузки CSV с обновлением существующих продуктов.
+    """
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "CSV Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+    product_id = client.post(
+        "/products/",
+        json={"name": "Old Name", "quantity": 1, "warehouse_id": warehouse_id},
+        headers=headers,
+    ).json()["id"]
+
+    body = (
+        "id,name,quantity,warehouse_id\n"
+        f"{product_id},New Name,50,{warehouse_id}\n"
+        f",Fresh,5,{warehouse_id}\n"
+    )
+    response = client.post(
+        "/products/bulk?upsert=true",
+        content=body,
+        headers={**headers, "Content-Type": "text/csv"},
+    )
+    assert response.json() == {"written": 2, "failed": 0, "errors": []}
+
+    products = client.get("/products/", headers=headers).json()
+    assert products[0] == {
+        "id": product_id, "name": "New Name", "quantity": 50, "warehouse_id": warehouse_id
+    }
+    assert products[1]["name"] == "Fresh"
+
+
+def test_bulk_rejects_invalid_utf8():
+    """
+    Тест массовой загрузки тела не в UTF-8: ответ 400 вместо ошибки сервера.
+    """
+    headers = auth_headers()
+    body = '{"name": "Café", "quantity": 1, "warehouse_id": 1}'.encode("latin-1")
+    for content_type in ("application/x-ndjson", "text/csv", "application/json"):
+        response = client.post(
+            "/products/bulk",
+            content=body,
+            headers={**headers, "Content-Type": content_type},
+        )
+        assert response.status_code == 400
+        assert "UTF-8" in response.json()["detail"]
+
+
+def test_sqlite_engine_pragmas(tmp_path):
+    """
+    Тест настройки WAL и пула для файловой базы SQLite.
+    """
+    file_engine = create_db_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    with file_engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() > 0
+    assert file_engine.pool.size() > 1
+    file_engine.dispose()
+
+
+def test_async_engine(tmp_path):
+    """
+    Тест асинхронного движка на основе aiosqlite.
+    """
+    pytest.importorskip("aiosqlite")
+    import asyncio
+
+    async def run():
+        async_engine = create_async_db_engine(f"sqlite:///{tmp_path / 'async.db'}")
+        async with async_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+            result = await connection.exec_driver_sql("SELECT count(*) FROM products")
+            count = result.scalar()
+        await async_engine.dispose()
+        return count
+
+    assert asyncio.run(run()) == 0
+
+
+def test_async_db_dependency(tmp_path, monkeypatch):
+    """
+    Тест зависимости get_async_db: async обработчик получает AsyncSession
+    и выполняет запрос через aiosqlite.
+    """
+    pytest.importorskip("aiosqlite")
+    from fastapi import Depends, FastAPI
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+    import database
+
+    database_url = f"sqlite:///{tmp_path / 'async_dependency.db'}"
+    file_engine = create_db_engine(database_url)
+    Base.metadata.create_all(bind=file_engine)
+    with file_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO warehouses (name, location) VALUES ('Async', 'Loop')"
+        )
+    file_engine.dispose()
+
+    monkeypatch.setattr(database, "_async_session_factory", None)
+    assert isinstance(database.get_async_sessionmaker(), async_sessionmaker)
+    async_engine = create_async_db_engine(database_url)
+    factory = async_sessionmaker(async_engine, expire_on_commit=False)
+    monkeypatch.setattr(database, "_async_session_factory", factory)
+
+    async_app = FastAPI()
+
+    @async_app.get("/names")
+    async def names(db: AsyncSession = Depends(database.get_async_db)):
+        assert isinstance(db, AsyncSession)
+        return list((await db.execute(select(Warehouse.name))).scalars())
+
+    with TestClient(async_app) as async_client:
+        assert async_client.get("/names").json() == ["Async"]
+        async_client.portal.call(async_engine.dispose)
+
+
+def test_adjust_product():
+    """
+    Тест атомарного изменения остатка продукта.
+    """
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "Adjust Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+    product_id = client.post(
+        "/products/",
+        json={"name": "Adjust Product", "quantity": 10, "warehouse_id": warehouse_id},
+        headers=headers,
+    ).json()["id"]
+
+    response = client.post(f"/products/{product_id}/adjust", json={"delta": -4}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 6
+
+    response = client.post(f"/products/{product_id}/adjust", json={"delta": -7}, headers=headers)
+    assert response.status_code == 409
+
+    response = client.post("/products/999/adjust", json={"delta": 1}, headers=headers)
+    assert response.status_code == 404
+
+
+def test_adjust_products_batch_is_atomic():
+    """
+    Тест пакетного изменения остатков: при ошибке изменения не применяются.
+    """
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "Batch Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+    ids = [
+        client.post(
+            "/products/",
+            json={"name": f"Batch {i}", "quantity": 5, "warehouse_id": warehouse_id},
+            headers=headers,
+        ).json()["id"]
+        for i in range(2)
+    ]
+
+    response = client.post(
+        "/products/adjust",
+        json=[{"product_id": ids[0], "delta": 3}, {"product_id": ids[1], "delta": -6}],
+        headers=headers,
+    )
+    assert response.status_code == 409
+    assert [p["quantity"] for p in client.get("/products/", headers=headers).json()] == [5, 5]
+
+    response = client.post(
+        "/products/adjust",
+        json=[{"product_id": ids[0], "delta": 3}, {"product_id": ids[1], "delta": -5}],
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert [p["quantity"] for p in response.json()] == [8, 0]
+
+
+def test_events_websocket():
+    """
+    Тест доставки событий изменения продуктов с фильтром по складу и возобновлением.
+    """
+    headers = auth_headers()
+    token = headers["Authorization"].split()[1]
+    first_id, second_id = (
+        client.post(
+            "/warehouses/",
+            json={"name": f"Events Warehouse {i}", "location": "Test Location"},
+            headers=headers,
+        ).json()["id"]
+        for i in range(2)
+    )
+
+    with client.websocket_connect(f"/events/ws?token={token}&warehouse_id={first_id}") as ws:
+        client.post(
+            "/products/",
+            json={"name": "Other", "quantity": 1, "warehouse_id": second_id},
+            headers=headers,
+        )
+        product_id = client.post(
+            "/products/",
+            json={"name": "Watched", "quantity": 1, "warehouse_id": first_id},
+            headers=headers,
+        ).json()["id"]
+        event = ws.receive_json()
+        assert event["type"] == "product.created"
+        assert event["data"]["id"] == product_id
+
+        assert client.delete(f"/products/{product_id}", headers=headers).status_code == 200
+        deleted = ws.receive_json()
+        assert deleted["type"] == "product.deleted"
+        assert deleted["seq"] > event["seq"]
+
+    url = f"/events/ws?token={token}&warehouse_id={first_id}&after={event['seq']}"
+    with client.websocket_connect(url) as ws:
+        assert ws.receive_json()["seq"] == deleted["seq"]
+
+
+def test_events_websocket_rejects_invalid_token():
+    """
+    Тест отказа в подписке без действительного токена.
+    """
+    with pytest.raises(Exception):
+        with client.websocket_connect("/events/ws?token=invalid") as ws:
+            ws.receive_json()
+
+
+def test_conditional_get_products():
+    """
+    Тест ответа 304 на If-None-Match без обращения к базе данных.
+    """
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "ETag Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+
+    response = client.get("/products/", headers=headers)
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    with count_queries() as statements:
+        response = client.get("/products/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert statements == []
+
+    client.post(
+        "/products/",
+        json={"name": "ETag Product", "quantity": 1, "warehouse_id": warehouse_id},
+        headers=headers,
+    )
+    response = client.get("/products/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_conditional_get_warehouse():
+    """
+    Тест версии отдельного склада: изменения в другом складе не сбрасывают ETag.
+    """
+    headers = auth_headers()
+    first_id, second_id = (
+        client.post(
+            "/warehouses/",
+            json={"name": f"Versioned {i}", "location": "Test Location"},
+            headers=headers,
+        ).json()["id"]
+        for i in range(2)
+    )
+    etag = client.get(f"/warehouses/{first_id}", headers=headers).headers["ETag"]
+
+    client.post(
+        "/products/",
+        json={"name": "Elsewhere", "quantity": 1, "warehouse_id": second_id},
+        headers=headers,
+    )
+    response = client.get(f"/warehouses/{first_id}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.post(
+        "/products/",
+        json={"name": "Here", "quantity": 1, "warehouse_id": first_id},
+        headers=headers,
+    )
+    response = client.get(f"/warehouses/{first_id}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()["products"]) == 1
+
+
+def test_response_cache_invalidation():
+    """
+    Тест кэша ответов: повторный запрос без обращения к базе и точечный сброс.
+    """
+    headers = auth_headers()
+    first_id, second_id = (
+        client.post(
+            "/warehouses/",
+            json={"name": f"Cached {i}", "location": "Test Location"},
+            headers=headers,
+        ).json()["id"]
+        for i in range(2)
+    )
+    first = client.get(f"/warehouses/{first_id}", headers=headers)
+    client.get(f"/warehouses/{second_id}", headers=headers)
+
+    with count_queries() as statements:
+        cached = client.get(f"/warehouses/{first_id}", headers=headers)
+    assert statements == []
+    assert cached.content == first.content
+
+    client.post(
+        "/products/",
+        json={"name": "Cached Product", "quantity": 1, "warehouse_id": first_id},
+        headers=headers,
+    )
+    with count_queries() as statements:
+        client.get(f"/warehouses/{second_id}", headers=headers)
+    assert statements == []
+
+    response = client.get(f"/warehouses/{first_id}", headers=headers)
+    assert [p["name"] for p in response.json()["products"]] == ["Cached Product"]
+
+
+def test_sqlite_response_cache_backend(tmp_path):
+    """
+    Тест общего SQLite бэкенда: сохранение, сброс по тегу и защита от устаревших данных.
+    """
+    backend = SQLiteBackend(str(tmp_path / "cache.db"))
+    other_process = SQLiteBackend(str(tmp_path / "cache.db"))
+    value = CachedResponse(b"[]", {"X-Next-After": "1"})
+
+    token = backend.begin(["products"])
+    backend.set("/products/?", value, ["products"], token)
+    assert other_process.get("/products/?") == value
+
+    other_process.invalidate(["products"])
+    assert backend.get("/products/?") is None
+
+    backend.set("/products/?", value, ["products"], token)
+    assert backend.get("/products/?") is None
+
+
+def test_sqlite_response_cache_evicts_tags_and_expired(tmp_path):
+    """
+    Тест SQLite бэкенда: просроченные и вытесненные записи удаляются вместе с тегами.
+    """
+    backend = SQLiteBackend(str(tmp_path / "cache.db"), maxsize=2)
+    connection = backend._connection()  # pylint: disable=protected-access
+    value = CachedResponse(b"[]", {})
+    for warehouse_id in range(1, 4):
+        tags = [warehouse_tag(warehouse_id)]
+        backend.set(f"/warehouses/{warehouse_id}?", value, tags, backend.begin(tags))
+    assert len(backend) == 2
+    assert connection.execute("SELECT count(*) FROM entry_tags").fetchone()[0] == 2
+
+    connection.execute("UPDATE entries SET expires = 0 WHERE key = '/warehouses/3?'")
+    backend.set("/products/?", value, ["products"], backend.begin(["products"]))
+    keys = {key for (key,) in connection.execute("SELECT key FROM entries")}
+    assert keys == {"/warehouses/2?", "/products/?"}
+    tagged = {key for (key,) in connection.execute("SELECT key FROM entry_tags")}
+    assert tagged == keys
+
+
+def test_memory_response_cache_bounds_generations():
+    """
+    Тест ограничения поколений тегов: после сброса поколений ответ,
+    вычисленный до него, не сохраняется.
+    """
+    from response_cache import MemoryBackend
+
+    backend = MemoryBackend(max_generations=2)
+    value = CachedResponse(b"{}", {})
+    tags = [warehouse_tag(1)]
+    stale = backend.begin(tags)
+    for warehouse_id in range(2, 6):
+        backend.invalidate([warehouse_tag(warehouse_id)])
+    assert len(backend._generations) <= 2  # pylint: disable=protected-access
+
+    backend.set("/warehouses/1?", value, tags, stale)
+    assert backend.get("/warehouses/1?") is None
+    backend.set("/warehouses/1?", value, tags, backend.begin(tags))
+    assert backend.get("/warehouses/1?") == value
+
+
+def test_benchmark_compare_reports():
+    """
+    Тест сравнения отчета бенчмарка с базовым отчетом.
+    """
+    from benchmark import compare_reports
+
+    def report(rps, p99, queries):
+        return {"results": {"inprocess:list_products": {
+            "rps": rps, "p99_ms": p99, "queries_per_request": queries
+        }}}
+
+    baseline = report(100, 10, 1.0)
+    assert compare_reports(report(95, 11, 1.1), baseline, 0.2) == []
+    regressions = compare_reports(report(50, 30, 12.0), baseline, 0.2)
+    assert len(regressions) == 3
+
+
+def test_hot_queries_use_indexes():
+    """
+    Тест использования индексов в основных запросах crud.py и main.py.
+    """
+    headers = auth_headers()
+    token_cache.clear()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "Indexed Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+    product_id = client.post(
+        "/products/",
+        json={"name": "Indexed Product", "quantity": 5, "warehouse_id": warehouse_id},
+        headers=headers,
+    ).json()["id"]
+
+    filtered_requests = [
+        ("GET", f"/products/?warehouse_id={warehouse_id}&after=0&limit=10"),
+        ("GET", f"/products/?warehouse_id={warehouse_id}&name=Indexed"),
+        ("GET", "/products/?name=Indexed"),
+        ("GET", "/products/?after=1&limit=10"),
+        ("GET", f"/warehouses/{warehouse_id}"),
+        ("GET", "/warehouses/?name=Indexed"),
+        ("POST", f"/products/{product_id}/adjust"),
+        ("PUT", f"/products/{product_id}"),
+        ("DELETE", f"/products/{product_id}"),
+    ]
+    bodies = {
+        "POST": {"delta": 1},
+        "PUT": {"name": "Indexed Product", "quantity": 1, "warehouse_id": warehouse_id},
+    }
+    with capture_statements() as statements:
+        for method, url in filtered_requests:
+            response = client.request(method, url, json=bodies.get(method), headers=headers)
+            assert response.status_code == 200, url
+    assert_queries_use_indexes(statements)
+
+    with capture_statements() as statements:
+        client.get("/warehouses/", headers=headers)
+        client.get("/warehouses/summary", headers=headers)
+    assert_queries_use_indexes(statements, allow_scan=("warehouses",))
+
+
+def test_migrate_creates_missing_indexes(tmp_path):
+    """
+    Тест создания индексов, добавленных в модели, на существующей базе.
+    """
+    from sqlalchemy import inspect
+    from migrations import migrate
+
+    file_engine = create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with file_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR, "
+            "quantity INTEGER, warehouse_id INTEGER)"
+        )
+    changes = migrate(file_engine)
+    assert "create index ix_products_warehouse_id_id" in changes
+    indexes = {index["name"] for index in inspect(file_engine).get_indexes("products")}
+    assert {"ix_products_warehouse_id_id", "ix_products_warehouse_id_name"} <= indexes
+    assert migrate(file_engine) == []
+    file_engine.dispose()
+
+
+def test_metrics_endpoint():
+    """
+    Тест метрик Prometheus: время маршрутов, SQL запросы и время bcrypt.
+    """
+    headers = auth_headers()
+    client.get("/products/", headers=headers)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    body = response.text
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/products/",status="200"}'
+        in body
+    )
+    assert 'http_request_sql_statements_count{method="GET",route="/products/"}' in body
+    assert 'http_request_bcrypt_duration_seconds_count{method="POST",route="/login"}' in body
+    assert "token_cache_hits_total" in body
+
+
+def test_slow_request_logged_with_sql(monkeypatch, caplog):
+    """
+    Тест записи медленного запроса в журнал вместе с SQL.
+    """
+    headers = auth_headers()
+    token_cache.clear()
+    monkeypatch.setattr(metrics, "SLOW_REQUEST_SECONDS", 0)
+    with caplog.at_level("WARNING", logger="warehouse.metrics"):
+        client.get("/products/?limit=5", headers=headers)
+    assert "GET /products/" in caplog.text
+    assert "FROM products" in caplog.text
+
+
+def test_sql_metrics_after_failed_statement():
+    """
+    Тест учета SQL запроса, завершившегося ошибкой: время начала не остается
+    на стеке соединения и не искажает время следующих запросов.
+    """
+    from sqlalchemy.exc import OperationalError
+
+    stats = metrics.RequestStats()
+    token = metrics.current_request.set(stats)
+    try:
+        with engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.exec_driver_sql("SELECT * FROM missing_table")
+            assert connection.info["query_started"] == []
+            connection.exec_driver_sql("SELECT 1")
+    finally:
+        metrics.current_request.reset(token)
+    assert stats.sql_count == 2
+    assert [statement for _, statement in stats.statements] == [
+        "SELECT * FROM missing_table", "SELECT 1"
+    ]
+
+
+def test_profile_requires_admin_and_enabled(monkeypatch):
+    """
+    Тест доступа к профилировщику: отключен по умолчанию и только для администраторов.
+    """
+    headers = auth_headers(username="profiler")
+    assert client.post("/admin/profile?seconds=0.1", headers=headers).status_code == 403
+
+    monkeypatch.setattr(config, "ADMIN_USERNAMES", {"profiler"})
+    assert client.post("/admin/profile?seconds=0.1", headers=headers).status_code == 404
+
+
+def test_profile_collapsed_stacks(monkeypatch):
+    """
+    Тест семплирующего профилирования с выдачей collapsed stacks.
+    """
+    monkeypatch.setattr(config, "PROFILER_ENABLED", True)
+    monkeypatch.setattr(config, "ADMIN_USERNAMES", {"profiler"})
+    headers = auth_headers(username="profiler")
+
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_loop)
+    worker.start()
+    try:
+        response = client.post("/admin/profile?seconds=0.3&interval_ms=1", headers=headers)
+    finally:
+        stop.set()
+        worker.join()
+    assert response.status_code == 200
+    assert int(response.headers["X-Profile-Samples"]) > 0
+    stack, count = response.text.splitlines()[0].rsplit(" ", 1)
+    assert "busy_loop" in stack
+    assert int(count) > 0
+
+    response = client.post("/admin/profile?seconds=0.1&route=/missing", headers=headers)
+    assert response.status_code == 404
+
+
+def test_warehouse_stats_maintained_incrementally():
+    """
+    Тест итогов складов при создании, переносе, изменении остатка, загрузке и удалении продуктов.
+    """
+    headers = auth_headers()
+    first_id, second_id = (
+        client.post(
+            "/warehouses/",
+            json={"name": f"Stats Warehouse {i}", "location": "Test Location"},
+            headers=headers,
+        ).json()["id"]
+        for i in range(2)
+    )
+
+    def stats(warehouse_id):
+        response = client.get(f"/warehouses/{warehouse_id}/stats", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        return data["product_count"], data["total_quantity"]
+
+    assert stats(first_id) == (0, 0)
+    product_id = client.post(
+        "/products/",
+        json={"name": "Stats Product", "quantity": 10, "warehouse_id": first_id},
+        headers=headers,
+    ).json()["id"]
+    client.post(
+        "/products/",
+        json={"name": "Other Product", "quantity": 4, "warehouse_id": first_id},
+        headers=headers,
+    )
+    assert stats(first_id) == (2, 14)
+
+    client.put(
+        f"/products/{product_id}",
+        json={"name": "Stats Product", "quantity": 12, "warehouse_id": second_id},
+        headers=headers,
+    )
+    assert stats(first_id) == (1, 4)
+    assert stats(second_id) == (1, 12)
+
+    client.post(f"/products/{product_id}/adjust", json={"delta": -2}, headers=headers)
+    assert stats(second_id) == (1, 10)
+
+    response = client.post(
+        "/products/bulk?upsert=true",
+        json=[
+            {"id": product_id, "name": "Stats Product", "quantity": 1, "warehouse_id": first_id},
+            {"name": "Bulk Product", "quantity": 6, "warehouse_id": second_id},
+        ],
+        headers=headers,
+    )
+    assert response.json()["written"] == 2
+    assert stats(first_id) == (2, 5)
+    assert stats(second_id) == (1, 6)
+
+    client.delete(f"/products/{product_id}", headers=headers)
+    assert stats(first_id) == (1, 4)
+
+    with count_queries() as statements:
+        response = client.get("/warehouses/stats", headers=headers)
+    assert len(statements) == 1
+    assert response.json() == [
+        {"warehouse_id": first_id, "product_count": 1, "total_quantity": 4},
+        {"warehouse_id": second_id, "product_count": 1, "total_quantity": 6},
+    ]
+    assert client.get("/warehouses/999/stats", headers=headers).status_code == 404
+
+
+def test_migrate_fills_warehouse_stock(tmp_path):
+    """
+    Тест заполнения итогов складов при создании таблицы warehouse_stock на существующей базе.
+    """
+    from migrations import migrate
+
+    file_engine = create_db_engine(f"sqlite:///{tmp_path / 'stock.db'}")
+    with file_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE warehouses (id INTEGER PRIMARY KEY, name VARCHAR, location VARCHAR)"
+        )
+        connection.exec_driver_sql(
+            "CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR, "
+            "quantity INTEGER, warehouse_id INTEGER)"
+        )
+        connection.exec_driver_sql("INSERT INTO warehouses VALUES (1, 'A', 'L'), (2, 'B', 'L')")
+        connection.exec_driver_sql(
+            "INSERT INTO products VALUES (1, 'P1', 3, 1), (2, 'P2', 4, 1)"
+        )
+    assert "fill warehouse_stock" in migrate(file_engine)
+    with file_engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "SELECT warehouse_id, product_count, total_quantity FROM warehouse_stock "
+            "ORDER BY warehouse_id"
+        ).all()
+    assert [tuple(row) for row in rows] == [(1, 2, 7), (2, 0, 0)]
+    file_engine.dispose()
+
+
+def test_list_fast_json_matches_schema():
+    """
+    Тест быстрого пути сериализации списков: ответ совпадает с сериализацией схем pydantic.
+    """
+    from pydantic import TypeAdapter
+    import schemas
+
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "Склад JSON", "location": "Москва"},
+        headers=headers,
+    ).json()["id"]
+    client.post(
+        "/warehouses/",
+        json={"name": "Empty JSON Warehouse", "location": "Test Location"},
+        headers=headers,
+    )
+    for name in ("Товар \"1\"", "Product 2"):
+        client.post(
+            "/products/",
+            json={"name": name, "quantity": 3, "warehouse_id": warehouse_id},
+            headers=headers,
+        )
+
+    def dump(schema, objects):
+        adapter = TypeAdapter(schema)
+        return adapter.dump_json(adapter.validate_python(objects, from_attributes=True))
+
+    db = TestingSessionLocal()
+    try:
+        expected_products = dump(
+            list[schemas.Product], db.query(Product).order_by(Product.id).all()
+        )
+        expected_warehouses = dump(
+            list[schemas.Warehouse], db.query(Warehouse).order_by(Warehouse.id).all()
+        )
+    finally:
+        db.close()
+
+    assert client.get("/products/", headers=headers).content == expected_products
+    assert client.get("/warehouses/", headers=headers).content == expected_warehouses
+    response = client.get("/warehouses/?include_products=false", headers=headers)
+    assert [warehouse["products"] for warehouse in response.json()] == [[], []]
+    lines = client.get("/products/?stream=true", headers=headers).text.splitlines()
+    assert [json.loads(line) for line in lines] == json.loads(expected_products)
+
+
+def test_search_products():
+    """
+    Тест полнотекстового поиска продуктов: префиксы, регистр, склад, лимит и синхронизация.
+    """
+    from migrations import sync_search_index
+
+    with engine.begin() as connection:
+        sync_search_index(connection)
+    headers = auth_headers()
+    first_id, second_id = (
+        client.post(
+            "/warehouses/",
+            json={"name": f"Search Warehouse {i}", "location": "Test Location"},
+            headers=headers,
+        ).json()["id"]
+        for i in range(2)
+    )
+    names = [
+        ("Красный стол", first_id),
+        ("Red table", first_id),
+        ("Red red chair", second_id),
+        ("Blue chair", second_id),
+    ]
+    ids = {}
+    for name, warehouse_id in names:
+        ids[name] = client.post(
+            "/products/",
+            json={"name": name, "quantity": 1, "warehouse_id": warehouse_id},
+            headers=headers,
+        ).json()["id"]
+
+    def search(query):
+        response = client.get(f"/products/search?{query}", headers=headers)
+        assert response.status_code == 200
+        return [product["name"] for product in response.json()]
+
+    assert search("q=крас") == ["Красный стол"]
+    assert search("q=re") == ["Red red chair", "Red table"]
+    assert search("q=RED ch") == ["Red red chair"]
+    assert search(f"q=chair&warehouse_id={second_id}") == ["Blue chair", "Red red chair"]
+    assert search(f"q=chair&warehouse_id={second_id}&limit=1") == ["Blue chair"]
+    assert search(f"q=red&warehouse_id={first_id}") == ["Red table"]
+    assert search("q=%22%2A") == []
+
+    client.put(
+        f"/products/{ids['Blue chair']}",
+        json={"name": "Green sofa", "quantity": 1, "warehouse_id": second_id},
+        headers=headers,
+    )
+    client.delete(f"/products/{ids['Red table']}", headers=headers)
+    assert search("q=chair") == ["Red red chair"]
+    assert search("q=sofa") == ["Green sofa"]
+    assert search("q=table") == []
+
+    with capture_statements() as statements:
+        client.get("/products/search?q=sofa&limit=5", headers=headers)
+    assert any("MATCH" in statement for statement, _ in statements)
+
+    # Лучшее совпадение добавлено последним: ранжируются все совпадения, а не первые по rowid
+    with engine.begin() as connection:
+        connection.execute(Product.__table__.insert(), [
+            {"name": f"Lamp shade stand part {i}", "quantity": 1, "warehouse_id": first_id}
+            for i in range(300)
+        ] + [{"name": "Lamp", "quantity": 1, "warehouse_id": first_id}])
+    assert search("q=lamp&limit=1") == ["Lamp"]
+
+
+def test_token_claims_and_expiry():
+    """
+    Тест утверждений токена (sub, uid, iat, exp, jti, kid) и отказа для истекшего токена.
+    """
+    import jwt
+
+    headers = auth_headers(username="claimsuser")
+    token = headers["Authorization"].split()[1]
+    assert jwt.get_unverified_header(token)["kid"] == keyring.active_kid
+    claims = keyring.decode(token)
+    assert claims["sub"] == "claimsuser"
+    assert claims["exp"] > claims["iat"]
+    assert {"uid", "jti"} <= claims.keys()
+
+    expired = keyring.encode({**claims, "iat": 1, "exp": 2})
+    response = client.get("/products/", headers={"Authorization": f"Bearer {expired}"})
+    assert response.status_code == 401
+    legacy = jwt.encode({"sub": "claimsuser"}, config.SECRET_KEY, algorithm=config.ALGORITHM)
+    response = client.get("/products/", headers={"Authorization": f"Bearer {legacy}"})
+    assert response.status_code == 401
+
+
+def test_token_key_rotation(monkeypatch):
+    """
+    Тест ротации ключей: старые токены действуют до удаления своего ключа.
+    """
+    monkeypatch.setattr(keyring, "keys", dict(keyring.keys))
+    monkeypatch.setattr(keyring, "active_kid", keyring.active_kid)
+    old_kid = keyring.active_kid
+    old_headers = auth_headers(username="rotationuser")
+
+    keyring.rotate("rotated", "another_secret_key_for_rotation_tests")
+    new_headers = auth_headers(username="rotationuser")
+    new_token = new_headers["Authorization"].split()[1]
+    assert keyring.decode(new_token)["sub"] == "rotationuser"
+    assert client.get("/products/", headers=old_headers).status_code == 200
+    assert client.get("/products/", headers=new_headers).status_code == 200
+
+    keyring.retire(old_kid)
+    token_cache.clear()
+    assert client.get("/products/", headers=old_headers).status_code == 401
+    assert client.get("/products/", headers=new_headers).status_code == 200
+
+
+def test_stateless_verification_and_revocation(monkeypatch):
+    """
+    Тест проверки токенов без запросов к базе и отзыва токенов.
+    """
+    monkeypatch.setattr(config, "TOKEN_VERIFICATION", "stateless")
+    headers = auth_headers(username="statelessuser")
+    token = headers["Authorization"].split()[1]
+    assert client.get("/products/", headers=headers).status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        with count_queries() as statements:
+            user = crud.get_user_from_token(db, token, stateless=True)
+        assert statements == []
+        assert user.username == "statelessuser"
+
+        other_headers = auth_headers(username="statelessother")
+        assert client.post("/logout", headers=other_headers).status_code == 200
+        assert client.get("/products/", headers=other_headers).status_code == 401
+
+        crud.update_user_password(db, "statelessuser", "newpassword")
+        assert client.get("/products/", headers=headers).status_code == 401
+        response = client.post(
+            "/login", json={"username": "statelessuser", "password": "newpassword"}
+        )
+        fresh = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        assert client.get("/products/", headers=fresh).status_code == 200
+
+        # Отзывы, сделанные другим процессом, видны после обновления из базы
+        revocations.clear()
+        assert client.get("/products/", headers=other_headers).status_code == 401
+        assert client.get("/products/", headers=headers).status_code == 401
+    finally:
+        db.close()
+
+
+def test_cluster_channel_propagates_changes(tmp_path, monkeypatch):
+    """
+    Тест канала согласования процессов: изменения рассылаются другим процессам
+    и применяются ими, собственные сообщения пропускаются.
+    """
+    from cluster import cluster, InvalidationChannel
+    from versions import data_versions
+
+    path = str(tmp_path / "cluster.db")
+    sender, receiver = InvalidationChannel(path), InvalidationChannel(path)
+    monkeypatch.setattr(cluster, "channel", sender)
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/",
+        json={"name": "Cluster Warehouse", "location": "Test Location"},
+        headers=headers,
+    ).json()["id"]
+
+    messages, missing = receiver.receive()
+    assert [kind for _, kind, _ in messages] == ["user_tokens_changed", "warehouse_created"]
+    assert missing == []
+    assert sender.receive() == ([], [])
+
+    monkeypatch.setattr(cluster, "channel", receiver)
+    before = data_versions.products
+    sender.publish("products_changed", {
+        "event_type": "product.created",
+        "warehouse_ids": [warehouse_id],
+        "data": {},
+        "all_warehouses": False,
+    })
+    cluster.apply_pending()
+    assert data_versions.products == before + 1
+    assert cluster.stats() == {"enabled": True, "published": 0, "received": 3}
+
+
+def test_import_is_lazy_and_lifespan_syncs_schema(tmp_path):
+    """
+    Тест запуска: импорт main не обращается к базе данных и не загружает
+    passlib и uvicorn, а схема создается и процесс прогревается при старте приложения.
+    """
+    import subprocess
+    import sys
+
+    database = tmp_path / "startup.db"
+    script = (
+        "import json, os, sys\n"
+        "import main\n"
+        "imported = {'database': os.path.exists(os.environ['DATABASE_URL'][10:]),\n"
+        "            'passlib': 'passlib' in sys.modules, 'uvicorn': 'uvicorn' in sys.modules}\n"
+        "from fastapi.testclient import TestClient\n"
+        "with TestClient(main.create_app()) as startup_client:\n"
+        "    status = startup_client.get('/metrics').status_code\n"
+        "from sqlalchemy import inspect\n"
+        "tables = inspect(main.engine).get_table_names()\n"
+        "print(json.dumps({'imported': imported, 'status': status,\n"
+        "                  'schema': 'products_fts' in tables and 'warehouse_stock' in tables,\n"
+        "                  'passlib': 'passlib' in sys.modules}))\n"
+    )
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}",
+               MIGRATION_LOCK_PATH=str(tmp_path / "migrate.lock"))
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    assert result == {
+        "imported": {"database": False, "passlib": False, "uvicorn": False},
+        "status": 200,
+        "schema": True,
+        "passlib": True,
+    }
+
+
+def test_warm_up_steps():
+    """
+    Тест прогрева: все шаги выполняются на тестовой базе.
+    """
+    from warmup import warm_up
+
+    headers = auth_headers()
+    client.post("/warehouses/", json={"name": "Warm", "location": "Up"}, headers=headers)
+    timings = warm_up(engine, TestingSessionLocal, connections=2)
+    assert set(timings) == {"pool", "hashing", "queries"}
+
+
+def test_export_formats_and_restore():
+    """
+    Тест полной выгрузки во всех форматах и восстановления из нее.
+    """
+    import csv
+    import gzip
+    import io
+
+    from export import ColumnarDecoder
+
+    headers = auth_headers()
+    first = client.post(
+        "/warehouses/",
+        json={"name": "Export, \"main\"", "location": "Line\nbreak"},
+        headers=headers,
+    ).json()["id"]
+    second = client.post(
+        "/warehouses/", json={"name": "Склад", "location": ""}, headers=headers
+    ).json()["id"]
+    for name, quantity, warehouse_id in (
+        ("Plain", 1, first), ("Comma, \"quoted\"", 2, first), ("Юникод", 3, second),
+    ):
+        client.post(
+            "/products/",
+            json={"name": name, "quantity": quantity, "warehouse_id": warehouse_id},
+            headers=headers,
+        )
+    products = [
+        {
+            "id": p["id"], "name": p["name"],
+            "quantity": p["quantity"], "warehouse_id": p["warehouse_id"],
+        }
+        for p in client.get("/products/", headers=headers).json()
+    ]
+    warehouses = [
+        {"id": w["id"], "name": w["name"], "location": w["location"]}
+        for w in client.get("/warehouses/", headers=headers).json()
+    ]
+
+    response = client.get("/export/products", headers=headers)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == products
+
+    response = client.get("/export/warehouses?format=csv", headers=headers)
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [{**row, "id": int(row["id"])} for row in rows] == warehouses
+
+    response = client.get("/export/products?format=columnar&gzip=true", headers=headers)
+    assert response.headers["content-encoding"] == "gzip"
+    decoder = ColumnarDecoder()
+    records = []
+    for index in range(len(response.content)):
+        records.extend(decoder.feed(response.content[index:index + 1]))
+    decoder.close()
+    assert records == products
+
+    snapshots = {
+        kind: gzip.compress(client.get(f"/export/{kind}?format=columnar", headers=headers).content)
+        for kind in ("warehouses", "products")
+    }
+    csv_products = client.get("/export/products?format=csv", headers=headers).content
+    db = TestingSessionLocal()
+    try:
+        db.query(Product).delete()
+        db.query(WarehouseStock).delete()
+        db.query(Warehouse).delete()
+        db.commit()
+    finally:
+        db.close()
+    restore_headers = {
+        **headers, "Content-Type": "application/x-warehouse-columnar", "Content-Encoding": "gzip",
+    }
+    for kind in ("warehouses", "products"):
+        response = client.post(f"/import/{kind}", content=snapshots[kind], headers=restore_headers)
+        assert response.json() == {"written": len(locals()[kind]), "failed": 0, "errors": []}
+    response = client.post(
+        "/import/products", content=csv_products, headers={**headers, "Content-Type": "text/csv"}
+    )
+    assert response.json()["written"] == len(products)
+
+    assert client.get("/export/products", headers=headers).text.splitlines() == [
+        json.dumps(product, ensure_ascii=False, separators=(",", ":")) for product in products
+    ]
+    stats = client.get(f"/warehouses/{first}/stats", headers=headers).json()
+    assert stats == {"warehouse_id": first, "product_count": 2, "total_quantity": 3}
+
+    response = client.post(
+        "/import/products",
+        content=b"WHC1\x00\x00",
+        headers={**headers, "Content-Type": "application/x-warehouse-columnar"},
+    )
+    assert response.status_code == 400
+
+
+def test_group_commit_coalesces_concurrent_writes(tmp_path, monkeypatch):
+    """
+    Тест групповой фиксации: параллельные изменения применяются меньшим числом
+    транзакций, каждый вызов получает свой результат или свою ошибку.
+    """
+    from group_commit import GroupCommitWriter
+    from migrations import migrate
+    from schemas import ProductCreate, WarehouseCreate
+
+    file_engine = create_db_engine(f"sqlite:///{tmp_path / 'group.db'}")
+    migrate(file_engine)
+    file_engine.dispose()
+    # Все выполненные SQLite команды, включая COMMIT из connection.commit()
+    executed = []
+    event.listen(file_engine, "connect",
+                 lambda connection, record: connection.set_trace_callback(executed.append))
+    writer = GroupCommitWriter(sessionmaker(bind=file_engine), max_ops=64, window=0.05)
+    writer.start()
+    monkeypatch.setattr(crud, "group_writer", writer)
+    try:
+        warehouse = crud.create_warehouse(None, WarehouseCreate(name="Group", location="Commit"))
+        first = crud.create_product(
+            None, ProductCreate(name="First", quantity=1, warehouse_id=warehouse.id)
+        )
+        barrier = threading.Barrier(21)
+        results, errors = [], []
+
+        def create(index):
+            barrier.wait()
+            results.append(crud.create_product(
+                None, ProductCreate(name=f"P{index}", quantity=2, warehouse_id=warehouse.id)
+            ))
+
+        def overdraw():
+            barrier.wait()
+            try:
+                crud.adjust_product_quantity(None, first.id, -5)
+            except crud.InsufficientStock as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=create, args=(i,)) for i in range(20)]
+        threads.append(threading.Thread(target=overdraw))
+        del executed[:]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        writer.stop()
+
+    assert len({product.id for product in results}) == 20
+    assert [exc.product_id for exc in errors] == [first.id]
+    commits = executed.count("COMMIT")
+    # Изменения пакета фиксируются одним COMMIT, а SAVEPOINT выполняются внутри BEGIN
+    assert 1 <= commits < 21
+    assert executed.count("BEGIN IMMEDIATE") == commits
+    assert any(statement.startswith("RELEASE SAVEPOINT") for statement in executed)
+    with file_engine.connect() as connection:
+        stock = connection.exec_driver_sql(
+            "SELECT product_count, total_quantity FROM warehouse_stock"
+        ).one()
+    assert tuple(stock) == (21, 41)
+
+
+def test_group_commit_submit_after_stop(monkeypatch):
+    """
+    Тест изменения, поставленного после остановки потока записи: запрос
+    не зависает, а выполняет изменение в своей сессии.
+    """
+    from group_commit import GroupCommitWriter, WriterStopped
+    from schemas import WarehouseCreate
+
+    writer = GroupCommitWriter(TestingSessionLocal, window=0.01)
+    writer.start()
+    writer.stop()
+    with pytest.raises(WriterStopped):
+        writer.submit(lambda db: (None, None))
+
+    # Остановка между проверкой enabled и постановкой в очередь
+    monkeypatch.setattr(GroupCommitWriter, "enabled", property(lambda self: True))
+    monkeypatch.setattr(crud, "group_writer", writer)
+    db = TestingSessionLocal()
+    try:
+        warehouse = crud.create_warehouse(db, WarehouseCreate(name="Stopped", location="Writer"))
+        assert db.query(Warehouse).filter(Warehouse.id == warehouse.id).one().name == "Stopped"
+    finally:
+        db.close()
+
+
+def test_sqlite_write_after_concurrent_commit(tmp_path):
+    """
+    Тест записи после чтения в сессии, пока другая сессия зафиксировала изменение:
+    чтение не начинает транзакцию, поэтому запись не завершается database is locked.
+    """
+    file_engine = create_db_engine(f"sqlite:///{tmp_path / 'locks.db'}")
+    Base.metadata.create_all(bind=file_engine)
+    sessions = sessionmaker(bind=file_engine)
+    first, second = sessions(), sessions()
+    try:
+        assert first.query(Warehouse).all() == []
+        second.add(Warehouse(name="Second", location="B"))
+        second.commit()
+        first.add(Warehouse(name="First", location="A"))
+        first.commit()
+    finally:
+        first.close()
+        second.close()
+    with file_engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM warehouses").scalar() == 2
+
+
+def test_admission_control(monkeypatch):
+    """
+    Тест контроля допуска: классы запросов, приоритет очередей,
+    отказ при переполнении очереди и лимит запросов пользователя.
+    """
+    import asyncio
+    import main
+    from admission import AdmissionController, PriorityLimiter, classify
+
+    assert classify("GET", "/warehouses/") == "scan"
+    assert classify("GET", "/warehouses/", b"limit=10") == "read"
+    assert classify("GET", "/products/", b"limit=10&stream=true") == "scan"
+    assert classify("GET", "/export/products") == "scan"
+    assert classify("POST", "/products/1/adjust") == "write"
+    assert classify("POST", "/login") == "auth"
+    assert classify("GET", "/metrics") is None
+
+    async def queues():
+        limiter = PriorityLimiter(1, {"scan": 1}, queue_size=1, timeout=5)
+        assert await limiter.acquire("read") == "admitted"
+        scan = asyncio.ensure_future(limiter.acquire("scan"))
+        auth = asyncio.ensure_future(limiter.acquire("auth"))
+        await asyncio.sleep(0)
+        assert await limiter.acquire("scan") == "shed"
+        limiter.release("read")
+        assert await auth == "admitted"
+        assert not scan.done()
+        limiter.release("auth")
+        assert await scan == "admitted"
+        limiter.release("scan")
+        assert limiter.active == 0
+
+        short = PriorityLimiter(1, {}, queue_size=1, timeout=0.01)
+        await short.acquire("read")
+        assert await short.acquire("write") == "timeout"
+        assert short.waiting == 0
+
+    asyncio.run(queues())
+
+    controller = AdmissionController(rate=0.5, burst=2)
+    monkeypatch.setattr(config, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(main, "admission", controller)
+    limited_app = main.create_app(schema_sync="off", warmup=False)
+    limited_app.dependency_overrides[get_db] = override_get_db
+    limited = TestClient(limited_app)
+    headers = auth_headers()
+    other_headers = auth_headers("otheruser")
+    responses = [limited.get("/warehouses/?limit=10", headers=headers) for _ in range(3)]
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert responses[2].headers["Retry-After"] == "2"
+    assert limited.get("/warehouses/?limit=10", headers=other_headers).status_code == 200
+
+    text = limited.get("/metrics").text
+    assert 'admission_requests_total{class="read",outcome="rate_limited"} 1' in text
+    assert 'admission_requests_total{class="read",outcome="admitted"} 3' in text
+    assert "admission_in_flight 0" in text
+
+
+def test_read_replica_routing(tmp_path, monkeypatch):
+    """
+    Тест маршрутизации чтения: выбор реплики, запрет записи в реплику
+    и чтение своих изменений из основной базы.
+    """
+    import main
+    import replicas
+    from sqlalchemy.exc import OperationalError
+    from replicas import ReplicaRouter
+
+    path = tmp_path / "replica.db"
+    snapshot_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=snapshot_engine)
+    with snapshot_engine.begin() as connection:
+        connection.execute(Warehouse.__table__.insert().values(name="Replica", location="Copy"))
+    snapshot_engine.dispose()
+    url = f"sqlite:///file:{path}?mode=ro&uri=true"
+    router = ReplicaRouter([url, url], selection="least_busy", window=60)
+
+    first, first_db = router.open_session()
+    second, second_db = router.open_session()
+    assert {first, second} == {0, 1}
+    router.close_session(second, second_db)
+    third, third_db = router.open_session()
+    assert third == second
+    with pytest.raises(OperationalError):
+        first_db.execute(Warehouse.__table__.insert().values(name="Write", location="Denied"))
+    router.close_session(first, first_db)
+    router.close_session(third, third_db)
+
+    monkeypatch.setattr(replicas, "replica_router", router)
+    monkeypatch.setattr(main, "replica_router", router)
+    routed_app = main.create_app(schema_sync="off", warmup=False)
+    routed_app.dependency_overrides[get_db] = override_get_db
+    routed = TestClient(routed_app)
+    headers = auth_headers()
+    other_headers = auth_headers("otheruser")
+
+    def names(response):
+        return [warehouse["name"] for warehouse in response.json()]
+
+    assert names(routed.get("/warehouses/?limit=10", headers=headers)) == ["Replica"]
+    response = routed.post("/warehouses/", json={"name": "Primary", "location": "Main"},
+                           headers=headers)
+    assert response.status_code == 200
+    # Другой клиент читает реплику; ответ не кэшируется, пока реплика может отставать
+    response = routed.get("/warehouses/?limit=10", headers=other_headers)
+    assert names(response) == ["Replica"]
+    assert "ETag" not in response.headers
+    assert names(routed.get("/warehouses/?limit=10", headers=headers)) == ["Primary"]
+    stats = router.stats()
+    assert stats["primary_reads"] == 1
+    assert sum(replica["reads"] for replica in stats["replicas"]) == 5
+    assert all(replica["busy"] == 0 for replica in stats["replicas"])
+    for replica_engine in router.engines:
+        replica_engine.dispose()
+
+
+def test_response_compression():
+    """
+    Тест сжатия ответов: выбор кодировки, порог размера, кэш сжатых тел
+    по ETag и потоковое сжатие.
+    """
+    import zlib
+    from compression import StreamCompressor, compressed_cache, negotiate
+
+    encodings = ["zstd", "br", "gzip"]
+    assert negotiate("gzip;q=0.5, br", encodings) == "br"
+    assert negotiate("gzip, br, zstd", encodings) == "zstd"
+    assert negotiate("*;q=0.1, zstd;q=0", encodings) == "br"
+    assert negotiate("identity", encodings) is None
+
+    compressor = StreamCompressor("gzip", 6)
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(compressor.compress(b"first\n")) == b"first\n"
+    assert decompressor.decompress(compressor.finish(b"second\n")) == b"second\n"
+    assert decompressor.eof
+
+    headers = auth_headers()
+    warehouse_id = client.post(
+        "/warehouses/", json={"name": "Compressed", "location": "Remote"}, headers=headers
+    ).json()["id"]
+    for index in range(40):
+        client.post("/products/", json={
+            "name": f"Product {index}", "quantity": index, "warehouse_id": warehouse_id,
+        }, headers=headers)
+
+    gzip_headers = {**headers, "Accept-Encoding": "gzip"}
+    compressed_cache.clear()
+    first = client.get("/products/?limit=100", headers=gzip_headers)
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in first.headers["Vary"]
+    assert int(first.headers["Content-Length"]) < len(first.content)
+    assert len(first.json()) == 40
+    second = client.get("/products/?limit=100", headers=gzip_headers)
+    assert second.content == first.content
+    assert compressed_cache.hits == 1 and len(compressed_cache) == 1
+
+    plain = client.get("/products/?limit=100", headers={**headers, "Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.content == first.content
+    small = client.get(f"/warehouses/{warehouse_id}/stats", headers=gzip_headers)
+    assert "Content-Encoding" not in small.headers
+
+    streamed = client.get("/products/?stream=true", headers=gzip_headers)
+    assert streamed.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in streamed.headers
+    assert len(streamed.text.splitlines()) == 40
+
+
+def test_event_sequence_shared_by_cluster(tmp_path, monkeypatch):
+    """
+    Тест общей нумерации событий: номер события равен номеру сообщения канала,
+    события доставляются по возрастанию номеров, а номер из другого процесса
+    пригоден для возобновления.
+    """
+    import asyncio
+    from cluster import cluster, InvalidationChannel
+    from events import event_bus
+
+    path = str(tmp_path / "cluster.db")
+    sender, other_worker = InvalidationChannel(path), InvalidationChannel(path)
+    headers = auth_headers()
+    monkeypatch.setattr(cluster, "channel", sender)
+    event_bus.cluster_started(sender.last_seq)
+    try:
+        warehouse_id = client.post(
+            "/warehouses/", json={"name": "Shared", "location": "Sequence"}, headers=headers
+        ).json()["id"]
+        messages, _ = other_worker.receive()
+        assert [seq for seq, _, _ in messages] == [event_bus.sequence]
+
+        async def resume():
+            # Сообщение другого процесса с большим номером ждет применения меньшего
+            later = event_bus.sequence + 2
+            token = cluster.sequence.set(later)
+            event_bus.publish("product.created", [warehouse_id], {"id": 2})
+            cluster.sequence.reset(token)
+            event_bus.message_applied(later)
+            assert event_bus.sequence == later - 2
+            subscription, missed = event_bus.subscribe(last_seq=later - 2)
+            event_bus.message_applied(later - 1)
+            assert event_bus.sequence == later
+            delivered = await asyncio.wait_for(subscription.queue.get(), 1)
+            event_bus.unsubscribe(subscription)
+            # Клиент, уже получивший событие later, при возобновлении его не получает снова
+            resumed, resumed_missed = event_bus.subscribe(last_seq=later)
+            event_bus.unsubscribe(resumed)
+            return missed, delivered, resumed_missed
+
+        current = event_bus.sequence
+        missed, delivered, resumed_missed = asyncio.run(resume())
+        assert missed == [] and delivered["seq"] == current + 2
+        assert resumed_missed == []
+    finally:
+        event_bus.cluster_stopped()
+
+
+def test_event_without_channel_message_is_unnumbered():
+    """
+    Тест события, сообщение которого не записано в канал процессов: оно доставляется
+    без номера и не повторяет номер уже выданного события.
+    """
+    import asyncio
+    from events import EventBus
+
+    bus = EventBus()
+    bus.cluster_started(10)
+
+    async def run():
+        subscription, _ = bus.subscribe(last_seq=10)
+        bus.publish("warehouse.created", [1], {"id": 1})
+        event = await asyncio.wait_for(subscription.queue.get(), 1)
+        bus.unsubscribe(subscription)
+        return event, bus.subscribe(last_seq=10)[1]
+
+    event, missed = asyncio.run(run())
+    assert event["seq"] is None
+    assert bus.sequence == 10 and missed == []
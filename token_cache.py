@@ -0,0 +1,92 @@
+"""
+Кэш аутентифицированных пользователей.
+Хранит соответствие JWT токена и пользователя, чтобы не выполнять
+запрос к базе данных при каждом обращении к защищенному маршруту.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from config import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+
+
+class TokenCache:
+    """
+    Ограниченный по размеру LRU-кэш с вытеснением по времени жизни (TTL).
+    Ключ - токен, значение - пользователь, отсоединенный от сессии.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        """
+        Получение пользователя по токену.
+        Возвращает None, если записи нет или срок ее жизни истек.
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return user
+
+    def set(self, token: str, user):
+        """
+        Сохранение пользователя для токена.
+        При переполнении вытесняется самая давно использованная запись.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        """
+        Удаление всех записей пользователя.
+        Вызывается при создании, удалении пользователя и смене пароля.
+        """
+        with self._lock:
+            stale = [token for token, (user, _) in self._entries.items()
+                     if user.username == username]
+            for token in stale:
+                del self._entries[token]
+
+    def clear(self):
+        """
+        Полная очистка кэша и счетчиков.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Счетчики попаданий и промахов кэша.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+token_cache = TokenCache()
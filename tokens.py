@@ -0,0 +1,203 @@
+"""
+Выпуск и проверка JWT токенов.
+Keyring хранит ключи подписи с идентификаторами (kid): новые токены подписываются
+активным ключом, а токены, подписанные прежними ключами, остаются действительными,
+пока их ключ не удален. RevocationList хранит отозванные токены в памяти
+(фильтр Блума по jti и время отзыва всех токенов пользователя) и периодически
+обновляется из таблицы revoked_tokens, поэтому проверка токена не требует
+запроса к базе данных.
+"""
+import hashlib
+import math
+import secrets
+import threading
+import time
+
+import jwt
+from jwt.exceptions import InvalidTokenError
+from sqlalchemy.orm import Session
+
+from config import (
+    ALGORITHM, JWT_KEYS, JWT_ACTIVE_KID, ACCESS_TOKEN_EXPIRE_SECONDS,
+    REVOCATION_REFRESH_SECONDS, REVOCATION_FALSE_POSITIVE_RATE,
+)
+from models import RevokedToken
+
+# Обязательные утверждения токена
+REQUIRED_CLAIMS = ["sub", "uid", "iat", "exp", "jti"]
+
+
+class Keyring:
+    """
+    Набор ключей подписи с идентификаторами и активным ключом для новых токенов.
+    """
+
+    def __init__(self, keys: dict, active_kid: str, algorithm: str = ALGORITHM):
+        if active_kid not in keys:
+            raise ValueError(f"Активный ключ {active_kid} отсутствует в наборе ключей")
+        self.keys = dict(keys)
+        self.active_kid = active_kid
+        self.algorithm = algorithm
+        self._lock = threading.Lock()
+
+    def rotate(self, kid: str, secret: str):
+        """
+        Добавление нового ключа и выпуск последующих токенов с ним.
+        Прежние ключи остаются для проверки ранее выданных токенов.
+        """
+        with self._lock:
+            self.keys = {**self.keys, kid: secret}
+            self.active_kid = kid
+
+    def retire(self, kid: str):
+        """
+        Удаление ключа: токены, подписанные им, перестают проходить проверку.
+        """
+        with self._lock:
+            if kid == self.active_kid:
+                raise ValueError("Нельзя удалить активный ключ")
+            self.keys = {name: key for name, key in self.keys.items() if name != kid}
+
+    def encode(self, claims: dict) -> str:
+        """
+        Подпись утверждений активным ключом; kid передается в заголовке токена.
+        """
+        kid = self.active_kid
+        return jwt.encode(claims, self.keys[kid], algorithm=self.algorithm, headers={"kid": kid})
+
+    def decode(self, token: str) -> dict:
+        """
+        Проверка подписи, срока действия и наличия обязательных утверждений.
+        Вызывает InvalidTokenError для недействительного токена.
+        """
+        key = self.keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise InvalidTokenError("Неизвестный ключ подписи")
+        return jwt.decode(
+            token, key, algorithms=[self.algorithm], options={"require": REQUIRED_CLAIMS}
+        )
+
+
+def issue_claims(user_id: int, username: str, ttl: float = ACCESS_TOKEN_EXPIRE_SECONDS) -> dict:
+    """
+    Утверждения нового токена: пользователь, время выпуска и истечения, уникальный id.
+    Время выпуска хранится с миллисекундами, чтобы отзыв всех токенов пользователя
+    (например, при смене пароля) не затрагивал токены, выданные после него.
+    """
+    issued_at = math.floor(time.time() * 1000) / 1000
+    return {
+        "sub": username,
+        "uid": user_id,
+        "iat": issued_at,
+        "exp": int(issued_at + ttl),
+        "jti": secrets.token_hex(16),
+    }
+
+
+class BloomFilter:
+    """
+    Фильтр Блума для строк: не дает ложноотрицательных ответов,
+    ложноположительные ответы возникают с вероятностью error_rate.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = REVOCATION_FALSE_POSITIVE_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        """
+        Добавление строки.
+        """
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class RevocationList:
+    """
+    Отозванные токены в памяти процесса.
+    Отзывы из других процессов становятся видны после обновления из базы данных,
+    которое выполняется не чаще одного раза в refresh_seconds.
+    """
+
+    def __init__(self, refresh_seconds: float = REVOCATION_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.confirmations = 0
+        self._lock = threading.Lock()
+        self._filter = BloomFilter(0)
+        self._users = {}
+        self._loaded_at = None
+
+    def refresh(self, db: Session):
+        """
+        Загрузка действующих отзывов из таблицы revoked_tokens.
+        """
+        rows = (
+            db.query(RevokedToken.jti, RevokedToken.user_id, RevokedToken.revoked_before)
+            .filter(RevokedToken.expires_at > time.time())
+            .all()
+        )
+        jtis = [jti for jti, _, _ in rows if jti is not None]
+        bloom = BloomFilter(len(jtis) * 2)
+        for jti in jtis:
+            bloom.add(jti)
+        users = {}
+        for _, user_id, revoked_before in rows:
+            if user_id is not None and revoked_before is not None:
+                users[user_id] = max(users.get(user_id, 0), revoked_before)
+        with self._lock:
+            self._filter = bloom
+            self._users = users
+            self._loaded_at = time.monotonic()
+
+    def add(self, jti: str = None, user_id: int = None, revoked_before: float = None):
+        """
+        Немедленный учет отзыва, выполненного в этом процессе.
+        """
+        with self._lock:
+            if jti is not None:
+                self._filter.add(jti)
+            if user_id is not None and revoked_before is not None:
+                self._users[user_id] = max(self._users.get(user_id, 0), revoked_before)
+
+    def clear(self):
+        """
+        Сброс состояния; следующая проверка загрузит отзывы заново.
+        """
+        with self._lock:
+            self._filter = BloomFilter(0)
+            self._users = {}
+            self._loaded_at = None
+
+    def is_revoked(self, db: Session, claims: dict) -> bool:
+        """
+        Проверка отзыва токена по его утверждениям.
+        Запрос к базе данных выполняется только при периодическом обновлении
+        и для подтверждения положительного ответа фильтра Блума.
+        """
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at >= self.refresh_seconds:
+            self.refresh(db)
+        revoked_before = self._users.get(claims["uid"])
+        if revoked_before is not None and claims["iat"] < revoked_before:
+            return True
+        if claims["jti"] not in self._filter:
+            return False
+        self.confirmations += 1
+        revoked = db.query(RevokedToken.id).filter(RevokedToken.jti == claims["jti"]).first()
+        return revoked is not None
+
+
+keyring = Keyring(JWT_KEYS, JWT_ACTIVE_KID)
+revocations = RevocationList()
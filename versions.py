@@ -0,0 +1,81 @@
+"""
+Счетчики версий данных для условных GET запросов.
+Функции записи в crud.py увеличивают версии, а маршруты чтения строят из них
+слабые ETag и отвечают 304 без обращения к базе данных.
+"""
+import hashlib
+import threading
+import uuid
+
+
+class DataVersions:
+    """
+    Монотонные версии таблиц складов и продуктов, а также версии отдельных складов.
+    Версия склада меняется при изменении его продуктов.
+    """
+
+    def __init__(self):
+        # Идентификатор запуска, чтобы ETag не совпадали после перезапуска процесса
+        self.epoch = uuid.uuid4().hex[:8]
+        self.warehouses = 0
+        self.products = 0
+        self._all_warehouses = 0
+        self._warehouse = {}
+        self._lock = threading.Lock()
+
+    def bump_warehouses(self, warehouse_ids=()):
+        """
+        Изменение таблицы складов.
+        """
+        with self._lock:
+            self.warehouses += 1
+            self._bump_each(warehouse_ids)
+
+    def bump_products(self, warehouse_ids=(), all_warehouses: bool = False):
+        """
+        Изменение таблицы продуктов и продуктов указанных складов.
+        all_warehouses используется, когда затронутые склады неизвестны.
+        """
+        with self._lock:
+            self.products += 1
+            if all_warehouses:
+                self._all_warehouses += 1
+            self._bump_each(warehouse_ids)
+
+    def _bump_each(self, warehouse_ids):
+        for warehouse_id in warehouse_ids:
+            if warehouse_id is not None:
+                self._warehouse[warehouse_id] = self._warehouse.get(warehouse_id, 0) + 1
+
+    def warehouse(self, warehouse_id: int) -> str:
+        """
+        Версия отдельного склада вместе с его продуктами.
+        """
+        with self._lock:
+            return f"{self._all_warehouses}.{self._warehouse.get(warehouse_id, 0)}"
+
+
+def make_etag(*parts) -> str:
+    """
+    Слабый ETag из версий данных и параметров запроса.
+    """
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{data_versions.epoch}-{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Слабое сравнение ETag из заголовка If-None-Match (RFC 9110).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in if_none_match.split(",")
+    )
+
+
+data_versions = DataVersions()
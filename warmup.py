@@ -0,0 +1,69 @@
+"""
+Прогрев процесса при запуске приложения (lifespan в main.py).
+Соединения пула открываются заранее, бэкенд bcrypt и список отозванных токенов
+загружаются до первого запроса, а типовые запросы чтения заполняют кэш
+скомпилированных SQL выражений SQLAlchemy и страниц базы данных.
+Так первые запросы клиентов после запуска или перезапуска рабочего процесса
+не платят за эту инициализацию.
+"""
+import logging
+import time
+
+import crud
+from config import DB_POOL_SIZE, MAX_PAGE_SIZE
+from database import engine, SessionLocal
+from hashing import load_hashing_backend
+from tokens import revocations
+
+logger = logging.getLogger("warehouse.startup")
+
+
+def warm_pool(bind=engine, connections: int = DB_POOL_SIZE) -> int:
+    """
+    Открытие connections соединений пула одновременно и возврат их в пул.
+    """
+    opened = []
+    try:
+        for _ in range(connections):
+            connection = bind.connect()
+            opened.append(connection)
+            connection.exec_driver_sql("SELECT 1")
+    finally:
+        for connection in opened:
+            connection.close()
+    return len(opened)
+
+
+def warm_queries(session_factory=SessionLocal):
+    """
+    Типовые запросы чтения и загрузка отозванных токенов.
+    """
+    db = session_factory()
+    try:
+        revocations.refresh(db)
+        crud.get_warehouse_summaries(db, limit=MAX_PAGE_SIZE).all()
+        crud.get_warehouses_stats(db, limit=MAX_PAGE_SIZE).all()
+        crud.get_product_rows(db, limit=MAX_PAGE_SIZE).all()
+    finally:
+        db.close()
+
+
+def warm_up(bind=engine, session_factory=SessionLocal, connections: int = DB_POOL_SIZE) -> dict:
+    """
+    Выполнение всех шагов прогрева.
+    Возвращает длительность каждого шага в секундах.
+    """
+    steps = (
+        ("pool", lambda: warm_pool(bind, connections)),
+        ("hashing", load_hashing_backend),
+        ("queries", lambda: warm_queries(session_factory)),
+    )
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+    logger.info("Прогрев завершен: %s", {
+        name: f"{seconds * 1000:.1f} ms" for name, seconds in timings.items()
+    })
+    return timings